@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+ASGI server for the Moving App API (uvicorn), with non-blocking M-Pesa calls
+Usage: python asgi.py [--bind HOST:PORT] [--workers N]
+   or: uvicorn asgi:application
+
+Booking with M-Pesa, wallet deposits, payment status checks and withdrawals
+spend nearly all their time waiting on Daraja. Here each of those requests is
+dispatched to Flask twice on a small pool (WEB_PAYMENT_THREADS): once to
+validate and record the payment, once to apply Daraja's answer. The Daraja
+call in between is awaited on the event loop with httpx, so a payment that is
+waiting holds no thread and no database connection, and one process can keep
+hundreds in flight (up to DARAJA_MAX_CONNECTIONS).
+
+Every other route runs as plain WSGI on a second pool (WEB_THREADS). An SSE
+stream uses that pool only to subscribe and load its replay; its events are
+then awaited on the event loop, so open streams hold no thread and thousands
+of watchers do not slow other requests. The same per-process in-memory state
+as under serve.py applies to --workers, and several workers need
+AUTH_TOKEN_SECRET and QUOTE_SECRET set (also when starting uvicorn directly
+with --workers), since each worker would otherwise sign with its own key.
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+import movers
+
+WEB_THREADS = int(os.getenv('WEB_THREADS', '16'))
+WEB_PAYMENT_THREADS = int(os.getenv('WEB_PAYMENT_THREADS', '8'))
+PAYMENT_ENDPOINTS = {'book_driver_with_mpesa', 'mpesa_stk_push', 'check_mpesa_status', 'driver_withdraw'}
+
+flask_app = movers.create_app()
+url_adapter = flask_app.url_map.bind('localhost')
+wsgi_pool = ThreadPoolExecutor(WEB_THREADS, thread_name_prefix='wsgi')
+payment_pool = ThreadPoolExecutor(WEB_PAYMENT_THREADS, thread_name_prefix='payment-db')
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope and its complete body"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        key = name.decode('latin1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def start_wsgi(environ, buffered=False):
+    """Call the Flask app (pool thread); bodies with a Content-Length are read here in full"""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]),
+                      [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]]
+
+    body = flask_app(environ, start_response)
+    status, headers = started
+    if not buffered and not any(name == b'content-length' for name, _ in headers):
+        return status, headers, body  # A stream; the caller pulls chunks as they come
+    try:
+        return status, headers, [b''.join(body)]
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def wsgi_request(scope, receive, send):
+    """Any route other than the payment ones: the Flask app on a pool thread"""
+    loop = asyncio.get_running_loop()
+    environ = build_environ(scope, await read_body(receive))
+    status, headers, body = await loop.run_in_executor(wsgi_pool, start_wsgi, environ)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    if isinstance(body, list):
+        await send({'type': 'http.response.body', 'body': body[0]})
+        return
+    if movers.SSE_STREAM_KEY in environ:
+        await sse_stream(receive, send, body, *environ[movers.SSE_STREAM_KEY])
+        return
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    chunks = iter(body)
+    try:
+        while not disconnected.done():
+            chunk = await loop.run_in_executor(wsgi_pool, next, chunks, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+    finally:
+        disconnected.cancel()
+        if hasattr(body, 'close'):
+            await loop.run_in_executor(wsgi_pool, body.close)  # Ends SSE subscriptions
+
+async def sse_stream(receive, send, body, subscription, replay):
+    """Events awaited on the loop; the unused WSGI body is only closed, which ends the subscription"""
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    chunks = subscription.astream(replay, heartbeat=movers.STREAM_HEARTBEAT_SECONDS)
+    try:
+        while True:
+            chunk = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait((chunk, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not chunk.done():
+                chunk.cancel()
+                await asyncio.wait((chunk,))  # Let the generator unwind before it is closed
+                break
+            try:
+                text = chunk.result()
+            except StopAsyncIteration:
+                await send({'type': 'http.response.body'})
+                break
+            await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+    finally:
+        disconnected.cancel()
+        await chunks.aclose()
+        body.close()
+
+async def payment_request(scope, receive, send):
+    """Prepare on the pool, await Daraja on the loop, then finalize on the pool"""
+    loop = asyncio.get_running_loop()
+    body = await read_body(receive)
+    environ = build_environ(scope, body)
+    environ[movers.DARAJA_DEFER_KEY] = True
+    status, headers, content = await loop.run_in_executor(payment_pool, start_wsgi, environ, True)
+    plan = environ.get(movers.DARAJA_PLAN_KEY)
+    if plan is not None:
+        reply = await movers.daraja_client.call_async(plan['call'])
+        tally = environ[movers.REQUEST_TALLY_KEY]  # Latency and SQL work span both dispatches
+        environ = build_environ(scope, body)
+        environ[movers.DARAJA_RESUME_KEY] = (plan, reply)
+        environ[movers.REQUEST_TALLY_KEY] = tally
+        status, headers, content = await loop.run_in_executor(payment_pool, start_wsgi, environ, True)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content[0]})
+
+def is_payment_request(scope):
+    try:
+        endpoint, _ = url_adapter.match(scope['path'], scope['method'])
+    except HTTPException:
+        return False
+    return endpoint in PAYMENT_ENDPOINTS
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await movers.daraja_client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if is_payment_request(scope):
+            await payment_request(scope, receive, send)
+        else:
+            await wsgi_request(scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bind', default=os.getenv('WEB_BIND', '0.0.0.0:5000'))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', '1')))
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Each uvicorn worker imports the app afresh, so a random per-process key would make
+    # tokens and quotes issued by one worker fail on the others
+    unset = [name for name in ('AUTH_TOKEN_SECRET', 'QUOTE_SECRET') if not getattr(movers, name)]
+    if args.workers > 1 and unset:
+        sys.exit(f"--workers {args.workers} needs {' and '.join(unset)} set, so every worker signs with the same key")
+    if args.workers > 1:
+        # Only the worker holding this lock runs the dispatch loop
+        os.makedirs(os.path.join(here, 'instance'), exist_ok=True)
+        os.environ.setdefault('DISPATCH_LOCK_FILE', os.path.join(here, 'instance', 'dispatch.lock'))
+    host, port = args.bind.rsplit(':', 1)
+    print(f"[SERVER] ASGI {args.workers} worker(s), {WEB_THREADS} threads + "
+          f"{WEB_PAYMENT_THREADS} payment threads on {args.bind}")
+    uvicorn.run('asgi:application', host=host, port=int(port), workers=args.workers, app_dir=here,
+                lifespan='on', access_log=bool(os.getenv('WEB_ACCESS_LOG')), log_level='warning')
@@ -0,0 +1,109 @@
+"""
+Signed, expiring access tokens and a cache of the accounts behind them
+A token carries the user id, role and driver id, signed with HMAC and
+stamped with its issue time, so checking a request's identity and role
+costs one HMAC and a small JSON decode, with no database read. Anything
+the token does not carry (name, phone, ban status) comes from
+PrincipalCache, an LRU map of recently seen accounts with a short TTL that
+is also cleared for an account as soon as its row changes.
+"""
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from itsdangerous import BadSignature, SignatureExpired, TimestampSigner
+
+class AuthError(ValueError):
+    pass
+
+class Principal:
+    """Who a request is made by, as stated in its token"""
+    __slots__ = ('user_id', 'role', 'driver_id')
+
+    def __init__(self, user_id, role, driver_id=None):
+        self.user_id = user_id
+        self.role = role
+        self.driver_id = driver_id
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+class TokenSigner:
+    """Issues and verifies access tokens (same encoding as pricing.QuoteSigner)"""
+
+    def __init__(self, secret_key, ttl_seconds=43200):
+        self.ttl_seconds = ttl_seconds
+        self._signer = TimestampSigner(secret_key, salt='access-token')
+
+    def issue(self, user_id, role, driver_id=None):
+        fields = {'u': user_id, 'r': role}
+        if driver_id is not None:
+            fields['d'] = driver_id
+        payload = base64.urlsafe_b64encode(json.dumps(fields, separators=(',', ':')).encode())
+        return self._signer.sign(payload.rstrip(b'=')).decode()
+
+    def verify(self, token):
+        """Return the token's Principal, or raise AuthError"""
+        try:
+            payload = self._signer.unsign(token, max_age=self.ttl_seconds)
+        except SignatureExpired:
+            raise AuthError('Session has expired, please log in again')
+        except BadSignature:
+            raise AuthError('Invalid access token')
+        fields = json.loads(base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4)))
+        return Principal(fields['u'], fields['r'], fields.get('d'))
+
+class PrincipalCache:
+    """TTL + LRU map of user id -> account profile dict, filled by load(user_id)
+
+    load returns None for unknown users; that is not cached, so an account
+    created after a miss is found on the next lookup.
+    """
+
+    def __init__(self, load, ttl_seconds=60.0, max_entries=4096):
+        self.load = load
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user id -> (expires_at, profile)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, user_id, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        profile = self.load(user_id)  # Outside the lock; two threads may load the same user once each
+        if profile is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl_seconds, profile)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                if self._entries.pop(user_id, None) is not None:
+                    self.invalidated += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidated': self.invalidated,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the performance-sensitive parts of the backend
+Usage: python benchmarks.py [driver-search] [pricing] [dispatch] [serving] [--drivers N] [--queries N] [--bookings N]
+       python benchmarks.py serving [--workers 1,2,4] [--threads N] [--clients N] [--duration S]
+       python benchmarks.py payments [--clients N] [--daraja-latency S] [--duration S]
+       python benchmarks.py json [--rows N]
+       python benchmarks.py auth [--queries N]
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Nairobi city centre, used as the centre of all synthetic fleets
+NAIROBI_LAT = -1.2921
+NAIROBI_LNG = 36.8219
+
+def random_point(spread_deg=0.5):
+    return (NAIROBI_LAT + random.uniform(-spread_deg, spread_deg),
+            NAIROBI_LNG + random.uniform(-spread_deg, spread_deg))
+
+def report(name, timings_ms):
+    """Print latency percentiles for a list of per-call timings"""
+    timings_ms = sorted(timings_ms)
+    p50 = timings_ms[len(timings_ms) // 2]
+    p99 = timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.99))]
+    print(f"  {name:<32} mean {statistics.mean(timings_ms):8.4f} ms   "
+          f"p50 {p50:8.4f} ms   p99 {p99:8.4f} ms")
+
+def bench_driver_search(args):
+    """Nearest-k driver lookups against a synthetic fleet"""
+    from geo_index import GridIndex
+
+    print("=" * 60)
+    print(f"Driver search: {args.drivers} drivers, {args.queries} queries")
+    print("=" * 60)
+
+    index = GridIndex()
+    start = time.perf_counter()
+    for driver_id in range(args.drivers):
+        index.upsert(driver_id, *random_point())
+    print(f"  Index build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for k, radius_km in [(10, 5.0), (20, 20.0)]:
+        timings = []
+        for _ in range(args.queries):
+            lat, lng = random_point(0.3)
+            start = time.perf_counter()
+            index.nearest(lat, lng, k=k, radius_km=radius_km)
+            timings.append((time.perf_counter() - start) * 1000)
+        report(f"nearest k={k} radius={radius_km:g}km", timings)
+
+    # Dense hotspot: thousands of candidates inside the search radius, served
+    # through the registry with the same candidate cap and deadline as the API
+    from driver_registry import DriverRecord, DriverRegistry
+    registry = DriverRegistry()
+    registry.rebuild(
+        DriverRecord(driver_id, driver_id, f'Driver {driver_id}', 'Van', f'KAA {driver_id}',
+                     latitude=lat, longitude=lng)
+        for driver_id, (lat, lng) in ((i, random_point(0.02)) for i in range(args.drivers // 5))
+    )
+    timings = []
+    for _ in range(args.queries):
+        lat, lng = random_point(0.01)
+        start = time.perf_counter()
+        registry.nearest(lat, lng, k=20, radius_km=5.0, max_candidates=5000,
+                         deadline=start + 0.005)
+        timings.append((time.perf_counter() - start) * 1000)
+    report(f"hotspot {len(registry)} drivers k=20", timings)
+
+def bench_pricing(args):
+    """Quote issuing for a search result page and quote validation at booking"""
+    from pricing import QuoteSigner, Tariff, VEHICLE_MULTIPLIERS
+
+    print("=" * 60)
+    print(f"Pricing: {args.queries} searches of 20 drivers")
+    print("=" * 60)
+
+    tariff = Tariff(500, 60, 500)
+    signer = QuoteSigner('benchmark-secret', ttl_seconds=300)
+    vehicles = list(VEHICLE_MULTIPLIERS)
+
+    timings, quote_ids = [], []
+    for _ in range(args.queries):
+        distance = random.uniform(1, 40)
+        demand = random.uniform(1.0, 1.5)
+        start = time.perf_counter()
+        for driver_id in range(20):
+            price = tariff.price(distance, vehicles[driver_id % len(vehicles)], demand)
+            quote_ids.append(signer.issue(driver_id=driver_id, price=price,
+                                          distance=round(distance, 2), promo_code=None))
+        timings.append((time.perf_counter() - start) * 1000)
+    report("price + sign 20 quotes", timings)
+    print(f"  Quotes per second: {len(quote_ids) / (sum(timings) / 1000):,.0f}")
+
+    timings = []
+    for quote_id in random.sample(quote_ids, min(len(quote_ids), args.queries)):
+        start = time.perf_counter()
+        signer.verify(quote_id)
+        timings.append((time.perf_counter() - start) * 1000)
+    report("verify quote at booking", timings)
+
+def bench_dispatch(args):
+    """One dispatch tick where every open booking has timed out and needs a new driver"""
+    from driver_registry import DriverRecord, DriverRegistry
+    from dispatch import DispatchEngine
+
+    fleet = args.drivers // 10
+    print("=" * 60)
+    print(f"Dispatch: {args.bookings} open bookings, {fleet} drivers")
+    print("=" * 60)
+
+    registry = DriverRegistry()
+    registry.rebuild(
+        DriverRecord(driver_id, driver_id, f'Driver {driver_id}', 'Van', f'KAA {driver_id}',
+                     ratings=random.uniform(3, 5), latitude=lat, longitude=lng)
+        for driver_id, (lat, lng) in ((i, random_point(0.2)) for i in range(fleet))
+    )
+    loads = {driver_id: random.randint(0, 2) for driver_id in range(fleet)}
+    now = time.time()
+    bookings = [(booking_id, random.randrange(fleet), *random_point(0.2), now - 600, 'Van')
+                for booking_id in range(args.bookings)]
+
+    timings = []
+    for _ in range(5):
+        engine = DispatchEngine(registry, accept_timeout=120, max_load=3)
+        start = time.perf_counter()
+        assignments = engine.plan(bookings, loads, now=now)
+        timings.append((time.perf_counter() - start) * 1000)
+    report("plan tick", timings)
+    print(f"  Reassigned {len(assignments)} of {len(bookings)} bookings")
+
+def seed_serving_database(database_url, drivers):
+    """Fill a scratch database with bookable drivers around Nairobi and one funded customer"""
+    os.environ['DATABASE_URL'] = database_url
+    # Shared with the servers started below, so tokens and quotes issued here are valid there
+    os.environ.setdefault('AUTH_TOKEN_SECRET', secrets.token_hex(32))
+    os.environ.setdefault('QUOTE_SECRET', secrets.token_hex(32))
+    from werkzeug.security import generate_password_hash
+    import movers
+
+    with movers.app.app_context():
+        movers.db.create_all()
+        password = generate_password_hash('benchmark')
+        users = [movers.User(name=f'Driver {i}', phone='0700000000', email=f'driver{i}@bench.local',
+                             password=password, role='driver') for i in range(drivers)]
+        movers.db.session.add_all(users)
+        movers.db.session.flush()
+        for user in users:
+            lat, lng = random_point(0.2)
+            movers.db.session.add(movers.Driver(
+                user_id=user.id, vehicle_type=random.choice(['SUV', 'Van', 'Truck']),
+                license_plate=f'KAA {user.id}', is_available=True, is_verified=True,
+                latitude=lat, longitude=lng, live_location=f'{lat},{lng}'
+            ))
+        customer = movers.User(name='Customer', phone='0711111111', email='customer@bench.local',
+                               password=password, balance=1e12)
+        movers.db.session.add(customer)
+        movers.db.session.commit()
+        return customer.id
+
+def customer_headers(customer_id):
+    """Authorization header for the seeded customer, signed with the shared AUTH_TOKEN_SECRET"""
+    import movers
+
+    return {'Authorization': f"Bearer {movers.token_signer.issue(customer_id, 'user')}"}
+
+def wait_for_server(session, base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if session.get(base_url + '/', timeout=1).ok:
+                return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+def search_body():
+    pickup, dropoff = random_point(0.15), random_point(0.15)
+    return {'pickup_location': 'Pickup', 'dropoff_location': 'Dropoff',
+            'pickup_lat': pickup[0], 'pickup_lng': pickup[1],
+            'dropoff_lat': dropoff[0], 'dropoff_lng': dropoff[1]}
+
+def load_test(base_url, make_request, clients, duration):
+    """Run `clients` keep-alive clients for `duration` seconds
+
+    Returns per-request timings, the error count and the seconds until the last
+    request came back (requests still queued at the deadline are waited for).
+    """
+    import requests
+
+    timings, errors = [], []
+    started = time.time()
+    stop_at = started + duration
+
+    def client():
+        session = requests.Session()
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            try:
+                ok = make_request(session, base_url)
+            except Exception:
+                ok = False
+            (timings if ok else errors).append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, len(errors), time.time() - started
+
+def bench_serving(args):
+    """Requests per second through serve.py (gunicorn) on the search and booking endpoints"""
+    import requests
+
+    fleet = min(args.drivers, 2000)
+    worker_counts = [int(count) for count in args.workers.split(',')]
+    print("=" * 60)
+    print(f"Serving: {fleet} drivers, {args.clients} clients, {args.duration:g}s per endpoint, "
+          f"{args.threads} threads per worker, {os.cpu_count()} CPU(s)")
+    print("=" * 60)
+
+    scratch = tempfile.mkdtemp(prefix='movers-bench-')
+    database_url = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    customer_id = seed_serving_database(database_url, fleet)
+    headers = customer_headers(customer_id)
+    env = dict(os.environ, DATABASE_URL=database_url, DISPATCH_ENABLED='false',
+               DISPATCH_LOCK_FILE=os.path.join(scratch, 'dispatch.lock'))
+
+    def search(session, base_url):
+        return session.post(base_url + '/api/user/search-drivers', json=search_body(), headers=headers,
+                            timeout=10).ok
+
+    def book(session, base_url):
+        body = search_body()
+        driver = random.choice(quotes)
+        body.update(user_id=customer_id, driver_id=driver['driver_id'], quote_id=driver['quote_id'])
+        return session.post(base_url + '/api/user/book-driver', json=body, headers=headers, timeout=10).ok
+
+    for port, workers in enumerate(worker_counts, start=5600):
+        base_url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(
+            [sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}',
+             '--workers', str(workers), '--threads', str(args.threads)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            session = requests.Session()
+            if not wait_for_server(session, base_url):
+                print(f"  {workers} worker(s): server did not start")
+                continue
+            quotes = session.post(base_url + '/api/user/search-drivers', json=search_body(),
+                                  headers=headers).json()['drivers']
+            for name, make_request in [('search-drivers', search), ('book-driver', book)]:
+                timings, errors, elapsed = load_test(base_url, make_request, args.clients, args.duration)
+                print(f"  {workers} worker(s) {name:<15} {len(timings) / elapsed:8.1f} req/s"
+                      f"   errors {errors}")
+                if timings:
+                    report(f"{workers} worker(s) {name} latency", timings)
+        finally:
+            server.terminate()
+            server.wait()
+
+def start_daraja_stub(latency):
+    """Local stand-in for Daraja: instant tokens, STK Push answered after `latency` seconds"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class DarajaStub(BaseHTTPRequestHandler):
+        def reply(self, body):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.reply({'access_token': 'bench-token', 'expires_in': '3599'})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency)
+            self.reply({'ResponseCode': '0', 'ResponseDescription': 'Success',
+                        'CheckoutRequestID': f'ws_CO_{random.getrandbits(48):x}', 'MerchantRequestID': 'bench'})
+
+        def log_message(self, *args):
+            pass
+
+    class StubServer(ThreadingHTTPServer):
+        request_queue_size = 1024
+        daemon_threads = True
+
+    server = StubServer(('127.0.0.1', 0), DarajaStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def bench_payments(args):
+    """Wallet STK Push deposits in flight at once: serve.py (threads) vs asgi.py (async Daraja calls)"""
+    import requests
+
+    print("=" * 60)
+    print(f"Payments: {args.clients} clients, Daraja answering in {args.daraja_latency:g}s, "
+          f"{args.duration:g}s per server, {args.threads} threads, {os.cpu_count()} CPU(s)")
+    print("=" * 60)
+
+    stub = start_daraja_stub(args.daraja_latency)
+    scratch = tempfile.mkdtemp(prefix='movers-bench-')
+    database_url = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    customer_id = seed_serving_database(database_url, 10)
+    headers = customer_headers(customer_id)
+    env = dict(os.environ, DATABASE_URL=database_url, DISPATCH_ENABLED='false',
+               MPESA_API_BASE=f'http://127.0.0.1:{stub.server_port}',
+               MPESA_CONSUMER_KEY='bench', MPESA_CONSUMER_SECRET='bench', WEB_THREADS=str(args.threads))
+
+    def deposit(session, base_url):
+        response = session.post(base_url + '/api/mpesa/stk-push', timeout=120, headers=headers, json={
+            'user_id': customer_id, 'amount': 10, 'phone_number': '0712345678'
+        })
+        return response.ok
+
+    servers = [('sync (serve.py)', 'serve.py'), ('async (asgi.py)', 'asgi.py')]
+    for port, (name, script) in enumerate(servers, start=5700):
+        base_url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(
+            [sys.executable, script, '--bind', f'127.0.0.1:{port}'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            if not wait_for_server(requests.Session(), base_url):
+                print(f"  {name}: server did not start")
+                continue
+            timings, errors, elapsed = load_test(base_url, deposit, args.clients, args.duration)
+            print(f"  {name:<16} {len(timings) / elapsed:8.1f} payments/s   errors {errors}")
+            if timings:
+                report(f"{name} latency", timings)
+        finally:
+            server.terminate()
+            server.wait()
+    stub.shutdown()
+
+def capture_response(view, *args):
+    """The object a view hands to jsonify, captured instead of serialized"""
+    import movers
+
+    captured = []
+
+    class Capture(movers.app.json.__class__):
+        def response(self, *response_args, **kwargs):
+            captured.append(self._prepare_response_obj(response_args, kwargs))
+            return super().response(*response_args, **kwargs)
+
+    provider = movers.app.json
+    movers.app.json = Capture(movers.app)
+    try:
+        with movers.app.test_request_context():
+            view(*args)
+    finally:
+        movers.app.json = provider
+    return captured[0]
+
+def bench_json(args):
+    """Response serialization of the largest admin listings: json module vs orjson"""
+    from datetime import datetime, timedelta
+    from json_provider import JSON_PROVIDERS, orjson
+
+    print("=" * 60)
+    print(f"JSON responses: {args.rows} drivers")
+    print("=" * 60)
+
+    scratch = tempfile.mkdtemp(prefix='movers-bench-')
+    seed_serving_database(f"sqlite:///{os.path.join(scratch, 'bench.db')}", args.rows)
+    import movers
+
+    with movers.app.app_context():
+        now = datetime.utcnow()
+        for driver in movers.Driver.query.all():
+            driver.submitted_at = now - timedelta(days=random.randint(1, 300), seconds=random.randint(0, 86400))
+            driver.verified_at = driver.submitted_at + timedelta(hours=random.randint(1, 48))
+            driver.verification_status = 'approved'
+        movers.db.session.commit()
+        payloads = {
+            'all-drivers-verification': capture_response(movers.get_all_drivers_verification),
+            'manage-users': capture_response(movers.manage_users),
+        }
+
+    providers = {name: cls(movers.app) for name, cls in JSON_PROVIDERS.items() if name != 'orjson' or orjson}
+    providers['flask default'] = movers.app.json_provider_class(movers.app)
+    if orjson is None:
+        print("  orjson is not installed (pip install orjson); comparing the json module only")
+    for label, payload in payloads.items():
+        for name, provider in providers.items():
+            with movers.app.app_context():
+                body = provider.response(payload).get_data()
+                timings = []
+                for _ in range(20):
+                    start = time.perf_counter()
+                    provider.response(payload).get_data()
+                    timings.append((time.perf_counter() - start) * 1000)
+            report(f"{label} {name} ({len(body) // 1024} KB)", timings)
+
+def bench_auth(args):
+    """Per-request cost of access tokens: signature check, cached profile, full before_request hook"""
+    print("=" * 60)
+    print(f"Access tokens: {args.queries} requests")
+    print("=" * 60)
+
+    scratch = tempfile.mkdtemp(prefix='movers-bench-')
+    user_id = seed_serving_database(f"sqlite:///{os.path.join(scratch, 'bench.db')}", 100)
+    import movers
+
+    token = movers.token_signer.issue(user_id, 'user')
+    path = f'/api/user/order-history/{user_id}'
+
+    def timed(call):
+        timings = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    with movers.app.app_context():
+        report("verify token", timed(lambda: movers.token_signer.verify(token)))
+        report("principal cache hit", timed(lambda: movers.principal_cache.get(user_id)))
+
+        def cache_miss():
+            movers.principal_cache.invalidate([user_id])
+            movers.principal_cache.get(user_id)
+        report("principal cache miss (SQL)", timed(cache_miss))
+
+    with movers.app.test_request_context(path, headers={'Authorization': f'Bearer {token}'}):
+        report("authenticate_request", timed(movers.authenticate_request))
+
+    client = movers.app.test_client()
+    for label, headers in (('without token', {}), ('with token', {'Authorization': f'Bearer {token}'})):
+        report(f"GET order-history {label}", timed(lambda: client.get(path, headers=headers)))
+
+BENCHMARKS = {
+    'driver-search': bench_driver_search,
+    'pricing': bench_pricing,
+    'dispatch': bench_dispatch,
+    'serving': bench_serving,
+    'payments': bench_payments,
+    'json': bench_json,
+    'auth': bench_auth,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--drivers', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--bookings', type=int, default=5000)
+    parser.add_argument('--workers', default='1,2,4', help='serving: comma-separated worker counts')
+    parser.add_argument('--threads', type=int, default=16, help='serving: threads per worker')
+    parser.add_argument('--clients', type=int, default=16, help='serving: concurrent keep-alive clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='serving: seconds per endpoint')
+    parser.add_argument('--rows', type=int, default=5000, help='json: drivers in the admin listings')
+    parser.add_argument('--daraja-latency', type=float, default=1.0, help='payments: seconds Daraja takes to answer')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    random.seed(42)
+    for name in args.names or list(BENCHMARKS):
+        BENCHMARKS[name](args)
+        print()
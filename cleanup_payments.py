@@ -2,7 +2,9 @@
 """
 Cleanup script to remove unrealistic payment records from the database
 """
-from movers import app, db, Transaction, Booking, Escrow, Payment, Notification
+from models import db, Transaction, Booking, Escrow, Payment, Notification, script_app
+
+app = script_app()
 
 # M-Pesa receipt numbers to remove
 RECEIPTS_TO_REMOVE = [
@@ -0,0 +1,28 @@
+"""
+Negotiated response compression
+Repetitive JSON lists shrink many times over, and for clients on slow mobile
+networks the transfer time saved far exceeds the milliseconds spent
+compressing. Brotli is used when the client accepts it and the
+brotli package is installed, gzip otherwise. Quality/levels are the fast end
+of each codec since every response is compressed on the fly.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+def available_encodings():
+    """Encodings in order of preference"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def compress(data, encoding, gzip_level=6, brotli_quality=4):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
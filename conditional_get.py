@@ -0,0 +1,41 @@
+"""
+Conditional GET bookkeeping
+Polled endpoints tag responses with an ETag built from the version stamps of
+the rows they depend on. When a client sends the tag back in If-None-Match
+and the stamps have not moved, the view is skipped and a 304 is returned.
+This module builds the tags and counts how often each route was answered
+that way.
+"""
+import threading
+
+def make_etag(token):
+    """Opaque tag for a tuple of version stamps"""
+    return '-'.join(str(part) for part in token)
+
+class ConditionalStats:
+    """Per-route counts of full responses vs 304s"""
+
+    def __init__(self):
+        self._routes = {}  # endpoint -> [requests, not_modified, uncacheable]
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, not_modified=False, uncacheable=False):
+        with self._lock:
+            counts = self._routes.setdefault(endpoint, [0, 0, 0])
+            counts[0] += 1
+            if not_modified:
+                counts[1] += 1
+            if uncacheable:
+                counts[2] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': requests,
+                    'not_modified': not_modified,
+                    'uncacheable': uncacheable,
+                    'hit_rate': round(not_modified / requests, 4) if requests else 0.0
+                }
+                for endpoint, (requests, not_modified, uncacheable) in sorted(self._routes.items())
+            }
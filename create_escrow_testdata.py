@@ -4,10 +4,12 @@ Setup Escrow Test Data
 Creates test orders with funds in escrow for driver testing
 """
 
-from movers import app, db, User, Driver, Booking, Escrow, Payment, Transaction
+from models import db, User, Driver, Booking, Escrow, Payment, Transaction, script_app
 from werkzeug.security import generate_password_hash
 from datetime import datetime, timezone
 
+app = script_app()
+
 def create_escrow_test_data():
     """Create test data with escrow funds"""
     with app.app_context():
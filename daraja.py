@@ -0,0 +1,169 @@
+"""
+M-Pesa Daraja client for both serving modes
+Payment handlers describe the Daraja request they need as a call
+({'path', 'payload', 'timeout'}) and read the DarajaReply that comes back, so
+the same handler code runs behind a blocking client (requests, under WSGI)
+or a non-blocking one (httpx, under asgi.py). The OAuth token is reused
+until shortly before it expires instead of being fetched for every call.
+"""
+import time
+
+from structured_log import get_logger
+
+log = get_logger('movers.daraja')
+
+TOKEN_PATH = '/oauth/v1/generate'
+TOKEN_REFRESH_MARGIN = 60  # Seconds before expiry at which a token is renewed
+
+class DarajaReply:
+    """Outcome of one call: 'ok' (Daraja answered), 'no_token', 'timeout' or 'unreachable'"""
+
+    def __init__(self, outcome, status_code=None, data=None, text='', error=None):
+        self.outcome = outcome
+        self.status_code = status_code
+        self.data = data  # Parsed JSON body, None if Daraja did not send JSON
+        self.text = text
+        self.error = error
+
+    @property
+    def accepted(self):
+        """Daraja accepted the request (HTTP 200 and ResponseCode 0)"""
+        return self.outcome == 'ok' and self.status_code == 200 and (self.data or {}).get('ResponseCode') == '0'
+
+def parse_json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+class DarajaClient:
+    def __init__(self, base_url, consumer_key, consumer_secret, max_connections=200, observer=None):
+        self.base_url = base_url
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.max_connections = max_connections  # Concurrent calls in async mode
+        self.observer = observer  # observer(path, status code or outcome, seconds) per HTTP call
+        self._token = None
+        self._token_expires = 0.0
+        self._async_client = None
+
+    @property
+    def token_url(self):
+        return f'{self.base_url}{TOKEN_PATH}?grant_type=client_credentials'
+
+    def _observe(self, path, outcome, started):
+        if self.observer is not None:
+            self.observer(path, outcome, time.perf_counter() - started)
+
+    def _cached_token(self):
+        if self._token and time.time() < self._token_expires:
+            return self._token
+        return None
+
+    def _store_token(self, status_code, data):
+        token = (data or {}).get('access_token') if status_code == 200 else None
+        if not token:
+            log.error('daraja.token_failed', status=status_code)
+            return None
+        expires_in = int(data.get('expires_in') or 3599)  # Sent as a string
+        self._token = token
+        self._token_expires = time.time() + expires_in - TOKEN_REFRESH_MARGIN
+        return token
+
+    def _reply(self, status_code, data, text):
+        if status_code == 401:
+            self._token = None  # Revoked or expired early; fetch a new one next time
+        return DarajaReply('ok', status_code, data, text)
+
+    def _headers(self, token):
+        return {'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
+
+    def access_token(self):
+        """OAuth token for the blocking client, None if it cannot be obtained"""
+        token = self._cached_token()
+        if token or not (self.consumer_key and self.consumer_secret):
+            return token
+        import requests  # Imported on first use: scripts and the async mode never load it
+        started = time.perf_counter()
+        try:
+            response = requests.get(
+                self.token_url, auth=(self.consumer_key, self.consumer_secret), timeout=30
+            )
+        except requests.exceptions.RequestException as e:
+            self._observe(TOKEN_PATH, 'unreachable', started)
+            log.error('daraja.token_unreachable', error=str(e))
+            return None
+        self._observe(TOKEN_PATH, response.status_code, started)
+        return self._store_token(response.status_code, parse_json(response))
+
+    def call(self, call):
+        """Send a call with requests; blocks the calling thread until Daraja answers"""
+        token = self.access_token()
+        if not token:
+            return DarajaReply('no_token')
+        import requests
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                self.base_url + call['path'], json=call['payload'],
+                headers=self._headers(token), timeout=call['timeout']
+            )
+        except requests.exceptions.Timeout as e:
+            self._observe(call['path'], 'timeout', started)
+            return DarajaReply('timeout', error=str(e))
+        except requests.exceptions.RequestException as e:
+            self._observe(call['path'], 'unreachable', started)
+            return DarajaReply('unreachable', error=str(e))
+        self._observe(call['path'], response.status_code, started)
+        return self._reply(response.status_code, parse_json(response), response.text)
+
+    def _http(self):
+        if self._async_client is None:
+            import httpx  # Only the async serving mode needs it
+            self._async_client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+            ))
+        return self._async_client
+
+    async def access_token_async(self):
+        import httpx
+        token = self._cached_token()
+        if token or not (self.consumer_key and self.consumer_secret):
+            return token
+        started = time.perf_counter()
+        try:
+            response = await self._http().get(
+                self.token_url, auth=(self.consumer_key, self.consumer_secret), timeout=30
+            )
+        except httpx.HTTPError as e:
+            self._observe(TOKEN_PATH, 'unreachable', started)
+            log.error('daraja.token_unreachable', error=str(e))
+            return None
+        self._observe(TOKEN_PATH, response.status_code, started)
+        return self._store_token(response.status_code, parse_json(response))
+
+    async def call_async(self, call):
+        """Send a call with httpx; the event loop serves other requests meanwhile"""
+        import httpx
+        token = await self.access_token_async()
+        if not token:
+            return DarajaReply('no_token')
+        started = time.perf_counter()
+        try:
+            response = await self._http().post(
+                self.base_url + call['path'], json=call['payload'],
+                headers=self._headers(token), timeout=call['timeout']
+            )
+        except httpx.TimeoutException as e:
+            self._observe(call['path'], 'timeout', started)
+            return DarajaReply('timeout', error=str(e))
+        except httpx.HTTPError as e:
+            self._observe(call['path'], 'unreachable', started)
+            return DarajaReply('unreachable', error=str(e))
+        self._observe(call['path'], response.status_code, started)
+        return self._reply(response.status_code, parse_json(response), response.text)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
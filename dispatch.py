@@ -0,0 +1,151 @@
+"""
+Batch dispatch of pending bookings to drivers
+On every tick the engine looks at all pending bookings, picks out those whose
+driver has gone offline or has not accepted within the timeout, and assigns
+them to nearby bookable drivers with the same kind of vehicle. Candidate pairs from every booking are
+scored together and matched greedily by lowest cost, so the closest, best
+rated and least busy drivers win across the whole batch, not per booking.
+"""
+import heapq
+import threading
+import time
+
+import numpy as np
+
+from structured_log import get_logger
+
+log = get_logger('movers.dispatch')
+
+class DispatchEngine:
+    """Plans reassignments for pending bookings against the driver registry"""
+
+    def __init__(self, registry, accept_timeout=120, max_load=3, candidates=10, radius_km=20.0,
+                 distance_weight=1.0, rating_weight=0.5, load_weight=2.0):
+        self.registry = registry
+        self.accept_timeout = accept_timeout  # Seconds a driver has to accept before reassignment
+        self.max_load = max_load  # Open (pending + accepted) bookings a driver may hold
+        self.candidates = candidates  # Nearest drivers considered per booking
+        self.radius_km = radius_km
+        self.distance_weight = distance_weight  # Cost per km to pickup
+        self.rating_weight = rating_weight  # Cost per rating star below 5
+        self.load_weight = load_weight  # Cost per open booking the driver already has
+        self._passed = {}  # booking_id -> driver ids that let the booking time out
+        self._lock = threading.Lock()
+
+    def plan(self, bookings, loads, now=None):
+        """Return [(booking_id, from_driver_id, to_driver_id, distance_km)] for bookings to move
+
+        `bookings` is every pending booking as (booking_id, driver_id, pickup_lat,
+        pickup_lng, assigned_at_timestamp, vehicle_type), where vehicle_type is the
+        booked driver's and only drivers with that vehicle are candidates (None for
+        any); `loads` maps driver_id -> open bookings.
+        """
+        now = now if now is not None else time.time()
+        cutoff = now - self.accept_timeout
+        with self._lock:
+            # Forget drivers that passed on bookings which are no longer pending
+            pending_ids = {booking[0] for booking in bookings}
+            for booking_id in [b for b in self._passed if b not in pending_ids]:
+                del self._passed[booking_id]
+
+            open_bookings = []
+            for booking_id, driver_id, lat, lng, assigned_at, vehicle_type in bookings:
+                if lat is None or lng is None:
+                    continue  # Booked without coordinates; cannot be matched by distance
+                orphaned = driver_id not in self.registry
+                if orphaned or assigned_at is None or assigned_at <= cutoff:
+                    if not orphaned:
+                        self._passed.setdefault(booking_id, set()).add(driver_id)
+                    open_bookings.append((booking_id, driver_id, lat, lng, vehicle_type,
+                                          self._passed.get(booking_id, ())))
+
+        # Candidate edges across the whole batch
+        edge_booking, edge_driver, edge_distance, edge_rating, edge_load = [], [], [], [], []
+        for index, (booking_id, driver_id, lat, lng, vehicle_type, passed) in enumerate(open_bookings):
+            for distance, record in self.registry.nearest(lat, lng, k=self.candidates + len(passed) + 1,
+                                                          radius_km=self.radius_km, vehicle_type=vehicle_type):
+                candidate = record.driver_id
+                if candidate == driver_id or candidate in passed:
+                    continue
+                load = loads.get(candidate, 0)
+                if load >= self.max_load:
+                    continue
+                edge_booking.append(index)
+                edge_driver.append(candidate)
+                edge_distance.append(distance)
+                edge_rating.append(record.ratings)
+                edge_load.append(load)
+
+        if not edge_booking:
+            return []
+        base_costs = (self.distance_weight * np.asarray(edge_distance)
+                      + self.rating_weight * (5.0 - np.asarray(edge_rating)))
+        costs = base_costs + self.load_weight * np.asarray(edge_load)
+
+        # Lazy greedy matching: always take the cheapest remaining edge. Assigning a
+        # booking raises that driver's load, so edges scored with an older load are
+        # re-scored and pushed back instead of being taken at a stale price.
+        heap = list(zip(costs.tolist(), range(len(edge_booking))))
+        heapq.heapify(heap)
+        current_load = dict(loads)
+        matched = set()
+        assignments = []
+        while heap:
+            _, edge = heapq.heappop(heap)
+            index = edge_booking[edge]
+            if index in matched:
+                continue
+            candidate = edge_driver[edge]
+            load = current_load.get(candidate, 0)
+            if load >= self.max_load:
+                continue
+            if load != edge_load[edge]:
+                edge_load[edge] = load
+                heapq.heappush(heap, (float(base_costs[edge]) + self.load_weight * load, edge))
+                continue
+            matched.add(index)
+            current_load[candidate] = load + 1
+            booking_id, driver_id = open_bookings[index][:2]
+            assignments.append((booking_id, driver_id, candidate, float(edge_distance[edge])))
+        return assignments
+
+class DispatchWorker(threading.Thread):
+    """Daemon thread that calls tick_fn every `interval` seconds
+
+    When several processes serve the app, give each the same `lock_path`: only
+    the process holding an exclusive lock on it runs ticks, and another takes
+    over on its next tick once that process exits.
+    """
+
+    def __init__(self, tick_fn, interval=15.0, lock_path=None):
+        super().__init__(name='dispatch-worker', daemon=True)
+        self.tick_fn = tick_fn
+        self.interval = interval
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if not self._is_leader():
+                continue
+            try:
+                self.tick_fn()
+            except Exception as e:
+                log.exception('dispatch.tick_failed', error=str(e))
+
+    def _is_leader(self):
+        if self.lock_path is None or self._lock_file is not None:
+            return True
+        import fcntl  # Multi-process serving is Unix-only
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file  # Held until the process exits
+        return True
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,148 @@
+"""
+In-memory registry of bookable drivers
+Holds one compact record per verified, available, non-banned driver so that
+customer searches are served without touching the database. The registry is
+rebuilt from the database on start and updated incrementally by the routes
+that change availability, verification, bans or position.
+"""
+import threading
+
+from geo_index import GridIndex
+
+class DriverRecord:
+    """Search-facing snapshot of a bookable driver"""
+    __slots__ = ('driver_id', 'user_id', 'name', 'vehicle_type', 'license_plate',
+                 'ratings', 'completed_orders', 'latitude', 'longitude')
+
+    def __init__(self, driver_id, user_id, name, vehicle_type, license_plate,
+                 ratings=0.0, completed_orders=0, latitude=None, longitude=None):
+        self.driver_id = driver_id
+        self.user_id = user_id
+        self.name = name
+        self.vehicle_type = vehicle_type
+        self.license_plate = license_plate
+        self.ratings = ratings or 0.0
+        self.completed_orders = completed_orders or 0
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def as_tuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, DriverRecord) and self.as_tuple() == other.as_tuple()
+
+    def __repr__(self):
+        return f'<DriverRecord {self.driver_id} {self.name!r}>'
+
+class DriverRegistry:
+    """Thread-safe map of driver_id -> DriverRecord with a spatial index on position"""
+
+    def __init__(self, cell_size_deg=0.01):
+        self.cell_size_deg = cell_size_deg
+        self._records = {}
+        self._index = GridIndex(cell_size_deg)
+        self._vehicle_indexes = {}  # vehicle_type -> GridIndex of just those drivers
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._records
+
+    def get(self, driver_id):
+        return self._records.get(driver_id)
+
+    def records(self):
+        """All registered drivers ordered by driver id"""
+        with self._lock:
+            return sorted(self._records.values(), key=lambda record: record.driver_id)
+
+    def _indexes_for(self, record):
+        vehicle_index = self._vehicle_indexes.get(record.vehicle_type)
+        if vehicle_index is None:
+            vehicle_index = self._vehicle_indexes[record.vehicle_type] = GridIndex(self.cell_size_deg)
+        return self._index, vehicle_index
+
+    def upsert(self, record):
+        with self._lock:
+            previous = self._records.get(record.driver_id)
+            if previous is not None and previous.vehicle_type != record.vehicle_type:
+                self._indexes_for(previous)[1].remove(record.driver_id)
+            self._records[record.driver_id] = record
+            for index in self._indexes_for(record):
+                if record.latitude is not None and record.longitude is not None:
+                    index.upsert(record.driver_id, record.latitude, record.longitude)
+                else:
+                    index.remove(record.driver_id)
+
+    def remove(self, driver_id):
+        with self._lock:
+            record = self._records.pop(driver_id, None)
+            if record is not None:
+                for index in self._indexes_for(record):
+                    index.remove(driver_id)
+
+    def update_position(self, driver_id, latitude, longitude):
+        """Move a registered driver; returns False if the driver is not bookable"""
+        with self._lock:
+            record = self._records.get(driver_id)
+            if record is None:
+                return False
+            record.latitude = latitude
+            record.longitude = longitude
+            for index in self._indexes_for(record):
+                index.upsert(driver_id, latitude, longitude)
+            return True
+
+    def nearest(self, latitude, longitude, k=10, radius_km=10.0, max_candidates=None, deadline=None,
+                vehicle_type=None):
+        """Return up to k (distance_km, DriverRecord) pairs, closest first"""
+        with self._lock:
+            index = self._index if vehicle_type is None else self._vehicle_indexes.get(vehicle_type)
+            if index is None:
+                return []
+            matches = index.nearest(latitude, longitude, k, radius_km,
+                                    max_candidates=max_candidates, deadline=deadline)
+            return [(distance, self._records[driver_id]) for distance, driver_id in matches]
+
+    def rebuild(self, records):
+        """Replace the registry contents with a fresh set of records"""
+        with self._lock:
+            self._records = {}
+            self._index.clear()
+            self._vehicle_indexes = {}
+            for record in records:
+                self.upsert(record)
+            self.loaded = True
+
+    def check_consistency(self, records):
+        """Compare the registry against authoritative records from the database"""
+        expected = {record.driver_id: record for record in records}
+        with self._lock:
+            actual = dict(self._records)
+            indexed_ok = all(
+                (record.latitude is not None and record.longitude is not None)
+                == (driver_id in self._index)
+                == (driver_id in self._vehicle_indexes.get(record.vehicle_type, ()))
+                for driver_id, record in actual.items()
+            ) and len(self._index) <= len(actual) \
+                and len(self._index) == sum(len(index) for index in self._vehicle_indexes.values())
+
+        missing = sorted(set(expected) - set(actual))
+        stale = sorted(set(actual) - set(expected))
+        mismatched = sorted(
+            driver_id for driver_id in set(expected) & set(actual)
+            if expected[driver_id] != actual[driver_id]
+        )
+        return {
+            'consistent': not (missing or stale or mismatched) and indexed_ok,
+            'registered': len(actual),
+            'expected': len(expected),
+            'missing': missing,
+            'stale': stale,
+            'mismatched': mismatched,
+            'index_consistent': indexed_ok
+        }
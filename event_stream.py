@@ -0,0 +1,215 @@
+"""
+In-process publish/subscribe for Server-Sent Events
+A channel exists while someone is subscribed to it and keeps a short ring
+buffer of recent events. Publishing serializes an event once, appends it and
+wakes the channel's subscribers; each subscriber only tracks a cursor (the
+last event id it sent), so fan-out costs the same for one watcher or
+thousands, and a reconnect can resume from its Last-Event-ID.
+
+Subscription.stream blocks its thread between events, so under a threaded
+server every watcher holds a thread; Broadcaster's max_subscribers caps how
+many may be open. Subscription.astream waits on an asyncio event instead and
+holds no thread at all (asgi.py serves streams that way).
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+def format_sse(event_id, event_type, payload):
+    """Render one event in text/event-stream framing; payload is already JSON"""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+class StreamsFull(RuntimeError):
+    pass
+
+class Channel:
+    __slots__ = ('events', 'condition', 'subscribers', 'closed', 'waiters')
+
+    def __init__(self, history):
+        self.events = deque(maxlen=history)  # (event_id, event_type, payload) with increasing ids
+        self.condition = threading.Condition()
+        self.subscribers = 0
+        self.closed = False  # No more events will come; streams end once drained
+        self.waiters = set()  # (loop, asyncio.Event) of async subscribers waiting for an event
+
+    def wake(self):
+        """Wake blocked and async subscribers; call with the condition held"""
+        self.condition.notify_all()
+        for loop, ready in self.waiters:
+            loop.call_soon_threadsafe(ready.set)
+
+    def after(self, cursor):
+        """Buffered events newer than cursor, oldest first; call with the condition held"""
+        if cursor is None:
+            return list(self.events)
+        newer = []
+        for event in reversed(self.events):
+            if event[0] <= cursor:
+                break
+            newer.append(event)
+        newer.reverse()
+        return newer
+
+class Subscription:
+    """One client's view of a channel; registered as soon as it is created"""
+
+    def __init__(self, broadcaster, name, channel):
+        self.broadcaster = broadcaster
+        self.name = name
+        self.channel = channel
+        self.closed = False
+        with channel.condition:
+            # Start after whatever is already buffered; replay covers older events
+            self.cursor = channel.events[-1][0] if channel.events else None
+
+    def _replay(self, replay, retry_ms):
+        yield f"retry: {retry_ms}\n\n"
+        for event_id, event_type, data in replay:
+            yield format_sse(event_id, event_type, json.dumps(data, default=str))
+            if self.cursor is None or event_id > self.cursor:
+                self.cursor = event_id
+
+    def stream(self, replay=(), heartbeat=15.0, retry_ms=3000):
+        """Generator of SSE text: replayed events first, then live ones until disconnect"""
+        try:
+            yield from self._replay(replay, retry_ms)
+            while not self.closed:
+                with self.channel.condition:
+                    pending = self.channel.after(self.cursor)
+                    if not pending and not self.channel.closed:
+                        self.channel.condition.wait(heartbeat)
+                        pending = self.channel.after(self.cursor)
+                if not pending:
+                    if self.channel.closed:
+                        break
+                    yield ": keep-alive\n\n"  # Also how a dropped client is noticed
+                    continue
+                for event_id, event_type, payload in pending:
+                    yield format_sse(event_id, event_type, payload)
+                    self.cursor = event_id
+        finally:
+            self.close()
+
+    async def astream(self, replay=(), heartbeat=15.0, retry_ms=3000):
+        """Same text as stream(), awaited on the running event loop instead of a thread"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        waiter = (loop, ready)
+        try:
+            for text in self._replay(replay, retry_ms):
+                yield text
+            while not self.closed:
+                with self.channel.condition:
+                    pending = self.channel.after(self.cursor)
+                    closed = self.channel.closed
+                    if not pending and not closed:
+                        ready.clear()
+                        self.channel.waiters.add(waiter)  # Under the lock, so no publish is missed
+                if not pending and not closed:
+                    try:
+                        await asyncio.wait_for(ready.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        pass
+                    finally:
+                        with self.channel.condition:
+                            self.channel.waiters.discard(waiter)
+                    with self.channel.condition:
+                        pending = self.channel.after(self.cursor)
+                        closed = self.channel.closed
+                if not pending:
+                    if closed:
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                for event_id, event_type, payload in pending:
+                    yield format_sse(event_id, event_type, payload)
+                    self.cursor = event_id
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broadcaster._release(self.name, self.channel)
+
+class Broadcaster:
+    """Named channels of events fanned out to any number of subscribers"""
+
+    def __init__(self, history=100, max_subscribers=0):
+        self.history = history
+        self.max_subscribers = max_subscribers  # 0 for no limit
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.subscribers = 0
+        self.rejected = 0  # Subscriptions refused because max_subscribers were open
+        self.published = 0
+        self.dropped = 0  # Events published to channels nobody was watching
+
+    def subscribe(self, name):
+        """New Subscription to a channel; raises StreamsFull at max_subscribers"""
+        with self._lock:
+            if self.max_subscribers and self.subscribers >= self.max_subscribers:
+                self.rejected += 1
+                raise StreamsFull(f'{self.max_subscribers} streams already open')
+            self.subscribers += 1
+            channel = self._channels.get(name)
+            if channel is None:
+                channel = self._channels[name] = Channel(self.history)
+            channel.subscribers += 1
+        return Subscription(self, name, channel)
+
+    def _release(self, name, channel):
+        with self._lock:
+            self.subscribers -= 1
+            channel.subscribers -= 1
+            if channel.subscribers <= 0 and self._channels.get(name) is channel:
+                del self._channels[name]
+        with channel.condition:
+            channel.wake()
+
+    def publish(self, name, event_id, event_type, data):
+        """Send an event to a channel's subscribers
+
+        Ids increase within a channel: an event_id of None takes the current time,
+        and an id at or below the channel's last one is moved just past it.
+        """
+        channel = self._channels.get(name)
+        if channel is None:
+            self.dropped += 1  # Clients replay from their cursor when they (re)connect
+            return False
+        payload = json.dumps(data, default=str)  # Serialized once for every subscriber
+        with channel.condition:
+            last_id = channel.events[-1][0] if channel.events else None
+            if event_id is None:
+                event_id = round(time.time(), 3)
+            if last_id is not None and event_id <= last_id:
+                event_id = last_id + 1 if isinstance(last_id, int) else round(last_id + 0.001, 3)
+            channel.events.append((event_id, event_type, payload))
+            channel.wake()
+        self.published += 1
+        return True
+
+    def close(self, name):
+        """End a channel: current subscribers drain what is buffered and disconnect"""
+        with self._lock:
+            channel = self._channels.pop(name, None)
+        if channel is not None:
+            with channel.condition:
+                channel.closed = True
+                channel.wake()
+
+    def has_subscribers(self, name):
+        return name in self._channels
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'subscribers': self.subscribers,
+                'max_subscribers': self.max_subscribers,
+                'rejected': self.rejected,
+                'published': self.published,
+                'dropped': self.dropped
+            }
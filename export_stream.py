@@ -0,0 +1,74 @@
+"""
+Streaming table exports (NDJSON or CSV)
+Rows are read in keyset batches (id > last id seen, ORDER BY id, LIMIT n),
+encoded one at a time and sent in chunks of about CHUNK_BYTES, so an export
+of any size holds one batch and one chunk in memory. Each batch is a short
+query of its own: SQLite keeps a read lock for as long as a cursor is open,
+and one cursor held across a multi-million-row download would block every
+writer until the client finished reading.
+"""
+import csv
+import io
+from datetime import date, datetime, timezone
+
+CHUNK_BYTES = 64 * 1024
+
+class ExportError(ValueError):
+    pass
+
+def keyset_rows(fetch_batch, batch_size):
+    """Rows from fetch_batch(after_id, limit) until a short batch; row[0] must be the id"""
+    after_id = None
+    while True:
+        rows = fetch_batch(after_id, batch_size)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1][0]
+
+def ndjson_lines(columns, rows, dumps_bytes):
+    for row in rows:
+        yield dumps_bytes(dict(zip(columns, row))) + b'\n'
+
+def csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([csv_value(value) for value in row])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()  # Header of an empty export
+
+def chunked(lines, chunk_bytes=CHUNK_BYTES):
+    """Join encoded lines into chunks of about chunk_bytes"""
+    parts = []
+    size = 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b''.join(parts)
+
+def parse_timestamp(value, name):
+    """ISO date or datetime from a query string as naive UTC (like the stored values), None when absent"""
+    if not value:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f'{name} must be an ISO date or datetime, e.g. 2026-01-31 or 2026-01-31T08:00:00')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
@@ -0,0 +1,43 @@
+"""
+Sparse fieldsets for list endpoints (?fields=name,phone)
+A view describes each output key as a Field: the columns it needs and how to
+build the value from them. Only the requested fields' columns are selected,
+so leaving out e.g. document URLs also keeps them out of the query.
+"""
+
+class FieldsError(ValueError):
+    pass
+
+class Field:
+    """Output key built from one or more selected columns (the first column as is by default)"""
+
+    def __init__(self, *columns, build=None):
+        self.columns = columns
+        self.build = build
+
+def requested_fields(value, fields):
+    """Field names from a ?fields= value in the view's order; all of them when absent"""
+    if not value:
+        return list(fields)
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names - set(fields)
+    if unknown:
+        raise FieldsError(f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(fields)}")
+    return [name for name in fields if name in names]
+
+def field_columns(fields, names):
+    """Columns to select for the named fields, plus a function turning a result row into a dict"""
+    columns = []
+    layout = []
+    for name in names:
+        field = fields[name]
+        layout.append((name, len(columns), len(columns) + len(field.columns), field.build))
+        columns.extend(field.columns)
+
+    def build_row(row):
+        item = {}
+        for name, start, end, build in layout:
+            item[name] = row[start] if build is None else build(*row[start:end])
+        return item
+
+    return columns, build_row
@@ -2,7 +2,9 @@
 """
 Fix missing escrow records for completed transactions
 """
-from movers import app, db, Escrow, Booking, Transaction, User, Driver, Notification
+from models import db, Escrow, Booking, Transaction, User, Driver, Notification, script_app
+
+app = script_app()
 
 def fix_escrow_records():
     """Create escrow records for completed transactions that don't have them"""
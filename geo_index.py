@@ -0,0 +1,199 @@
+"""
+Grid-based spatial index for driver positions
+Buckets points into fixed-size lat/lng cells so nearest-driver lookups only
+scan the cells around the pickup point instead of every driver.
+"""
+import math
+import time
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32  # Length of one degree of latitude
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = (math.sin(dlat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def haversine_km_many(lat, lng, lats, lngs):
+    """Vectorized distance in kilometres from one point to arrays of points"""
+    lat1 = math.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlng = np.radians(np.asarray(lngs, dtype=np.float64)) - math.radians(lng)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def parse_latlng(value):
+    """Parse a "lat,lng" string into a (lat, lng) float tuple, or None if invalid"""
+    if not value:
+        return None
+    try:
+        lat_str, lng_str = str(value).split(',', 1)
+        lat, lng = float(lat_str), float(lng_str)
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash_encode(lat, lng, precision=7):
+    """Standard base32 geohash; precision 7 is a cell of roughly 150 x 150 m"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        span, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (span[0] + span[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            span[0] = mid
+        else:
+            bits = bits * 2
+            span[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+def geohash_bounds(geohash):
+    """Return (min_lat, min_lng, max_lat, max_lng) of a geohash cell"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            span = lng_range if even else lat_range
+            mid = (span[0] + span[1]) / 2
+            if (bits >> shift) & 1:
+                span[0] = mid
+            else:
+                span[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+class GridIndex:
+    """In-memory uniform grid of points keyed by id"""
+
+    def __init__(self, cell_size_deg=0.01):
+        self.cell_size_deg = cell_size_deg  # 0.01 degrees is roughly 1.1 km
+        self._cells = {}   # (row, col) -> {id: (lat, lng)}
+        self._points = {}  # id -> (lat, lng, cell)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, item_id):
+        return item_id in self._points
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_size_deg)), int(math.floor(lng / self.cell_size_deg)))
+
+    def position(self, item_id):
+        """Return (lat, lng) for an id, or None if it is not indexed"""
+        point = self._points.get(item_id)
+        return (point[0], point[1]) if point else None
+
+    def upsert(self, item_id, lat, lng):
+        """Insert a point or move an existing one"""
+        cell = self._cell(lat, lng)
+        previous = self._points.get(item_id)
+        if previous and previous[2] != cell:
+            self._discard_from_cell(item_id, previous[2])
+        self._points[item_id] = (lat, lng, cell)
+        self._cells.setdefault(cell, {})[item_id] = (lat, lng)
+
+    def remove(self, item_id):
+        """Drop a point from the index (no-op if missing)"""
+        previous = self._points.pop(item_id, None)
+        if previous:
+            self._discard_from_cell(item_id, previous[2])
+
+    def clear(self):
+        self._cells.clear()
+        self._points.clear()
+
+    def _discard_from_cell(self, item_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.pop(item_id, None)
+            if not members:
+                del self._cells[cell]
+
+    def _ring(self, row, col, radius):
+        """Yield the cells exactly `radius` steps away from (row, col)"""
+        if radius == 0:
+            yield (row, col)
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield (row - radius, c)
+            yield (row + radius, c)
+        for r in range(row - radius + 1, row + radius):
+            yield (r, col - radius)
+            yield (r, col + radius)
+
+    def nearest(self, lat, lng, k=10, radius_km=10.0, max_candidates=None, deadline=None):
+        """Return up to k (distance_km, id) pairs within radius_km, closest first
+
+        Cells are gathered ring by ring outwards and the exact distances are
+        computed with one vectorized haversine pass. Gathering stops early once
+        `max_candidates` ids are collected or time.perf_counter() passes
+        `deadline`, which bounds latency in very dense areas.
+        """
+        if k <= 0 or not self._points:
+            return []
+
+        # Smallest cell edge in km around this latitude; used to bound each ring
+        cell_km = self.cell_size_deg * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        max_ring = int(math.ceil(radius_km / cell_km)) + 1
+        row, col = self._cell(lat, lng)
+
+        ids, coords = [], []
+        distances = np.empty(0)  # Distances for the first len(distances) candidates
+
+        def measure_new_candidates():
+            if len(coords) == len(distances):
+                return distances
+            points = np.array(coords[len(distances):], dtype=np.float64)
+            return np.concatenate((distances, haversine_km_many(lat, lng, points[:, 0], points[:, 1])))
+
+        kth_bound = None  # Distance of the k-th closest candidate once k have been seen
+        exhausted = False  # Candidate cap or deadline reached
+        for ring in range(max_ring + 1):
+            # Every point in this ring is at least (ring - 1) cells away
+            ring_floor_km = max(ring - 1, 0) * cell_km
+            if exhausted or ring_floor_km > radius_km:
+                break
+            if kth_bound is not None and ring_floor_km > kth_bound:
+                break
+
+            for cell in self._ring(row, col, ring):
+                members = self._cells.get(cell)
+                if not members:
+                    continue
+                ids.extend(members.keys())
+                coords.extend(members.values())
+                if ((max_candidates is not None and len(ids) >= max_candidates)
+                        or (deadline is not None and time.perf_counter() > deadline)):
+                    exhausted = True
+                    break
+
+            if kth_bound is None and len(ids) >= k:
+                distances = measure_new_candidates()
+                kth_bound = float(np.partition(distances, k - 1)[k - 1])
+
+        if not ids:
+            return []
+        distances = measure_new_candidates()
+        within = np.flatnonzero(distances <= radius_km)
+        if len(within) > k:
+            within = within[np.argpartition(distances[within], k - 1)[:k]]
+        order = within[np.argsort(distances[within], kind='stable')]
+        return [(float(distances[i]), ids[i]) for i in order]
@@ -0,0 +1,81 @@
+"""
+JSON encoding for API responses
+Flask's default provider writes datetimes as HTTP dates ("Mon, 19 Oct 2026
+13:04:36 GMT") while most views format them with isoformat(); both providers
+here write ISO-8601 everywhere, so views can return datetimes as they are.
+
+OrjsonJSONProvider encodes with orjson (written in Rust, several times faster
+than the json module on large lists of dicts) and hands the bytes straight to
+the response. orjson is optional: without it, or for values it cannot encode
+(such as integers beyond 64 bits), the json module is used instead.
+"""
+import dataclasses
+import datetime
+import decimal
+import uuid
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def iso_default(o):
+    """Flask's fallbacks, but with ISO-8601 dates"""
+    if isinstance(o, (datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """The json module with ISO-8601 dates; keys keep the order the view built them in"""
+    default = staticmethod(iso_default)
+    sort_keys = False
+
+    def dumps_bytes(self, obj):
+        return self.dumps(obj).encode()
+
+class OrjsonJSONProvider(IsoJSONProvider):
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj):
+        try:
+            return orjson.dumps(obj, default=iso_default, option=self._options())
+        except TypeError:
+            return super().dumps(obj).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)  # json.dumps options orjson has no equivalent for
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+JSON_PROVIDERS = {'stdlib': IsoJSONProvider, 'orjson': OrjsonJSONProvider}
+
+def json_provider_class(name='auto'):
+    """'orjson', 'stdlib', or 'auto' (orjson when installed)"""
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_PROVIDER=orjson but orjson is not installed (pip install orjson)')
+    return JSON_PROVIDERS[name]
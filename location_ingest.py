@@ -0,0 +1,111 @@
+"""
+Coalescing ingestion pipeline for driver GPS pings
+Pings only touch memory: the buffer keeps the newest position per driver and
+a background flusher writes all pending positions to the database in one
+bulk update every few seconds.
+"""
+import threading
+import time
+
+from structured_log import get_logger
+
+log = get_logger('movers.location')
+
+class LocationBuffer:
+    """Latest known position per driver plus the set still waiting to be flushed"""
+
+    def __init__(self):
+        self._latest = {}   # driver_id -> (lat, lng, timestamp)
+        self._pending = {}  # subset of _latest not yet written to the database
+        self._lock = threading.Lock()
+        self.received = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.flushes = 0
+
+    def submit(self, driver_id, lat, lng, timestamp=None):
+        """Record a ping; returns False if a newer position is already known"""
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self._lock:
+            self.received += 1
+            current = self._latest.get(driver_id)
+            if current and current[2] > timestamp:
+                self.coalesced += 1
+                return False
+            if driver_id in self._pending:
+                self.coalesced += 1
+            self._latest[driver_id] = self._pending[driver_id] = (lat, lng, timestamp)
+            return True
+
+    def latest(self, driver_id):
+        """Return (lat, lng, timestamp) for a driver, or None if no ping was received"""
+        return self._latest.get(driver_id)
+
+    def latest_positions(self):
+        with self._lock:
+            return dict(self._latest)
+
+    def drain(self):
+        """Take every pending position, leaving the pending set empty"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            return pending
+
+    def requeue(self, positions):
+        """Put back positions from a failed flush unless newer pings arrived meanwhile"""
+        with self._lock:
+            for driver_id, position in positions.items():
+                current = self._pending.get(driver_id)
+                if current is None or current[2] < position[2]:
+                    self._pending[driver_id] = position
+
+    def forget(self, driver_ids):
+        """Drop drivers that no longer exist so they stop being tracked"""
+        with self._lock:
+            for driver_id in driver_ids:
+                self._latest.pop(driver_id, None)
+                self._pending.pop(driver_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'received': self.received,
+                'coalesced': self.coalesced,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'pending': len(self._pending),
+                'tracked_drivers': len(self._latest)
+            }
+
+class LocationFlusher(threading.Thread):
+    """Daemon thread that calls flush_fn every `interval` seconds"""
+
+    def __init__(self, buffer, flush_fn, interval=5.0):
+        super().__init__(name='location-flusher', daemon=True)
+        self.buffer = buffer
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        positions = self.buffer.drain()
+        if not positions:
+            return 0
+        try:
+            written = self.flush_fn(positions)
+        except Exception as e:
+            log.exception('location.flush_failed', error=str(e), requeued=len(positions))
+            self.buffer.requeue(positions)
+            return 0
+        self.buffer.flushed += written
+        self.buffer.flushes += 1
+        return written
+
+    def stop(self, flush=True):
+        self._stop_event.set()
+        if flush:
+            self.flush()
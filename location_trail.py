@@ -0,0 +1,145 @@
+"""
+Per-booking GPS trails for live tracking
+Each active booking gets a fixed-capacity ring buffer of (timestamp, lat, lng)
+held in packed float arrays. Trails are served as encoded polylines and are
+packed into a compressed blob when the booking completes.
+"""
+import threading
+import zlib
+from array import array
+from bisect import bisect_right
+
+class TrailBuffer:
+    """Ring buffer of timestamped positions; timestamps are strictly increasing"""
+
+    def __init__(self, capacity=2880):
+        self.capacity = capacity
+        self._ts = array('d', [0.0]) * capacity
+        self._lat = array('d', [0.0]) * capacity
+        self._lng = array('d', [0.0]) * capacity
+        self._start = 0
+        self._count = 0
+        self.dropped = 0  # Points overwritten once the buffer is full
+
+    def __len__(self):
+        return self._count
+
+    def _slot(self, i):
+        return (self._start + i) % self.capacity
+
+    @property
+    def last_timestamp(self):
+        return self._ts[self._slot(self._count - 1)] if self._count else None
+
+    def append(self, timestamp, lat, lng):
+        """Add a point; out-of-order or duplicate timestamps are ignored"""
+        if self._count and timestamp <= self.last_timestamp:
+            return False
+        if self._count < self.capacity:
+            slot = self._slot(self._count)
+            self._count += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+            self.dropped += 1
+        self._ts[slot] = timestamp
+        self._lat[slot] = lat
+        self._lng[slot] = lng
+        return True
+
+    def points(self, since=None):
+        """Return [(timestamp, lat, lng)] in order, only those newer than `since`"""
+        first = 0
+        if since is not None and self._count:
+            # Binary search over the logical (unrotated) order of timestamps
+            timestamps = _LogicalView(self._ts, self._start, self._count, self.capacity)
+            first = bisect_right(timestamps, since)
+        return [(self._ts[s], self._lat[s], self._lng[s])
+                for s in (self._slot(i) for i in range(first, self._count))]
+
+class _LogicalView:
+    """Sequence view over a rotated array so bisect can search it in place"""
+
+    def __init__(self, values, start, count, capacity):
+        self.values, self.start, self.count, self.capacity = values, start, count, capacity
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return self.values[(self.start + i) % self.capacity]
+
+def encode_polyline(points, precision=5):
+    """Encode [(timestamp, lat, lng)] with the Google encoded polyline algorithm"""
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lng = 0
+    for _, lat, lng in points:
+        lat_i, lng_i = int(round(lat * factor)), int(round(lng * factor))
+        for delta in (lat_i - prev_lat, lng_i - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lat, prev_lng = lat_i, lng_i
+    return ''.join(output)
+
+def pack_points(points):
+    """Serialize [(timestamp, lat, lng)] into a compressed blob of packed doubles"""
+    flat = array('d')
+    for point in points:
+        flat.extend(point)
+    return zlib.compress(flat.tobytes())
+
+def unpack_points(blob):
+    flat = array('d')
+    flat.frombytes(zlib.decompress(blob))
+    return [tuple(flat[i:i + 3]) for i in range(0, len(flat), 3)]
+
+def points_since(points, since=None):
+    """Filter an ordered point list to those newer than `since`"""
+    if since is None:
+        return points
+    return points[bisect_right([point[0] for point in points], since):]
+
+class TrailStore:
+    """Active trails keyed by booking, fed by driver pings"""
+
+    def __init__(self, capacity=2880):
+        self.capacity = capacity
+        self._trails = {}           # booking_id -> TrailBuffer
+        self._driver_bookings = {}  # driver_id -> booking_id currently being tracked
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def start(self, booking_id, driver_id):
+        with self._lock:
+            self._trails.setdefault(booking_id, TrailBuffer(self.capacity))
+            self._driver_bookings[driver_id] = booking_id
+
+    def record(self, driver_id, timestamp, lat, lng):
+        """Append a ping to the driver's active booking trail, if any"""
+        booking_id = self._driver_bookings.get(driver_id)
+        if booking_id is None:
+            return None
+        with self._lock:
+            trail = self._trails.get(booking_id)
+            if trail is not None:
+                trail.append(timestamp, lat, lng)
+        return booking_id
+
+    def points(self, booking_id, since=None):
+        """Return trail points newer than `since`, or None if the booking is not tracked"""
+        with self._lock:
+            trail = self._trails.get(booking_id)
+            return trail.points(since) if trail is not None else None
+
+    def finish(self, booking_id):
+        """Stop tracking a booking and return its full point list"""
+        with self._lock:
+            trail = self._trails.pop(booking_id, None)
+            for driver_id, tracked in list(self._driver_bookings.items()):
+                if tracked == booking_id:
+                    del self._driver_bookings[driver_id]
+            return trail.points() if trail is not None else []
@@ -0,0 +1,151 @@
+"""
+In-process metrics in the Prometheus text format
+Counters and histograms are plain dicts keyed by label values behind one
+lock, so recording a request or a SQL statement costs a perf_counter call
+and a few additions. Each server process keeps its own numbers; with several
+workers Prometheus sees whichever worker answers the scrape.
+
+The SQL statements a request runs are tallied on a RequestTally made current
+for that request (see track_request), so the per-route histograms show how
+many queries and how much database time each request took.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current_tally = contextvars.ContextVar('request_tally', default=None)
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{label_value(value)}"' for name, value in zip(names, values)) + '}'
+
+def series_order(item):
+    return tuple(str(value) for value in item[0])
+
+def format_number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, total in sorted(self._values.items(), key=series_order):
+                lines.append(f'{self.name}{format_labels(self.labels, values)} {format_number(total)}')
+        return lines
+
+class Histogram:
+    """Cumulative buckets, sum and count per label set"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items(), key=series_order):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    le = bound if bound == '+Inf' else format_number(float(bound))
+                    lines.append(f'{self.name}_bucket{format_labels(names, values + (le,))} {cumulative}')
+                labels = format_labels(self.labels, values)
+                lines.append(f'{self.name}_sum{labels} {format_number(round(total, 6))}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class Gauges:
+    """Values read at scrape time: collect() returns [(label values, value)]"""
+
+    def __init__(self, name, help_text, collect, labels=(), kind='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.labels = tuple(labels)
+        self.kind = kind  # 'counter' for totals kept elsewhere
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for values, value in self.collect():
+            lines.append(f'{self.name}{format_labels(self.labels, values)} {format_number(value)}')
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauges(self, name, help_text, collect, labels=(), kind='gauge'):
+        return self.register(Gauges(name, help_text, collect, labels, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+class RequestTally:
+    """Start time and SQL work of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+
+def track_request(tally):
+    """Make tally the current request's; SQL statements run on this thread add to it"""
+    _current_tally.set(tally)
+
+def untrack_request():
+    _current_tally.set(None)
+
+def record_query(seconds):
+    tally = _current_tally.get()
+    if tally is not None:
+        tally.queries += 1
+        tally.query_seconds += seconds
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
-"""Database migration script to add booking_id column to transaction table"""
+"""Database migration script to add booking_id column to transaction table,
+numeric latitude/longitude columns to the driver table and dispatch columns
+to the booking table"""
 
 import sqlite3
 import os
@@ -33,6 +35,56 @@ try:
     print("\nTransaction table columns:")
     for col in columns:
         print(f"  - {col[1]} ({col[2]})")
+
+    # Add numeric driver coordinates used by the spatial driver search
+    cursor.execute("PRAGMA table_info(`driver`);")
+    driver_columns = [col[1] for col in cursor.fetchall()]
+    
+    for column in ['latitude', 'longitude']:
+        if column in driver_columns:
+            print(f"✓ Column '{column}' already exists in driver table")
+        else:
+            cursor.execute(f"ALTER TABLE `driver` ADD COLUMN {column} FLOAT;")
+            print(f"✓ Successfully added '{column}' column to driver table")
+    
+    # Backfill coordinates from the existing "lat,lng" live_location strings
+    cursor.execute("SELECT id, live_location FROM `driver` WHERE live_location IS NOT NULL AND latitude IS NULL;")
+    backfilled = 0
+    for driver_id, live_location in cursor.fetchall():
+        try:
+            lat, lng = [float(part) for part in live_location.split(',', 1)]
+        except ValueError:
+            print(f"  ! Skipping driver {driver_id}: unparseable live_location '{live_location}'")
+            continue
+        cursor.execute("UPDATE `driver` SET latitude = ?, longitude = ? WHERE id = ?;", (lat, lng, driver_id))
+        backfilled += 1
+    conn.commit()
+    print(f"✓ Backfilled coordinates for {backfilled} driver(s)")
+
+    # Add pickup coordinates and assignment time used by the dispatch engine
+    cursor.execute("PRAGMA table_info(`booking`);")
+    booking_columns = [col[1] for col in cursor.fetchall()]
+
+    for column, column_type in [('pickup_lat', 'FLOAT'), ('pickup_lng', 'FLOAT'), ('assigned_at', 'DATETIME')]:
+        if column in booking_columns:
+            print(f"✓ Column '{column}' already exists in booking table")
+        else:
+            cursor.execute(f"ALTER TABLE `booking` ADD COLUMN {column} {column_type};")
+            print(f"✓ Successfully added '{column}' column to booking table")
+
+    # Existing pending bookings start their accept window now
+    cursor.execute("UPDATE `booking` SET assigned_at = CURRENT_TIMESTAMP WHERE assigned_at IS NULL;")
+    conn.commit()
+
+    # Change stamp used by the drivers' order feed (?since= cursor)
+    if 'version' in booking_columns:
+        print("✓ Column 'version' already exists in booking table")
+    else:
+        cursor.execute("ALTER TABLE `booking` ADD COLUMN version BIGINT;")
+        print("✓ Successfully added 'version' column to booking table")
+    # Existing rows get small stamps, all older than any taken from the clock
+    cursor.execute("UPDATE `booking` SET version = id WHERE version IS NULL;")
+    conn.commit()
     
     conn.close()
     print("\n✓ Migration completed successfully!")
@@ -0,0 +1,401 @@
+"""
+Database models and the session listeners that keep derived rows in step
+Importing this module costs Flask-SQLAlchemy and nothing else: no routes,
+background workers, HTTP clients or .env loading. Maintenance scripts work
+against script_app(); movers.py binds the same db to the server app.
+
+The listeners stay with the models so that a script writing bookings or
+notifications still bumps version stamps and unread counters, and clients
+polling with If-None-Match see its changes.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+DEFAULT_DATABASE_URL = 'sqlite:///moving_app.db'  # Relative to the instance folder
+UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}  # Same on_conflict_* API
+
+db = SQLAlchemy()
+
+def check_database_url(url):
+    """Raise RuntimeError for a database the counters and version stamps cannot upsert into"""
+    backend = make_url(url).get_backend_name()
+    if backend not in UPSERT_DIALECTS:
+        raise RuntimeError(f'DATABASE_URL uses {backend}; supported databases: {", ".join(UPSERT_DIALECTS)}')
+    return url
+
+def upsert(connection, table):
+    """INSERT supporting on_conflict_do_nothing / on_conflict_do_update on the connection's database"""
+    return UPSERT_DIALECTS[connection.dialect.name](table)
+
+def script_app(database_url=None):
+    """Bare Flask app bound to db, for scripts that need an app context but no routes"""
+    from flask import Flask
+    from dotenv import load_dotenv
+    load_dotenv()  # DATABASE_URL from .env, as the server reads it
+    app = Flask(__name__)  # Same root and instance folder as movers.app, so relative SQLite paths agree
+    app.config['SQLALCHEMY_DATABASE_URI'] = check_database_url(database_url or os.getenv('DATABASE_URL',
+                                                                                        DEFAULT_DATABASE_URL))
+    db.init_app(app)
+    return app
+
+# Models
+class Transaction(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=True)
+    transaction_id = db.Column(db.String(100), unique=True, nullable=False)
+    mpesa_receipt_number = db.Column(db.String(100), nullable=True)
+    checkout_request_id = db.Column(db.String(100), nullable=True)
+    merchant_request_id = db.Column(db.String(100), nullable=True)
+    amount = db.Column(db.Float, nullable=False)
+    phone_number = db.Column(db.String(20), nullable=True)
+    type = db.Column(db.String(50), nullable=False)  # deposit, payment, withdrawal, escrow_release, refund, booking_payment
+    status = db.Column(db.String(50), default='pending')  # pending, completed, failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('idx_transaction_created_at', 'created_at'),)
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(150), nullable=False)
+    phone = db.Column(db.String(20), nullable=False)
+    email = db.Column(db.String(150), unique=True, nullable=False)
+    password = db.Column(db.String(150), nullable=False)
+    role = db.Column(db.String(50), nullable=False, default='user')  # user, driver, admin
+    is_banned = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    balance = db.Column(db.Float, default=0.0)  # Wallet balance
+
+    # Relationships
+    bookings = db.relationship('Booking', backref='user', lazy=True)
+    payments = db.relationship('Payment', backref='user', lazy=True)
+    reviews = db.relationship('Review', backref='user', lazy=True)
+    support_tickets = db.relationship('SupportTicket', backref='user', lazy=True)
+    notifications = db.relationship('Notification', backref='user', lazy=True)
+
+class Driver(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    vehicle_type = db.Column(db.String(100), nullable=False)
+    license_plate = db.Column(db.String(50), nullable=False)
+    is_available = db.Column(db.Boolean, default=True)
+    earnings = db.Column(db.Float, default=0.0)
+    ratings = db.Column(db.Float, default=0.0)
+    completed_orders = db.Column(db.Integer, default=0)
+    live_location = db.Column(db.String(100), nullable=True)  # Latitude, Longitude
+    latitude = db.Column(db.Float, nullable=True)  # Parsed from live_location for spatial search
+    longitude = db.Column(db.Float, nullable=True)
+
+    # Verification System
+    is_verified = db.Column(db.Boolean, default=False)
+    verification_status = db.Column(db.String(50), default='pending')  # pending, under_review, approved, rejected
+    
+    # Driver Documents
+    license_number = db.Column(db.String(100), nullable=True)
+    license_expiry = db.Column(db.DateTime, nullable=True)
+    drivers_license_url = db.Column(db.String(500), nullable=True)
+    
+    # Vehicle Documents
+    vehicle_registration_url = db.Column(db.String(500), nullable=True)
+    insurance_certificate_url = db.Column(db.String(500), nullable=True)
+    insurance_expiry = db.Column(db.DateTime, nullable=True)
+    vehicle_photo_url = db.Column(db.String(500), nullable=True)
+    
+    # Profile
+    profile_photo_url = db.Column(db.String(500), nullable=True)
+    
+    # Admin Review
+    rejection_reason = db.Column(db.Text, nullable=True)
+    verified_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    verified_at = db.Column(db.DateTime, nullable=True)
+    submitted_at = db.Column(db.DateTime, nullable=True)
+
+    # Relationships
+    user = db.relationship('User', foreign_keys=[user_id], backref='driver_profile', lazy=True)
+    bookings = db.relationship('Booking', backref='driver', lazy=True)
+    reviews = db.relationship('Review', backref='driver', lazy=True)
+    notifications = db.relationship('Notification', backref='driver', lazy=True)
+    verifier = db.relationship('User', foreign_keys=[verified_by], backref='verified_drivers', lazy=True)
+
+class Booking(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
+    pickup_location = db.Column(db.String(200), nullable=False)
+    dropoff_location = db.Column(db.String(200), nullable=False)
+    distance = db.Column(db.Float, nullable=False)  # Distance in km
+    price = db.Column(db.Float, nullable=False)  # Price based on distance
+    status = db.Column(db.String(50), default='pending')  # pending, accepted, completed, cancelled
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    promo_code = db.Column(db.String(50), nullable=True)  # Applied promo code
+    pickup_lat = db.Column(db.Float, nullable=True)  # Pickup coordinates from the search quote, used by dispatch
+    pickup_lng = db.Column(db.Float, nullable=True)
+    assigned_at = db.Column(db.DateTime, default=datetime.utcnow)  # When the current driver was given the booking
+    version = db.Column(db.BigInteger, nullable=True)  # Change stamp, see reserve_booking_versions()
+
+    __table_args__ = (db.Index('idx_booking_driver_id_version', 'driver_id', 'version'),
+                      db.Index('idx_booking_created_at', 'created_at'))
+
+class BookingReassignment(db.Model):
+    """A booking taken from a driver, kept so that driver's order feed can still drop it"""
+    id = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False)
+    from_driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)  # The booking's version once moved
+
+    __table_args__ = (db.Index('idx_booking_reassignment_driver_version', 'from_driver_id', 'version'),)
+
+class Payment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    transaction_id = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(50), default='pending')  # pending, completed, failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Review(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)  # Rating out of 5
+    comment = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SupportTicket(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(50), default='open')  # open, resolved
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    admin_reply = db.Column(db.Text, nullable=True)
+
+class Notification(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=True)
+    message = db.Column(db.String(200), nullable=False)
+    is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PromoCode(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), unique=True, nullable=False)
+    discount = db.Column(db.Float, nullable=False)  # Discount percentage
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Escrow(db.Model):
+    """Escrow model to track held funds between users and drivers"""
+    id = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
+    amount = db.Column(db.Float, nullable=False)  # Total amount held in escrow
+    platform_fee = db.Column(db.Float, nullable=False)  # Platform fee (10%)
+    driver_amount = db.Column(db.Float, nullable=False)  # Amount driver will receive
+    status = db.Column(db.String(50), default='held')  # held, released, refunded, cancelled
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime, nullable=True)
+    refunded_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('idx_escrow_created_at', 'created_at'),)
+    
+    # Relationships
+    booking = db.relationship('Booking', backref='escrow_record', lazy=True, uselist=False)
+    user = db.relationship('User', foreign_keys=[user_id], backref='escrow_payments', lazy=True)
+    driver = db.relationship('Driver', foreign_keys=[driver_id], backref='escrow_earnings', lazy=True)
+
+class BookingTrail(db.Model):
+    """GPS trail recorded while a booking was in progress, stored compactly once it completes"""
+    id = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False, unique=True)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed packed doubles (timestamp, lat, lng)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+@event.listens_for(Booking.status, 'set')
+def restart_accept_timer(booking, value, oldvalue, initiator):
+    """A booking that becomes pending (e.g. once paid) gives its driver a fresh accept window"""
+    if value == 'pending' and oldvalue != 'pending':
+        booking.assigned_at = datetime.utcnow()
+
+class ResourceVersion(db.Model):
+    """Version stamp of an API resource, bumped whenever a row it is built from changes"""
+    key = db.Column(db.String(120), primary_key=True)  # e.g. 'user:12', 'orders:driver:3'
+    version = db.Column(db.BigInteger, nullable=False)
+
+class UnreadCounter(db.Model):
+    """Unread notifications per recipient ('user:<id>' / 'driver:<id>'), kept in step on write"""
+    key = db.Column(db.String(60), primary_key=True)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+
+# Monotonic microsecond stamps for resource versions (booking versions: reserve_booking_versions)
+version_stamp_lock = threading.Lock()
+last_version_stamp = 0
+
+def next_version_stamp():
+    global last_version_stamp
+    with version_stamp_lock:
+        last_version_stamp = max(time.time_ns() // 1000, last_version_stamp + 1)
+        return last_version_stamp
+
+BOOKING_VERSION_KEY = 'sequence:booking'  # ResourceVersion row that hands out booking versions
+
+def reserve_booking_versions(connection, count=1):
+    """First of `count` new booking versions, taken from a counter row in the current transaction
+
+    Updating the row takes the database write lock (a row lock on other databases)
+    until commit, so versions are handed out in commit order: a ?since= cursor can
+    never pass a version whose booking has yet to commit. Versions stay microsecond
+    times, as cursors issued before the counter existed are.
+    """
+    table = ResourceVersion.__table__
+    now = time.time_ns() // 1000
+    advanced = table.c.version + count
+    bump = table.update().where(table.c.key == BOOKING_VERSION_KEY).values(
+        version=db.case((advanced > now, advanced), else_=now)
+    )
+    if not connection.execute(bump).rowcount:
+        latest = db.select(db.literal(BOOKING_VERSION_KEY), db.func.coalesce(db.func.max(Booking.version), 0)).where(
+            Booking.id.isnot(None)  # SQLite needs a WHERE before ON CONFLICT in INSERT ... SELECT
+        )
+        connection.execute(upsert(connection, table).from_select(['key', 'version'], latest).on_conflict_do_nothing())
+        connection.execute(bump)
+    last = connection.execute(db.select(table.c.version).where(table.c.key == BOOKING_VERSION_KEY)).scalar()
+    return last - count + 1
+
+@event.listens_for(Session, 'before_flush')
+def stamp_booking_versions(session, flush_context, instances):
+    """Drivers' order feeds fetch only bookings whose version is newer than their cursor"""
+    changed = [obj for obj in session.new if isinstance(obj, Booking)]
+    changed += [obj for obj in session.dirty
+                if isinstance(obj, Booking) and session.is_modified(obj, include_collections=False)]
+    if changed:
+        first = reserve_booking_versions(session.connection(), len(changed))
+        for offset, obj in enumerate(changed):
+            obj.version = first + offset
+
+@event.listens_for(Session, 'after_flush')
+def record_reassignments(session, flush_context):
+    """Bookings whose driver changed; bulk updates (dispatch) insert these rows themselves"""
+    rows = []
+    for obj in session.dirty:
+        if isinstance(obj, Booking):
+            for previous_driver in inspect(obj).attrs.driver_id.history.deleted:
+                if previous_driver is not None and previous_driver != obj.driver_id:
+                    rows.append({'booking_id': obj.id, 'from_driver_id': previous_driver, 'version': obj.version})
+    if rows:
+        session.connection().execute(BookingReassignment.__table__.insert(), rows)
+
+def changed_resource_keys(obj):
+    """Resource version keys whose responses include this row"""
+    if isinstance(obj, User):
+        yield f'user:{obj.id}'
+    elif isinstance(obj, Driver):
+        yield f'driver:{obj.id}'
+    elif isinstance(obj, Notification):
+        if obj.user_id:
+            yield f'notifications:user:{obj.user_id}'
+        if obj.driver_id:
+            yield f'notifications:driver:{obj.driver_id}'
+    elif isinstance(obj, Booking):
+        yield 'orders:pending'
+        yield f'orders:driver:{obj.driver_id}'
+        for previous_driver in inspect(obj).attrs.driver_id.history.deleted:
+            yield f'orders:driver:{previous_driver}'
+    elif isinstance(obj, Transaction):
+        yield f'transaction:{obj.transaction_id}'
+
+def bump_resource_versions(connection, keys):
+    """Give every key a new stamp in the current transaction, so it rolls back with it"""
+    if not keys:
+        return
+    version = next_version_stamp()
+    statement = upsert(connection, ResourceVersion.__table__)
+    connection.execute(
+        statement.on_conflict_do_update(index_elements=['key'], set_={'version': statement.excluded.version}),
+        [{'key': key, 'version': version} for key in sorted(keys)]
+    )
+
+@event.listens_for(Session, 'after_flush')
+def bump_changed_resources(session, flush_context):
+    keys = set()
+    for obj in session.new | session.deleted:
+        keys.update(changed_resource_keys(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            keys.update(changed_resource_keys(obj))
+    bump_resource_versions(session.connection(), keys)
+
+def notification_channels(notification):
+    if notification.user_id:
+        yield f'user:{notification.user_id}'
+    if notification.driver_id:
+        yield f'driver:{notification.driver_id}'
+
+# Unread notification counters: the count is read by key instead of scanning notifications
+UNREAD_NOTIFICATION = Notification.is_read.isnot(True)  # Legacy rows may hold NULL
+
+def adjust_unread_counters(connection, deltas):
+    """Apply {key: delta} to counters that exist; missing ones are counted on first read
+
+    A counter is seeded by one INSERT ... SELECT COUNT(*) (seed_unread_counter), so a
+    notification written around the first read is either in that count or finds
+    the row here, never neither.
+    """
+    rows = [{'counter_key': key, 'delta': delta} for key, delta in deltas.items() if delta]
+    if rows:
+        connection.execute(
+            UnreadCounter.__table__.update().where(UnreadCounter.key == db.bindparam('counter_key')).values(
+                unread=UnreadCounter.unread + db.bindparam('delta')
+            ),
+            rows
+        )
+
+def seed_unread_counter(connection, key, owner_filter):
+    """Create the counter for key from a count of its unread notifications, in a single statement"""
+    counted = db.select(db.literal(key), db.func.count()).select_from(Notification).where(
+        owner_filter, UNREAD_NOTIFICATION
+    )
+    connection.execute(
+        upsert(connection, UnreadCounter.__table__).from_select(['key', 'unread'], counted).on_conflict_do_nothing()
+    )
+
+def rebuild_unread_counters(connection):
+    """Replace every counter with a fresh count of unread notifications; returns the keys touched"""
+    table = UnreadCounter.__table__
+    keys = set(connection.execute(db.select(table.c.key)).scalars())
+    connection.execute(table.delete())
+    for prefix, owner in (('user:', Notification.user_id), ('driver:', Notification.driver_id)):
+        counts = db.select(db.literal(prefix) + db.cast(owner, db.String), db.func.count()).where(
+            owner.isnot(None), UNREAD_NOTIFICATION
+        ).group_by(owner)
+        connection.execute(table.insert().from_select(['key', 'unread'], counts))
+    keys.update(connection.execute(db.select(table.c.key)).scalars())
+    return keys
+
+@event.listens_for(Session, 'after_flush')
+def track_unread_notifications(session, flush_context):
+    deltas = {}
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Notification) and not obj.is_read:
+            for key in notification_channels(obj):
+                deltas[key] = deltas.get(key, 0) + (1 if obj in session.new else -1)
+    for obj in session.dirty:
+        if isinstance(obj, Notification):
+            history = inspect(obj).attrs.is_read.history
+            was_read = bool(history.deleted[0]) if history.deleted else False
+            if history.added and bool(history.added[0]) != was_read:
+                for key in notification_channels(obj):
+                    deltas[key] = deltas.get(key, 0) + (-1 if obj.is_read else 1)
+    adjust_unread_counters(session.connection(), deltas)
@@ -1,23 +1,56 @@
-from flask import Flask, jsonify, request
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, g, jsonify, make_response, request, send_file, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased, joinedload
 from datetime import datetime, timezone
+from functools import wraps
 from dotenv import load_dotenv
 import os
-import requests
+import hmac
+import secrets
 import uuid
 import base64
-import random
-from requests.auth import HTTPBasicAuth
+import threading
+import atexit
+import time
+import math
+import numpy as np
+from geo_index import geohash_bounds, geohash_encode, haversine_km, haversine_km_many, parse_latlng
+from driver_registry import DriverRecord, DriverRegistry
+from location_ingest import LocationBuffer, LocationFlusher
+from location_trail import TrailStore, encode_polyline, pack_points, unpack_points, points_since
+from pricing import DemandTracker, QuoteError, QuoteSigner, Tariff, demand_factor
+from dispatch import DispatchEngine, DispatchWorker
+from search_cache import SearchCache
+from event_stream import Broadcaster, StreamsFull
+from daraja import DarajaClient
+from structured_log import TraceSampler, configure_logging, get_logger, logging_stats
+from conditional_get import ConditionalStats, make_etag
+from profiling import ProfileStore
+from password_hashing import HashingBusy, PasswordHasher
+from auth_tokens import AuthError, PrincipalCache, TokenSigner
+from json_provider import json_provider_class
+from compression import available_encodings, compress, is_compressible
+from fieldsets import Field, FieldsError, field_columns, requested_fields
+from export_stream import ExportError, chunked, csv_lines, keyset_rows, ndjson_lines, parse_timestamp
+from metrics import QUERY_COUNT_BUCKETS, MetricsRegistry, RequestTally, record_query, track_request, untrack_request
+from poll_hints import (driver_orders_poll_interval, format_poll_interval, payment_poll_interval,
+                        tracking_poll_interval, verification_poll_interval)
+from models import (DEFAULT_DATABASE_URL, UNREAD_NOTIFICATION, Booking, BookingReassignment, BookingTrail, Driver,
+                    Escrow, Notification, Payment, PromoCode, ResourceVersion, Review, SupportTicket, Transaction,
+                    UnreadCounter, User, adjust_unread_counters, bump_resource_versions, check_database_url, db,
+                    notification_channels, rebuild_unread_counters, reserve_booking_versions, seed_unread_counter)
 app = Flask(__name__)
 
 load_dotenv()
 
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=['ETag', 'X-Poll-Interval', 'X-Profile-Id'])  # Enable CORS for all routes
 app.config['SECRET_KEY'] = 'supersecretkey'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///moving_app.db'
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_DATABASE_URI'] = check_database_url(os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL))
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto')  # orjson, stdlib, or auto (orjson when installed)
+app.json = json_provider_class(JSON_PROVIDER)(app)  # ISO-8601 datetimes in every response
+db.init_app(app)
 
 # M-Pesa Daraja API Configuration
 MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY', '').strip()
@@ -46,151 +79,320 @@ if MPESA_ENVIRONMENT == 'sandbox':
     MPESA_API_BASE = 'https://sandbox.safaricom.co.ke'
 else:
     MPESA_API_BASE = 'https://api.safaricom.co.ke'
+MPESA_API_BASE = os.getenv('MPESA_API_BASE') or MPESA_API_BASE  # e.g. a local stub for load tests
+DARAJA_MAX_CONNECTIONS = int(os.getenv('DARAJA_MAX_CONNECTIONS', '200'))  # In-flight Daraja calls (asgi.py)
+
+# Driver search configuration
+DRIVER_SEARCH_RADIUS_KM = float(os.getenv('DRIVER_SEARCH_RADIUS_KM', '20'))
+DRIVER_SEARCH_LIMIT = int(os.getenv('DRIVER_SEARCH_LIMIT', '20'))
+SEARCH_LATENCY_BUDGET_MS = float(os.getenv('SEARCH_LATENCY_BUDGET_MS', '5'))  # Cap on candidate gathering time
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', '5000'))
+ROAD_DISTANCE_FACTOR = float(os.getenv('ROAD_DISTANCE_FACTOR', '1.3'))  # Road distance vs straight line
+DRIVER_AVG_SPEED_KMH = float(os.getenv('DRIVER_AVG_SPEED_KMH', '25'))  # Typical Nairobi traffic speed
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '5'))  # Seconds a cell's candidate list is reused
+SEARCH_CACHE_PRECISION = int(os.getenv('SEARCH_CACHE_PRECISION', '7'))  # Geohash length; 7 is ~150 m cells
+SEARCH_CACHE_OVERFETCH = int(os.getenv('SEARCH_CACHE_OVERFETCH', '2'))  # Candidates cached per requested driver
+
+# Driver location ingestion
+LOCATION_FLUSH_INTERVAL = float(os.getenv('LOCATION_FLUSH_INTERVAL', '5'))  # Seconds between bulk writes
+LOCATION_BATCH_LIMIT = int(os.getenv('LOCATION_BATCH_LIMIT', '1000'))
+LOCATION_MAX_CLOCK_SKEW = float(os.getenv('LOCATION_MAX_CLOCK_SKEW', '30'))  # Seconds a ping may be ahead of server time
+TRAIL_CAPACITY = int(os.getenv('TRAIL_CAPACITY', '2880'))  # Points kept per active booking (4h at 5s pings)
+
+# Pricing - sandbox defaults keep every fare within KES 10-20 for affordable M-Pesa testing
+SANDBOX_PRICING = MPESA_ENVIRONMENT == 'sandbox'
+PRICE_BASE_FARE = float(os.getenv('PRICE_BASE_FARE', '10' if SANDBOX_PRICING else '500'))
+PRICE_PER_KM = float(os.getenv('PRICE_PER_KM', '0.4' if SANDBOX_PRICING else '60'))
+PRICE_MIN = float(os.getenv('PRICE_MIN', '10' if SANDBOX_PRICING else '500'))
+PRICE_MAX = float(os.getenv('PRICE_MAX', '20' if SANDBOX_PRICING else '0'))  # 0 = no ceiling
+PRICE_SURGE_CAP = float(os.getenv('PRICE_SURGE_CAP', '2.0'))
+QUOTE_TTL_SECONDS = int(os.getenv('QUOTE_TTL_SECONDS', '300'))
+QUOTE_SECRET = os.getenv('QUOTE_SECRET', '').strip()  # Signs quote ids; keep apart from AUTH_TOKEN_SECRET
+
+# Dispatch - periodic reassignment of pending bookings
+DISPATCH_ENABLED = os.getenv('DISPATCH_ENABLED', 'true').lower() == 'true'
+DISPATCH_INTERVAL = float(os.getenv('DISPATCH_INTERVAL', '15'))  # Seconds between dispatch ticks
+DISPATCH_ACCEPT_TIMEOUT = float(os.getenv('DISPATCH_ACCEPT_TIMEOUT', '120'))  # Seconds a driver has to accept
+DISPATCH_MAX_LOAD = int(os.getenv('DISPATCH_MAX_LOAD', '3'))  # Open bookings per driver
+DISPATCH_CANDIDATES = int(os.getenv('DISPATCH_CANDIDATES', '10'))  # Nearest drivers scored per booking
+DISPATCH_LOCK_FILE = os.getenv('DISPATCH_LOCK_FILE') or None  # With several server processes, one runs dispatch
+
+# Server-Sent Event streams
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_REPLAY_LIMIT = int(os.getenv('STREAM_REPLAY_LIMIT', '500'))  # Missed rows replayed on reconnect
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', '0'))  # Open streams per process, 0 for no limit (serve.py sets one)
+NOTIFICATION_MARK_READ_LIMIT = int(os.getenv('NOTIFICATION_MARK_READ_LIMIT', '500'))  # Ids per bulk mark-read
+
+# Response compression (gzip, or brotli when installed)
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))  # Smaller bodies are sent as is; 0 disables
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+
+# Admin exports
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))  # Rows read per query while streaming
+
+# Logging - key/value records written by a background thread
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'logfmt')  # logfmt or json
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Records buffered before new ones are dropped
+LOG_TRACE_SAMPLE = os.getenv('LOG_TRACE_SAMPLE', '')  # Per-route debug traces, e.g. "search_drivers=0.01,*=0"
+
+# Password hashing - on a bounded pool so a burst of logins cannot take every core
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')  # e.g. pbkdf2:sha256:600000, scrypt:32768:8:1
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))  # Hashes computed at once per process
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '16'))  # Hashes waiting beyond this are answered 503
+
+# Authentication - signed tokens from /api/login, sent as "Authorization: Bearer <token>"
+AUTH_REQUIRED = os.getenv('AUTH_REQUIRED', 'true').lower() == 'true'  # false: legacy clients may omit the token
+AUTH_TOKEN_SECRET = os.getenv('AUTH_TOKEN_SECRET', '').strip()  # Only with AUTH_REQUIRED=false may it be unset
+if AUTH_REQUIRED and not AUTH_TOKEN_SECRET:
+    raise RuntimeError('Set AUTH_TOKEN_SECRET (e.g. python -c "import secrets; print(secrets.token_hex(32))"), '
+                       'or AUTH_REQUIRED=false to let legacy clients call without a token')
+AUTH_TOKEN_TTL = int(os.getenv('AUTH_TOKEN_TTL', '43200'))  # Seconds a token stays valid (12 h)
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', '60'))  # Seconds an account's profile is reused
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', '4096'))
+
+# Profiling - single requests on demand, with ?profile=<PROFILE_TOKEN> or an X-Profile-Token header
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '').strip()  # Empty disables profiling and its admin endpoints
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))  # Most recent profiles kept on disk
+
+configure_logging(LOG_LEVEL, json_lines=LOG_FORMAT == 'json', queue_size=LOG_QUEUE_SIZE)
+trace_sampler = TraceSampler(LOG_TRACE_SAMPLE)
+log = get_logger('movers')
+search_log = get_logger('movers.search')
+payment_log = get_logger('movers.payments')
+
+# Metrics - served on /metrics in the Prometheus text format
+metrics = MetricsRegistry()
+http_requests = metrics.counter('movers_http_requests_total', 'Requests by route, method and status',
+                                ('route', 'method', 'status'))
+http_latency = metrics.histogram('movers_http_request_duration_seconds', 'Request latency by route',
+                                 ('route', 'method'))
+request_queries = metrics.histogram('movers_http_request_db_queries', 'SQL statements per request by route',
+                                    ('route',), QUERY_COUNT_BUCKETS)
+request_query_time = metrics.histogram('movers_http_request_db_seconds', 'SQL time per request by route',
+                                       ('route',))
+db_queries = metrics.counter('movers_db_queries_total', 'SQL statements executed, background work included')
+db_query_time = metrics.counter('movers_db_query_seconds_total', 'Time spent executing SQL statements')
+db_commits = metrics.counter('movers_db_commits_total', 'Session commits')
+db_rollbacks = metrics.counter('movers_db_rollbacks_total', 'Session rollbacks')
+daraja_latency = metrics.histogram('movers_daraja_request_duration_seconds', 'Daraja API call latency by endpoint',
+                                   ('endpoint', 'status'))
+
+# SQL statement, commit and rollback counts
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started']
+    db_queries.inc()
+    db_query_time.inc(amount=seconds)
+    record_query(seconds)
+
+@event.listens_for(Session, 'after_commit')
+def count_commit(session):
+    db_commits.inc()
+
+@event.listens_for(Session, 'after_rollback')
+def count_rollback(session):
+    db_rollbacks.inc()
+
+def resource_versions(*keys):
+    """Current stamps for keys in one indexed lookup; 0 for keys never written"""
+    rows = dict(db.session.query(ResourceVersion.key, ResourceVersion.version).filter(
+        ResourceVersion.key.in_(keys)
+    ).all())
+    return tuple(rows.get(key, 0) for key in keys)
+
+conditional_stats = ConditionalStats()
+
+def conditional(version_token):
+    """Answer If-None-Match with 304 while the resource's version stamps are unchanged
+
+    version_token(**view_args) returns a tuple of stamps, or None when the view
+    must run anyway. Stamps are read before the view, so a write racing the
+    request can only make the tag older than the body, never newer.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            token = version_token(**kwargs)
+            if token is None:
+                if DARAJA_RESUME_KEY not in request.environ:  # Counted on the request's first pass
+                    conditional_stats.record(request.endpoint, uncacheable=True)
+                return view(**kwargs)
+            etag = make_etag(token)
+            if request.if_none_match.contains_weak(etag):
+                conditional_stats.record(request.endpoint, not_modified=True)
+                response = make_response('', 304)
+            else:
+                conditional_stats.record(request.endpoint)
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'  # Browsers revalidate with If-None-Match
+            return response
+        return wrapper
+    return decorator
+
+def poll_interval(policy):
+    """Tell polling clients when to ask again (X-Poll-Interval: seconds or "stop")
+
+    policy(**view_args) runs after the view, so the hint reflects any change the
+    view made; it is also attached to 304s, which skip the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            response = make_response(view(**kwargs))
+            if response.status_code in (200, 304):
+                response.headers['X-Poll-Interval'] = format_poll_interval(policy(**kwargs))
+            return response
+        return wrapper
+    return decorator
+
+def every(seconds):
+    """Fixed polling policy for resources that are also pushed or rarely change"""
+    return lambda **view_args: seconds
+
+# Live push: committed rows are published to per-user/driver channels for SSE clients
+broadcaster = Broadcaster(max_subscribers=STREAM_MAX_CLIENTS)
+SSE_STREAM_KEY = 'movers.sse_stream'  # (subscription, replay) for servers that stream asynchronously
+BOOKING_FINAL_STATUSES = ('completed', 'cancelled')  # Tracking streams end at these
+
+def notification_payload(notification):
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'is_read': notification.is_read or False,
+        'created_at': (notification.created_at or datetime.utcnow()).isoformat()
+    }
+
+@event.listens_for(Session, 'after_flush')
+def collect_new_notifications(session, flush_context):
+    """Snapshot notifications inserted by this flush; they are published only once committed"""
+    pending = session.info.setdefault('pending_events', [])
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            payload = notification_payload(obj)
+            pending.extend((channel, obj.id, 'notification', payload, False)
+                           for channel in notification_channels(obj))
+
+@event.listens_for(Session, 'after_flush')
+def collect_booking_status_changes(session, flush_context):
+    """Status changes of bookings someone is tracking; a finished booking closes its stream"""
+    pending = session.info.setdefault('pending_events', [])
+    for obj in session.dirty:
+        if not isinstance(obj, Booking):
+            continue
+        channel = f'booking:{obj.id}'
+        if broadcaster.has_subscribers(channel) and inspect(obj).attrs.status.history.added:
+            pending.append((channel, None, 'status', {'status': obj.status},
+                            obj.status in BOOKING_FINAL_STATUSES))
+
+def order_event(booking_id, status, version):
+    """Order feed events are small change notices; clients fetch new bookings via ?since="""
+    return {'booking_id': booking_id, 'status': status, 'version': version}
+
+@event.listens_for(Session, 'after_flush')
+def collect_order_changes(session, flush_context):
+    """New bookings and status or driver changes, for the assigned drivers' order feeds"""
+    pending = session.info.setdefault('pending_events', [])
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            pending.append((f'orders:{obj.driver_id}', obj.version, 'order',
+                            order_event(obj.id, obj.status, obj.version), False))
+    for obj in session.dirty:
+        if not isinstance(obj, Booking):
+            continue
+        attrs = inspect(obj).attrs
+        if attrs.driver_id.history.deleted:
+            for previous_driver in attrs.driver_id.history.deleted:
+                pending.append((f'orders:{previous_driver}', obj.version, 'order',
+                                order_event(obj.id, 'reassigned', obj.version), False))
+        if attrs.status.history.added or attrs.driver_id.history.added:
+            pending.append((f'orders:{obj.driver_id}', obj.version, 'order',
+                            order_event(obj.id, obj.status, obj.version), False))
+
+@event.listens_for(Session, 'after_flush')
+def collect_principal_changes(session, flush_context):
+    """Accounts whose cached profile (name, role, ban, driver id) may have changed"""
+    changed = session.info.setdefault('changed_principals', set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+        elif isinstance(obj, Driver):
+            changed.add(obj.user_id)
+
+@event.listens_for(Session, 'after_commit')
+def publish_committed_events(session):
+    for channel, event_id, event_type, payload, close in session.info.pop('pending_events', []):
+        broadcaster.publish(channel, event_id, event_type, payload)
+        if close:
+            broadcaster.close(channel)
+
+    principal_cache.invalidate(session.info.pop('changed_principals', ()))
+
+@event.listens_for(Session, 'after_rollback')
+def discard_uncommitted_events(session):
+    session.info.pop('pending_events', None)
+    session.info.pop('changed_principals', None)
+
+def last_event_id(cast=int):
+    """Reconnect cursor: the browser's Last-Event-ID header, else ?last_event_id= on first connect"""
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return cast(float(value)) if value else None
+    except ValueError:
+        return None
 
-# Models
-class Transaction(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=True)
-    transaction_id = db.Column(db.String(100), unique=True, nullable=False)
-    mpesa_receipt_number = db.Column(db.String(100), nullable=True)
-    checkout_request_id = db.Column(db.String(100), nullable=True)
-    merchant_request_id = db.Column(db.String(100), nullable=True)
-    amount = db.Column(db.Float, nullable=False)
-    phone_number = db.Column(db.String(20), nullable=True)
-    type = db.Column(db.String(50), nullable=False)  # deposit, payment, withdrawal, escrow_release, refund, booking_payment
-    status = db.Column(db.String(50), default='pending')  # pending, completed, failed
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(150), nullable=False)
-    phone = db.Column(db.String(20), nullable=False)
-    email = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
-    role = db.Column(db.String(50), nullable=False, default='user')  # user, driver, admin
-    is_banned = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    balance = db.Column(db.Float, default=0.0)  # Wallet balance
-
-    # Relationships
-    bookings = db.relationship('Booking', backref='user', lazy=True)
-    payments = db.relationship('Payment', backref='user', lazy=True)
-    reviews = db.relationship('Review', backref='user', lazy=True)
-    support_tickets = db.relationship('SupportTicket', backref='user', lazy=True)
-    notifications = db.relationship('Notification', backref='user', lazy=True)
-
-class Driver(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    vehicle_type = db.Column(db.String(100), nullable=False)
-    license_plate = db.Column(db.String(50), nullable=False)
-    is_available = db.Column(db.Boolean, default=True)
-    earnings = db.Column(db.Float, default=0.0)
-    ratings = db.Column(db.Float, default=0.0)
-    completed_orders = db.Column(db.Integer, default=0)
-    live_location = db.Column(db.String(100), nullable=True)  # Latitude, Longitude
-
-    # Verification System
-    is_verified = db.Column(db.Boolean, default=False)
-    verification_status = db.Column(db.String(50), default='pending')  # pending, under_review, approved, rejected
-    
-    # Driver Documents
-    license_number = db.Column(db.String(100), nullable=True)
-    license_expiry = db.Column(db.DateTime, nullable=True)
-    drivers_license_url = db.Column(db.String(500), nullable=True)
-    
-    # Vehicle Documents
-    vehicle_registration_url = db.Column(db.String(500), nullable=True)
-    insurance_certificate_url = db.Column(db.String(500), nullable=True)
-    insurance_expiry = db.Column(db.DateTime, nullable=True)
-    vehicle_photo_url = db.Column(db.String(500), nullable=True)
-    
-    # Profile
-    profile_photo_url = db.Column(db.String(500), nullable=True)
-    
-    # Admin Review
-    rejection_reason = db.Column(db.Text, nullable=True)
-    verified_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-    verified_at = db.Column(db.DateTime, nullable=True)
-    submitted_at = db.Column(db.DateTime, nullable=True)
-
-    # Relationships
-    user = db.relationship('User', foreign_keys=[user_id], backref='driver_profile', lazy=True)
-    bookings = db.relationship('Booking', backref='driver', lazy=True)
-    reviews = db.relationship('Review', backref='driver', lazy=True)
-    notifications = db.relationship('Notification', backref='driver', lazy=True)
-    verifier = db.relationship('User', foreign_keys=[verified_by], backref='verified_drivers', lazy=True)
-
-class Booking(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
-    pickup_location = db.Column(db.String(200), nullable=False)
-    dropoff_location = db.Column(db.String(200), nullable=False)
-    distance = db.Column(db.Float, nullable=False)  # Distance in km
-    price = db.Column(db.Float, nullable=False)  # Price based on distance
-    status = db.Column(db.String(50), default='pending')  # pending, accepted, completed, cancelled
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    promo_code = db.Column(db.String(50), nullable=True)  # Applied promo code
-
-class Payment(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    transaction_id = db.Column(db.String(100), nullable=False)
-    status = db.Column(db.String(50), default='pending')  # pending, completed, failed
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Review(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
-    rating = db.Column(db.Integer, nullable=False)  # Rating out of 5
-    comment = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class SupportTicket(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    subject = db.Column(db.String(200), nullable=False)
-    message = db.Column(db.Text, nullable=False)
-    status = db.Column(db.String(50), default='open')  # open, resolved
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    admin_reply = db.Column(db.Text, nullable=True)
-
-class Notification(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=True)
-    message = db.Column(db.String(200), nullable=False)
-    is_read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class PromoCode(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    code = db.Column(db.String(50), unique=True, nullable=False)
-    discount = db.Column(db.Float, nullable=False)  # Discount percentage
-    is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Escrow(db.Model):
-    """Escrow model to track held funds between users and drivers"""
-    id = db.Column(db.Integer, primary_key=True)
-    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False, unique=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)  # Total amount held in escrow
-    platform_fee = db.Column(db.Float, nullable=False)  # Platform fee (10%)
-    driver_amount = db.Column(db.Float, nullable=False)  # Amount driver will receive
-    status = db.Column(db.String(50), default='held')  # held, released, refunded, cancelled
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    released_at = db.Column(db.DateTime, nullable=True)
-    refunded_at = db.Column(db.DateTime, nullable=True)
-    
-    # Relationships
-    booking = db.relationship('Booking', backref='escrow_record', lazy=True, uselist=False)
-    user = db.relationship('User', foreign_keys=[user_id], backref='escrow_payments', lazy=True)
-    driver = db.relationship('Driver', foreign_keys=[driver_id], backref='escrow_earnings', lazy=True)
+def open_subscription(channel):
+    """(subscription, None), or (None, 503 response) when STREAM_MAX_CLIENTS streams are open"""
+    try:
+        return broadcaster.subscribe(channel), None
+    except StreamsFull:
+        response = jsonify({'error': 'Too many live connections right now, please try again shortly'})
+        response.headers['Retry-After'] = str(int(STREAM_HEARTBEAT_SECONDS))
+        return None, (response, 503)
+
+def sse_response(subscription, replay=()):
+    """The stream as a WSGI body; asgi.py instead awaits subscription.astream from SSE_STREAM_KEY"""
+    request.environ[SSE_STREAM_KEY] = (subscription, replay)
+    response = Response(subscription.stream(replay, heartbeat=STREAM_HEARTBEAT_SECONDS),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    response.call_on_close(subscription.close)
+    return response
+
+def notification_stream(channel, owner_filter):
+    """Subscribe first, then replay rows newer than the client's cursor from the database"""
+    subscription, busy = open_subscription(channel)
+    if busy:
+        return busy
+    cursor = last_event_id()
+    replay = []
+    if cursor is not None:
+        missed = Notification.query.filter(owner_filter, Notification.id > cursor).order_by(
+            Notification.id
+        ).limit(STREAM_REPLAY_LIMIT).all()
+        replay = [(n.id, 'notification', notification_payload(n)) for n in missed]
+    db.session.remove()  # Do not hold a connection for the lifetime of the stream
+    return sse_response(subscription, replay)
+
+# Unread counts (counters are kept in step by models.track_unread_notifications)
+def unread_count(key, owner_filter):
+    """O(1) read of a maintained counter; the first read for a recipient counts and stores it"""
+    unread = db.session.query(UnreadCounter.unread).filter_by(key=key).scalar()
+    if unread is None:
+        seed_unread_counter(db.session.connection(), key, owner_filter)
+        unread = db.session.query(UnreadCounter.unread).filter_by(key=key).scalar()
+        db.session.commit()
+    return unread
 
 # Helper Functions
 def validate_user(data):
@@ -198,29 +400,453 @@ def validate_user(data):
         return False
     return True
 
+# In-memory registry of bookable drivers (verified, available and not banned)
+driver_registry = DriverRegistry()
+search_cache = SearchCache(SEARCH_CACHE_TTL)
+
+def is_driver_bookable(driver, user):
+    return bool(driver.is_available and driver.is_verified and not user.is_banned)
+
+def make_driver_record(driver, user):
+    # Positions still waiting in the location buffer are newer than the database copy
+    live = location_buffer.latest(driver.id)
+    latitude, longitude = (live[0], live[1]) if live else (driver.latitude, driver.longitude)
+    return DriverRecord(
+        driver_id=driver.id,
+        user_id=driver.user_id,
+        name=user.name,
+        vehicle_type=driver.vehicle_type,
+        license_plate=driver.license_plate,
+        ratings=driver.ratings,
+        completed_orders=driver.completed_orders,
+        latitude=latitude,
+        longitude=longitude
+    )
+
+def load_bookable_driver_records():
+    """Build registry records for every bookable driver in one JOIN query"""
+    results = db.session.query(Driver, User).join(
+        User, Driver.user_id == User.id
+    ).filter(
+        Driver.is_available == True,
+        Driver.is_verified == True,
+        User.is_banned.isnot(True)
+    ).all()
+    return [make_driver_record(driver, user) for driver, user in results]
+
+def load_driver_registry():
+    """Rebuild the driver registry from the database"""
+    driver_registry.rebuild(load_bookable_driver_records())
+    search_cache.clear()
+    log.info('driver_registry.loaded', drivers=len(driver_registry))
+
+def ensure_driver_registry():
+    if not driver_registry.loaded:
+        load_driver_registry()
+
+def sync_driver_registry(driver):
+    """Add, refresh or drop a driver in the registry after a committed change"""
+    if not driver_registry.loaded:
+        return  # The next search rebuilds from the database anyway
+    user = driver.user
+    if is_driver_bookable(driver, user):
+        record = make_driver_record(driver, user)
+        driver_registry.upsert(record)
+        search_cache.invalidate_driver(driver.id, record.latitude, record.longitude)
+    else:
+        driver_registry.remove(driver.id)
+        search_cache.invalidate_driver(driver.id)
+
+# Driver GPS pings are coalesced in memory and flushed to the database in bulk
+location_buffer = LocationBuffer()
+location_flusher = None
+location_flusher_lock = threading.Lock()
+
+def flush_driver_locations(positions):
+    """Write buffered positions with one bulk UPDATE; returns the number of rows written"""
+    with app.app_context():
+        driver_ids = list(positions)
+        known_ids = set()
+        for i in range(0, len(driver_ids), 500):  # Stay under SQLite's bound-parameter limit
+            chunk = driver_ids[i:i + 500]
+            known_ids.update(row[0] for row in db.session.query(Driver.id).filter(Driver.id.in_(chunk)).all())
+
+        unknown_ids = set(driver_ids) - known_ids
+        if unknown_ids:
+            location_buffer.forget(unknown_ids)
+
+        rows = [{
+            'id': driver_id,
+            'latitude': lat,
+            'longitude': lng,
+            'live_location': f'{lat},{lng}'
+        } for driver_id, (lat, lng, _) in positions.items() if driver_id in known_ids]
+        if rows:
+            db.session.bulk_update_mappings(Driver, rows)
+            db.session.commit()
+        return len(rows)
+
+def ensure_location_flusher():
+    """Start the background flusher on first use"""
+    global location_flusher
+    if location_flusher is not None:
+        return
+    with location_flusher_lock:
+        if location_flusher is None:
+            location_flusher = LocationFlusher(location_buffer, flush_driver_locations, LOCATION_FLUSH_INTERVAL)
+            location_flusher.start()
+            atexit.register(location_flusher.stop)
+
+# Position trails for bookings that are in progress
+trail_store = TrailStore(TRAIL_CAPACITY)
+
+def load_active_trails():
+    """Start empty trails for accepted bookings after a restart"""
+    accepted = db.session.query(Booking.id, Booking.driver_id).filter_by(status='accepted').all()
+    for booking_id, driver_id in accepted:
+        trail_store.start(booking_id, driver_id)
+    trail_store.loaded = True
+
+def ensure_trail_store():
+    if not trail_store.loaded:
+        with app.app_context():
+            load_active_trails()
+
+def trail_payload(points):
+    """Encode trail points for the tracking API; last_timestamp is the next `since` cursor"""
+    return {
+        'polyline': encode_polyline(points),
+        'point_count': len(points),
+        'first_timestamp': points[0][0] if points else None,
+        'last_timestamp': points[-1][0] if points else None
+    }
+
+def position_payload(timestamp, lat, lng):
+    return {'latitude': lat, 'longitude': lng, 'timestamp': timestamp}
+
+# Batch dispatch: reassign pending bookings whose driver went offline or did not accept in time
+dispatch_engine = DispatchEngine(driver_registry, DISPATCH_ACCEPT_TIMEOUT, DISPATCH_MAX_LOAD,
+                                 DISPATCH_CANDIDATES, DRIVER_SEARCH_RADIUS_KM)
+dispatch_worker = None
+dispatch_worker_lock = threading.Lock()
+
+def run_dispatch():
+    """Run one dispatch tick over every pending booking and apply the reassignments"""
+    with app.app_context():
+        ensure_driver_registry()
+        start = time.perf_counter()
+        pending = db.session.query(
+            Booking.id, Booking.driver_id, Booking.pickup_lat, Booking.pickup_lng,
+            Booking.assigned_at, Booking.user_id, Driver.vehicle_type
+        ).outerjoin(Driver, Driver.id == Booking.driver_id).filter(Booking.status == 'pending').all()
+        loads = dict(db.session.query(Booking.driver_id, db.func.count(Booking.id)).filter(
+            Booking.status.in_(['pending', 'accepted'])
+        ).group_by(Booking.driver_id).all())
+
+        # The customer booked a kind of vehicle; a replacement driver must have the same
+        bookings = [(booking_id, driver_id, lat, lng,
+                     assigned_at.replace(tzinfo=timezone.utc).timestamp() if assigned_at else None,
+                     vehicle_type)
+                    for booking_id, driver_id, lat, lng, assigned_at, _, vehicle_type in pending]
+        assignments = dispatch_engine.plan(bookings, loads)
+
+        user_ids = {row[0]: row[5] for row in pending}
+        now = datetime.now(timezone.utc)
+        reassigned = []
+        moves = []  # BookingReassignment rows, so the previous drivers' feeds drop these bookings
+        notifications = []
+        # Bulk updates bypass the flush hooks, so order feed events and versions are handled here
+        order_events = db.session.info.setdefault('pending_events', [])
+        changed_order_lists = set()
+        for booking_id, from_driver, to_driver, distance in assignments:
+            # Conditional update: a driver accepting at the same moment keeps the booking
+            version = reserve_booking_versions(db.session.connection())
+            updated = Booking.query.filter_by(id=booking_id, driver_id=from_driver, status='pending').update(
+                {'driver_id': to_driver, 'assigned_at': now, 'version': version}, synchronize_session=False
+            )
+            if not updated:
+                continue
+            reassigned.append(booking_id)
+            moves.append({'booking_id': booking_id, 'from_driver_id': from_driver, 'version': version})
+            changed_order_lists.update(('orders:pending', f'orders:driver:{from_driver}', f'orders:driver:{to_driver}'))
+            order_events.append((f'orders:{from_driver}', version, 'order',
+                                 order_event(booking_id, 'reassigned', version), False))
+            order_events.append((f'orders:{to_driver}', version, 'order',
+                                 order_event(booking_id, 'pending', version), False))
+            record = driver_registry.get(to_driver)
+            driver_name = record.name if record else 'a new driver'
+            notifications.extend([
+                Notification(driver_id=to_driver,
+                             message=f'Booking #{booking_id} has been assigned to you ({distance:.1f} km to pickup). Please accept it.'),
+                Notification(driver_id=from_driver,
+                             message=f'Booking #{booking_id} was reassigned to another driver.'),
+                Notification(user_id=user_ids[booking_id],
+                             message=f'Your booking #{booking_id} has been reassigned to {driver_name}, {distance:.1f} km away.')
+            ])
+
+        # Escrow follows the booking to its new driver
+        new_drivers = {booking_id: to_driver for booking_id, _, to_driver, _ in assignments}
+        for i in range(0, len(reassigned), 500):  # Stay under SQLite's bound-parameter limit
+            chunk = reassigned[i:i + 500]
+            escrows = db.session.query(Escrow.id, Escrow.booking_id).filter(Escrow.booking_id.in_(chunk)).all()
+            db.session.bulk_update_mappings(Escrow, [
+                {'id': escrow_id, 'driver_id': new_drivers[booking_id]} for escrow_id, booking_id in escrows
+            ])
+        db.session.add_all(notifications)
+        if reassigned:
+            db.session.execute(BookingReassignment.__table__.insert(), moves)
+            bump_resource_versions(db.session.connection(), changed_order_lists)
+        db.session.commit()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if reassigned:
+            log.info('dispatch.tick', reassigned=len(reassigned), pending=len(pending), elapsed_ms=round(elapsed_ms, 1))
+        return {
+            'pending': len(pending),
+            'reassigned': len(reassigned),
+            'booking_ids': reassigned,
+            'elapsed_ms': round(elapsed_ms, 2)
+        }
+
+def ensure_dispatch_worker():
+    """Start the background dispatch loop on first use"""
+    global dispatch_worker
+    if dispatch_worker is not None or not DISPATCH_ENABLED:
+        return
+    with dispatch_worker_lock:
+        if dispatch_worker is None:
+            dispatch_worker = DispatchWorker(run_dispatch, DISPATCH_INTERVAL, DISPATCH_LOCK_FILE)
+            dispatch_worker.start()
+            atexit.register(dispatch_worker.stop)
+
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_KEEP)
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE)
+
+def has_profile_token():
+    token = request.headers.get('X-Profile-Token') or request.args.get('profile') or ''
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+@app.before_request
+def start_request_profile():
+    if PROFILE_TOKEN and request.endpoint not in PROFILE_ENDPOINTS and has_profile_token():
+        request.environ[PROFILE_RUN_KEY] = profile_store.start(request.endpoint)
+
+@app.before_request
+def start_request_metrics():
+    # Under asgi.py a payment request is dispatched twice and keeps one tally
+    track_request(request.environ.setdefault(REQUEST_TALLY_KEY, RequestTally()))
+
+@app.before_request
+def start_background_workers():
+    ensure_dispatch_worker()
+
+@app.before_request
+def start_request_trace():
+    trace_sampler.start(request.endpoint)
+
+@app.after_request
+def save_request_profile(response):
+    run = request.environ.pop(PROFILE_RUN_KEY, None)
+    if run is not None:
+        profile_store.save(run, method=request.method, path=request.path, status=response.status_code)
+        response.headers['X-Profile-Id'] = run.name
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    if DARAJA_PLAN_KEY in request.environ:
+        return response  # Deferred to asgi.py; recorded when the request resumes
+    tally = request.environ.get(REQUEST_TALLY_KEY)
+    if tally is None:
+        return response  # Failed before the before_request hooks ran
+    route = request.endpoint or 'unmatched'
+    http_requests.inc(route, request.method, response.status_code)
+    http_latency.observe(time.perf_counter() - tally.started, route, request.method)
+    request_queries.observe(tally.queries, route)
+    request_query_time.observe(tally.query_seconds, route)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli large bodies the client accepts; streams (SSE, exports) are left alone"""
+    if not COMPRESS_MIN_BYTES or not is_compressible(response.mimetype):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or (response.content_length or 0) < COMPRESS_MIN_BYTES):
+        return response
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    response.set_data(compress(response.get_data(), encoding, COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # Another byte representation of the same version
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    trace_sampler.end()
+    untrack_request()
+    run = request.environ.pop(PROFILE_RUN_KEY, None)
+    if run is not None:
+        run.stop()  # The response was never finalized; nothing to save
+
 # Create Admin User
 def create_admin_user():
-    admin_password = generate_password_hash('admin#cuba', method='pbkdf2:sha256')
     admin_email = 'admin@movingapp.com'
 
     admin = User.query.filter_by(email=admin_email).first()
-    if not admin:
+    if not admin:  # Hash only for a new database, not on every start
         admin = User(
             name='Admin',
             phone='1234567890',
             email=admin_email,
-            password=admin_password,
+            password=password_hasher.hash('admin#cuba'),
             role='admin'
         )
         db.session.add(admin)
         db.session.commit()
-        print("Admin user created successfully.")
+        log.info('admin.created', email=admin_email)
 # Routes
 @app.route('/')
 def landing_page():
     return jsonify({'message': 'Welcome to the Moving App API!'})
 
 # Authentication
+if not AUTH_TOKEN_SECRET:
+    log.warning('auth.ephemeral_secret', note='AUTH_TOKEN_SECRET is not set; tokens stop working when the server '
+                                              'restarts and only the process that issued them accepts them')
+token_signer = TokenSigner(AUTH_TOKEN_SECRET or secrets.token_hex(32), AUTH_TOKEN_TTL)
+PUBLIC_ENDPOINTS = frozenset({'login', 'register', 'mpesa_callback', 'b2c_result_callback', 'b2c_timeout_callback',
+                              'list_profiles', 'download_profile'})  # Profile endpoints check the profile token instead
+STREAM_ENDPOINTS = frozenset({'driver_order_stream', 'track_driver_stream', 'user_notification_stream',
+                              'driver_notification_stream'})  # EventSource cannot send headers
+# Routes that move money; with /api/admin/ and /api/debug/ they need a token even with AUTH_REQUIRED=false
+TOKEN_ONLY_ENDPOINTS = frozenset({'book_driver', 'book_driver_with_mpesa', 'create_deposit', 'mpesa_stk_push',
+                                  'complete_order', 'user_cancel_order', 'driver_cancel_order', 'driver_withdraw'})
+
+def token_required():
+    return (AUTH_REQUIRED or request.endpoint in TOKEN_ONLY_ENDPOINTS
+            or request.path.startswith(('/api/admin/', '/api/debug/')))
+
+def load_principal_profile(user_id):
+    row = db.session.query(
+        User.id, User.name, User.email, User.phone, User.role, User.is_banned, Driver.id
+    ).outerjoin(Driver, Driver.user_id == User.id).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    return {'user_id': row[0], 'name': row[1], 'email': row[2], 'phone': row[3], 'role': row[4],
+            'is_banned': bool(row[5]), 'driver_id': row[6]}
+
+principal_cache = PrincipalCache(load_principal_profile, PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_SIZE)
+
+def request_token():
+    header = request.headers.get('Authorization', '')
+    if header[:7].lower() == 'bearer ':
+        return header[7:].strip()
+    if request.endpoint in STREAM_ENDPOINTS:
+        return request.args.get('access_token')
+    return None
+
+def current_principal():
+    """Principal of the request's access token, None for requests sent without one"""
+    return g.get('principal')
+
+def same_id(a, b):
+    return a is not None and b is not None and str(a) == str(b)  # JSON bodies may send ids as strings
+
+def booking_owners(booking_id):
+    return db.session.query(Booking.user_id, Booking.driver_id).filter(Booking.id == booking_id).first()
+
+def transaction_owners(transaction_id):
+    row = db.session.query(Transaction.user_id).filter(Transaction.transaction_id == transaction_id).first()
+    return (row[0], None) if row else None
+
+def notification_owners(notification_id):
+    return db.session.query(Notification.user_id, Notification.driver_id).filter(
+        Notification.id == notification_id
+    ).first()
+
+# (user id, driver id) a resource belongs to, by the id that names it in a URL or body
+RESOURCE_OWNERS = {
+    'booking_id': booking_owners,
+    'transaction_id': transaction_owners,
+    'notification_id': notification_owners,
+}
+
+def request_ids(view_args, args, body):
+    """(name, value) of every id in the URL, query string and JSON body, batch items included"""
+    sources = [view_args, args]
+    if isinstance(body, dict):
+        sources.append(body)
+        points = body.get('points')  # update-locations batches
+        if isinstance(points, list):
+            sources.extend(point for point in points if isinstance(point, dict))
+    for source in sources:
+        for name in ('user_id', 'driver_id', *RESOURCE_OWNERS):
+            value = source.get(name)
+            if value is not None and value != '':
+                yield name, value
+
+def principal_allowed(principal, path, view_args, args, body):
+    """Admins may call anything; others only non-admin routes whose ids and resources are their own"""
+    if principal.is_admin:
+        return True
+    if path.startswith('/api/admin/'):
+        return False
+    for name, value in request_ids(view_args, args, body):
+        if name == 'user_id':
+            allowed = same_id(value, principal.user_id)
+        elif name == 'driver_id':
+            # On /api/user/ routes driver_id is the driver being booked or reviewed, not the caller
+            allowed = path.startswith('/api/user/') or same_id(value, principal.driver_id)
+        else:
+            owners = RESOURCE_OWNERS[name](value)
+            if owners is None:
+                continue  # The view answers 404
+            owner_user_id, owner_driver_id = owners
+            if path.startswith('/api/driver/'):
+                allowed = same_id(owner_driver_id, principal.driver_id)
+            elif path.startswith('/api/user/'):
+                allowed = same_id(owner_user_id, principal.user_id)
+            else:
+                allowed = same_id(owner_user_id, principal.user_id) or same_id(owner_driver_id, principal.driver_id)
+        if not allowed:
+            return False
+    return True
+
+@app.before_request
+def authenticate_request():
+    """Check the access token against the route; with AUTH_REQUIRED=false, ids in token-less
+    requests to other routes are trusted as before"""
+    if request.method == 'OPTIONS' or not request.path.startswith('/api/') or request.endpoint in PUBLIC_ENDPOINTS:
+        return None  # CORS preflights never carry credentials
+    token = request_token()
+    if not token:
+        if token_required():
+            return jsonify({'error': 'Authentication required'}), 401
+        return None
+    try:
+        principal = token_signer.verify(token)
+    except AuthError as e:
+        return jsonify({'error': str(e)}), 401
+    profile = principal_cache.get(principal.user_id)
+    if profile is None or profile['role'] != principal.role:
+        return jsonify({'error': 'Session is no longer valid, please log in again'}), 401
+    if profile['is_banned']:
+        return jsonify({'error': 'Account is banned'}), 403
+    if not principal_allowed(principal, request.path, request.view_args or {}, request.args,
+                             request.get_json(silent=True)):
+        return jsonify({'error': 'Not allowed for this account'}), 403
+    g.principal = principal
+
+def hashing_busy_response():
+    response = jsonify({'error': 'Too many sign-ins right now, please try again in a moment'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -230,11 +856,16 @@ def register():
     if User.query.filter_by(email=data['email']).first():
         return jsonify({'error': 'Email already exists'}), 400
 
+    try:
+        password_hash = password_hasher.hash(data['password'])
+    except HashingBusy:
+        return hashing_busy_response()
+
     user = User(
         name=data['name'],
         phone=data['phone'],
         email=data['email'],
-        password=generate_password_hash(data['password'], method='pbkdf2:sha256'),
+        password=password_hash,
         role=data.get('role', 'user')
     )
     db.session.add(user)
@@ -264,8 +895,18 @@ def register():
 def login():
     data = request.get_json()
     user = User.query.filter_by(email=data['email']).first()
+    if not user:
+        return jsonify({'error': 'Invalid credentials'}), 401
 
-    if user and check_password_hash(user.password, data['password']):
+    try:
+        matches, upgraded_hash = password_hasher.verify(user.password, data['password'])
+    except HashingBusy:
+        return hashing_busy_response()
+
+    if matches:
+        if upgraded_hash:  # Stored with an older method or cost; replace it while the password is at hand
+            user.password = upgraded_hash
+            db.session.commit()
         response_data = {
             'message': 'Login successful!',
             'user_id': user.id,
@@ -280,12 +921,17 @@ def login():
             driver = Driver.query.filter_by(user_id=user.id).first()
             if driver:
                 response_data['driver_id'] = driver.id
-        
+
+        response_data['access_token'] = token_signer.issue(user.id, user.role, response_data.get('driver_id'))
+        response_data['token_type'] = 'Bearer'
+        response_data['expires_in'] = AUTH_TOKEN_TTL
         return jsonify(response_data)
     return jsonify({'error': 'Invalid credentials'}), 401
 
 # Get User Balance
 @app.route('/api/user/balance/<int:user_id>', methods=['GET'])
+@poll_interval(every(30))
+@conditional(lambda user_id: resource_versions(f'user:{user_id}'))
 def get_user_balance(user_id):
     user = User.query.get_or_404(user_id)
     return jsonify({
@@ -294,6 +940,73 @@ def get_user_balance(user_id):
         'email': user.email
     })
 
+# Pricing engine: deterministic fares with signed quotes that booking trusts as-is
+tariff = Tariff(PRICE_BASE_FARE, PRICE_PER_KM, PRICE_MIN, PRICE_MAX, PRICE_SURGE_CAP)
+demand_tracker = DemandTracker()
+if not QUOTE_SECRET:
+    log.warning('pricing.ephemeral_secret', note='QUOTE_SECRET is not set; quotes issued before a restart, or by '
+                                                 'another server process, are rejected')
+quote_signer = QuoteSigner(QUOTE_SECRET or secrets.token_hex(32), QUOTE_TTL_SECONDS)
+
+def verify_booking_quote(data):
+    """Validate the quote sent with a booking; returns (quote, error response)"""
+    quote_id = data.get('quote_id')
+    if not quote_id:
+        return None, (jsonify({'error': 'A price quote is required, please search for drivers again'}), 400)
+    try:
+        quote = quote_signer.verify(quote_id)
+    except QuoteError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    if str(quote['driver_id']) != str(data.get('driver_id')):
+        return None, (jsonify({'error': 'Quote does not match the selected driver'}), 400)
+    price = quote.get('price')
+    if not isinstance(price, (int, float)) or isinstance(price, bool) or not price > 0:
+        return None, (jsonify({'error': 'Invalid quote price, please search for drivers again'}), 400)
+    return quote, None
+
+def find_nearby_drivers(pickup, radius_km, limit, vehicle_type=None):
+    """Nearest bookable drivers to a pickup point as [(distance_km, DriverRecord)]
+
+    Candidates are gathered once per geohash cell and reused for SEARCH_CACHE_TTL
+    seconds; each request still ranks them by exact distance from its own pickup.
+    """
+    cell = geohash_encode(pickup[0], pickup[1], SEARCH_CACHE_PRECISION)
+    key = (cell, vehicle_type, radius_km, limit)
+    candidates = search_cache.get(key)
+    if candidates is None:
+        min_lat, min_lng, max_lat, max_lng = geohash_bounds(cell)
+        centre_lat, centre_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+        # Widen by the cell's half-diagonal so the candidates cover any pickup inside the cell
+        reach_km = radius_km + haversine_km(min_lat, min_lng, max_lat, max_lng) / 2
+        deadline = time.perf_counter() + SEARCH_LATENCY_BUDGET_MS / 1000
+        matches = driver_registry.nearest(centre_lat, centre_lng, k=limit * SEARCH_CACHE_OVERFETCH,
+                                          radius_km=reach_km, max_candidates=SEARCH_MAX_CANDIDATES,
+                                          deadline=deadline, vehicle_type=vehicle_type)
+        records = [record for _, record in matches]
+        # Positions are snapshotted with the entry; drivers move little within the TTL
+        candidates = (records,
+                      np.array([record.latitude for record in records], dtype=np.float64),
+                      np.array([record.longitude for record in records], dtype=np.float64))
+        search_cache.put(key, centre_lat, centre_lng, reach_km, candidates)
+
+    records, latitudes, longitudes = candidates
+    if not records:
+        return []
+    distances = haversine_km_many(pickup[0], pickup[1], latitudes, longitudes)
+    within = np.flatnonzero(distances <= radius_km)
+    order = within[np.argsort(distances[within], kind='stable')][:limit]
+    return [(float(distances[i]), records[i]) for i in order]
+
+def parse_coordinates(data, prefix):
+    """Read <prefix>_lat/<prefix>_lng from a request body; None if absent, ValueError if invalid"""
+    lat, lng = data.get(f'{prefix}_lat'), data.get(f'{prefix}_lng')
+    if lat is None or lng is None:
+        return None
+    position = parse_latlng(f'{float(lat)},{float(lng)}')
+    if not position:
+        raise ValueError(f'{prefix} coordinates out of range')
+    return position
+
 # User Dashboard
 @app.route('/api/user/search-drivers', methods=['POST'])
 def search_drivers():
@@ -307,56 +1020,112 @@ def search_drivers():
         if not pickup_location or not dropoff_location:
             return jsonify({'error': 'Pickup and dropoff locations are required'}), 400
 
-        # Use actual distance from frontend or default to reasonable estimate
-        if not distance:
+        try:
+            pickup = parse_coordinates(data, 'pickup')
+            dropoff = parse_coordinates(data, 'dropoff')
+            radius_km = float(data.get('radius_km', DRIVER_SEARCH_RADIUS_KM))
+            limit = min(int(data.get('limit', DRIVER_SEARCH_LIMIT)), 100)
+            vehicle_type = data.get('vehicle_type') or None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid coordinates, radius or limit'}), 400
+
+        if pickup and dropoff:
+            # Server-side trip distance; the client estimate is only used without coordinates
+            distance = haversine_km(pickup[0], pickup[1], dropoff[0], dropoff[1]) * ROAD_DISTANCE_FACTOR
+        elif not distance:
             distance = 15.0  # Default reasonable distance for moving services
-        
-        # TEST PRICING MODE: Fixed range 10-20 KES for affordable M-Pesa testing
-        # This makes it practical to test real payments without spending much money
-        base_test_price = random.randint(10, 20)  # Random price between 10-20 KES
-        
-        print(f"[SEARCH DRIVERS] Request from: {pickup_location} to: {dropoff_location}")
-        print(f"[TEST MODE] Base shipping fee: KES {base_test_price}")
+        distance = float(distance)
+
+        search_log.debug('search.request', pickup=pickup_location, dropoff=dropoff_location)
+
+        ensure_driver_registry()
+        if pickup:
+            # Nearest verified & available drivers around the pickup point; candidates are
+            # shared per cell through the search cache, ranked with one vectorized haversine pass
+            matches = find_nearby_drivers(pickup, radius_km, limit, vehicle_type)
+            drivers = [record for _, record in matches]
+            pickup_distances = np.array([distance_km for distance_km, _ in matches]) * ROAD_DISTANCE_FACTOR
+            pickup_etas = np.ceil(pickup_distances / DRIVER_AVG_SPEED_KMH * 60)
+            # Surge when recent searches around the pickup outnumber the drivers found there
+            demand = demand_factor(demand_tracker.record(pickup[0], pickup[1]), len(drivers))
+        else:
+            # No pickup coordinates - show all verified drivers that are available
+            drivers = [record for record in driver_registry.records()
+                       if vehicle_type is None or record.vehicle_type == vehicle_type]
+            pickup_distances = pickup_etas = [None] * len(drivers)
+            demand = 1.0
 
-        # Only show verified drivers that are available
-        drivers = Driver.query.filter_by(is_available=True, is_verified=True).all()
-        
-        print(f"[SEARCH DRIVERS] Found {len(drivers)} verified & available drivers")
-        for driver in drivers:
-            print(f"  - {driver.user.name} (ID: {driver.id}, Vehicle: {driver.vehicle_type})")
+        base_price = tariff.price(distance, demand=demand)
+        search_log.debug('search.fare', base_fare=base_price, distance_km=round(distance, 1), demand=round(demand, 2))
+
+        if search_log.tracing:
+            search_log.debug('search.candidates', count=len(drivers), driver_ids=[driver.driver_id for driver in drivers])
         
-        # Apply small price variation per driver (±1-2 KES) to show different prices
+        # Price each driver by vehicle type and sign it so booking can trust the amount
         drivers_data = []
-        for driver in drivers:
-            # Small random variation per driver (between -2 and +2 KES)
-            price_variation = random.randint(-2, 2)
-            driver_price = max(10, base_test_price + price_variation)  # Ensure minimum 10 KES
-            driver_price = min(20, driver_price)  # Ensure maximum 20 KES
-            
+        for driver, pickup_distance, pickup_eta in zip(drivers, pickup_distances, pickup_etas):
+            driver_price = tariff.price(distance, driver.vehicle_type, demand)
+            quote_id = quote_signer.issue(driver_id=driver.driver_id, price=driver_price,
+                                          distance=round(distance, 2), promo_code=None, pickup=pickup)
+
             drivers_data.append({
-                'driver_id': driver.id,
-                'name': driver.user.name,
+                'driver_id': driver.driver_id,
+                'name': driver.name,
                 'vehicle_type': driver.vehicle_type,
                 'ratings': driver.ratings,
                 'completed_orders': driver.completed_orders,
                 'price': driver_price,
-                'is_verified': driver.is_verified,
-                'license_plate': driver.license_plate
+                'quote_id': quote_id,
+                'is_verified': True,  # Only verified drivers are registered
+                'license_plate': driver.license_plate,
+                'distance_to_pickup': round(float(pickup_distance), 2) if pickup_distance is not None else None,
+                'eta_minutes': int(pickup_eta) if pickup_eta is not None else None
             })
 
-        print(f"[SEARCH DRIVERS] Returning {len(drivers_data)} drivers to client")
+        search_log.debug('search.response', drivers=len(drivers_data))
         
         return jsonify({
             'distance': round(distance, 2),
-            'base_price': base_test_price,
+            'trip_duration_minutes': int(math.ceil(distance / DRIVER_AVG_SPEED_KMH * 60)),
+            'base_price': base_price,
+            'demand_multiplier': round(demand, 2),
+            'quote_ttl_seconds': QUOTE_TTL_SECONDS,
             'drivers': drivers_data
         })
     except Exception as e:
-        print(f"[ERROR] Search drivers failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        search_log.exception('search.failed', error=str(e))
         return jsonify({'error': f'Failed to search drivers: {str(e)}'}), 500
 
+@app.route('/api/user/apply-promo', methods=['POST'])
+def apply_promo():
+    """Apply a promo code to a driver quote and return the discounted, re-signed quote"""
+    data = request.get_json()
+    promo_code = (data.get('promo_code') or '').strip().upper()
+    if not data.get('quote_id') or not promo_code:
+        return jsonify({'error': 'Quote and promo code are required'}), 400
+
+    try:
+        quote = quote_signer.verify(data['quote_id'])
+    except QuoteError as e:
+        return jsonify({'error': str(e)}), 400
+    if quote.get('promo_code'):
+        return jsonify({'error': 'A promo code has already been applied'}), 400
+
+    promo = PromoCode.query.filter_by(code=promo_code, is_active=True).first()
+    if not promo:
+        return jsonify({'error': 'Invalid or inactive promo code'}), 404
+
+    # Whole shillings like Tariff.price, so the STK push, escrow and booking all carry the same amount
+    price = int(round(quote['price'] * (1 - promo.discount / 100)))
+    quote_id = quote_signer.issue(**dict(quote, price=price, promo_code=promo.code))
+    return jsonify({
+        'quote_id': quote_id,
+        'price': price,
+        'original_price': quote['price'],
+        'discount': promo.discount,
+        'promo_code': promo.code
+    })
+
 @app.route('/api/user/book-driver', methods=['POST'])
 def book_driver():
     data = request.get_json()
@@ -364,23 +1133,22 @@ def book_driver():
     driver_id = data.get('driver_id')
     pickup_location = data.get('pickup_location')
     dropoff_location = data.get('dropoff_location')
-    distance = data.get('distance')
-    price = data.get('price')
-    promo_code = data.get('promo_code', None)
 
-    if not user_id or not driver_id or not pickup_location or not dropoff_location or not distance or not price:
+    if not user_id or not driver_id or not pickup_location or not dropoff_location:
         return jsonify({'error': 'Missing required fields'}), 400
 
+    # Price, distance and promo come from the signed quote, never from the client
+    quote, error = verify_booking_quote(data)
+    if error:
+        return error
+    final_price = quote['price']
+    distance = quote['distance']
+    promo_code = quote['promo_code']
+    pickup_lat, pickup_lng = quote.get('pickup') or (None, None)
+
     # Check user wallet balance
     user = User.query.get_or_404(user_id)
-    
-    # Apply promo code discount if valid
-    final_price = price
-    if promo_code:
-        promo = PromoCode.query.filter_by(code=promo_code, is_active=True).first()
-        if promo:
-            final_price = price * (1 - promo.discount / 100)
-    
+
     # Check if user has sufficient balance
     if user.balance < final_price:
         return jsonify({
@@ -399,7 +1167,9 @@ def book_driver():
         dropoff_location=dropoff_location,
         distance=distance,
         price=final_price,
-        promo_code=promo_code
+        promo_code=promo_code,
+        pickup_lat=pickup_lat,
+        pickup_lng=pickup_lng
     )
     db.session.add(booking)
     db.session.flush()  # Get booking.id before commit
@@ -451,37 +1221,33 @@ def book_driver():
 @app.route('/api/user/book-driver-mpesa', methods=['POST'])
 def book_driver_with_mpesa():
     """Create booking and initiate M-Pesa payment"""
-    data = request.get_json()
+    return run_payment(prepare_booking_payment, finalize_booking_payment, request.get_json())
+
+def prepare_booking_payment(data):
+    """Record the booking (pending_payment) and its transaction, and build the STK Push"""
     user_id = data.get('user_id')
     driver_id = data.get('driver_id')
     pickup_location = data.get('pickup_location')
     dropoff_location = data.get('dropoff_location')
-    distance = data.get('distance')
-    price = data.get('price')
     phone_number = data.get('phone_number')
-    promo_code = data.get('promo_code', None)
 
-    if not all([user_id, driver_id, pickup_location, dropoff_location, distance, price, phone_number]):
-        return jsonify({'error': 'Missing required fields'}), 400
+    if not all([user_id, driver_id, pickup_location, dropoff_location, phone_number]):
+        return None, (jsonify({'error': 'Missing required fields'}), 400)
+
+    # Price, distance and promo come from the signed quote, never from the client
+    quote, error = verify_booking_quote(data)
+    if error:
+        return None, error
+    final_price = float(quote['price'])
+    distance = quote['distance']
+    promo_code = quote['promo_code']
+    pickup_lat, pickup_lng = quote.get('pickup') or (None, None)
+    if final_price <= 0:
+        return None, (jsonify({'error': 'Amount must be greater than 0'}), 400)
 
     # Get user
     user = User.query.get_or_404(user_id)
     
-    # Apply promo code discount if valid
-    final_price = price
-    if promo_code:
-        promo = PromoCode.query.filter_by(code=promo_code, is_active=True).first()
-        if promo:
-            final_price = price * (1 - promo.discount / 100)
-    
-    # Validate amount
-    try:
-        final_price = float(final_price)
-        if final_price <= 0:
-            return jsonify({'error': 'Amount must be greater than 0'}), 400
-    except ValueError:
-        return jsonify({'error': 'Invalid amount'}), 400
-    
     # Format phone number
     phone_number = phone_number.replace('+', '').replace(' ', '').replace('-', '')
     if phone_number.startswith('0'):
@@ -498,6 +1264,8 @@ def book_driver_with_mpesa():
         distance=distance,
         price=final_price,
         promo_code=promo_code,
+        pickup_lat=pickup_lat,
+        pickup_lng=pickup_lng,
         status='pending_payment'
     )
     db.session.add(booking)
@@ -519,185 +1287,117 @@ def book_driver_with_mpesa():
     db.session.add(transaction)
     db.session.commit()
     
-    # Call M-Pesa API to send STK push
-    print(f"\n{'='*60}")
-    print(f"[PAYMENT] Starting M-Pesa STK Push for booking {booking.id}")
-    print(f"[PAYMENT] Environment: {MPESA_ENVIRONMENT}")
-    print(f"[PAYMENT] Amount: KES {final_price}")
-    print(f"[PAYMENT] Phone: {phone_number}")
-    print(f"{'='*60}\n")
-    
+    payment_log.info('stk_push.start', kind='booking', booking_id=booking.id, transaction_id=transaction_id,
+                     amount=final_price, phone_number=phone_number, environment=MPESA_ENVIRONMENT)
+
+    return {
+        'transaction_id': transaction_id,
+        'booking_id': booking.id,
+        'user_id': user_id,
+        'user_name': user.name,
+        'driver_id': driver_id,
+        'amount': final_price,
+        'phone_number': phone_number,
+        'call': stk_push_call(int(final_price), phone_number, f'Booking-{booking.id}',
+                              'Moving service booking payment', timeout=30)
+    }, None
+
+def finalize_booking_payment(plan, reply):
+    """Apply the STK Push outcome; in sandbox the payment completes immediately"""
+    transaction_id = plan['transaction_id']
+    transaction = Transaction.query.filter_by(transaction_id=transaction_id).first()
+    booking = db.session.get(Booking, plan['booking_id'])
+    final_price = plan['amount']
+
     try:
-        # Get OAuth access token
-        print(f"[PAYMENT] Step 1: Requesting M-Pesa access token...")
-        access_token = get_mpesa_access_token()
-        
-        if not access_token:
-            # Log the error for debugging
-            print(f"[ERROR] Failed to get M-Pesa access token for booking {booking.id}")
-            print(f"[ERROR] M-Pesa Config - Environment: {MPESA_ENVIRONMENT}")
-            print(f"[ERROR] M-Pesa Config - Business Short Code: {MPESA_BUSINESS_SHORT_CODE}")
-            print(f"[ERROR] M-Pesa Config - Has Consumer Key: {bool(MPESA_CONSUMER_KEY)}")
-            print(f"[ERROR] M-Pesa Config - Has Consumer Secret: {bool(MPESA_CONSUMER_SECRET)}")
-            
-            # Cannot proceed without access token
+        if not reply.accepted:
+            if reply.outcome == 'no_token':
+                payment_log.error('stk_push.no_token', booking_id=booking.id, environment=MPESA_ENVIRONMENT,
+                                  short_code=MPESA_BUSINESS_SHORT_CODE, has_consumer_key=bool(MPESA_CONSUMER_KEY),
+                                  has_consumer_secret=bool(MPESA_CONSUMER_SECRET))
+                error_message, status_code = 'Failed to authenticate with M-Pesa API. Please check your configuration.', 500
+            elif reply.outcome == 'timeout':
+                payment_log.error('stk_push.timeout', booking_id=booking.id, error=reply.error)
+                error_message, status_code = 'M-Pesa service timeout. Please try again in a few minutes.', 500
+            elif reply.outcome == 'unreachable':
+                payment_log.error('stk_push.unreachable', booking_id=booking.id, error=reply.error)
+                error_message, status_code = 'Failed to connect to M-Pesa. Please check your internet connection.', 500
+            else:
+                response_data = reply.data or {}
+                payment_log.warning('stk_push.rejected', booking_id=booking.id, status=reply.status_code,
+                                    error_code=response_data.get('errorCode'), response_code=response_data.get('ResponseCode'))
+                payment_log.debug('stk_push.response', booking_id=booking.id, body=reply.text)
+                error_message = response_data.get('errorMessage') or response_data.get('ResponseDescription') or 'Failed to initiate M-Pesa payment'
+                status_code = 400
             transaction.status = 'failed'
             booking.status = 'cancelled'
             db.session.commit()
             return jsonify({
                 'success': False,
-                'error': 'Failed to authenticate with M-Pesa API. Please check your configuration.',
+                'error': error_message,
                 'transaction_id': transaction_id
-            }), 500
-        
-        # Generate password and timestamp
-        print(f"[PAYMENT] Step 2: Generating password and timestamp...")
-        password, timestamp = generate_password_and_timestamp()
-        
-        # Prepare STK Push request
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        payload = {
-            'BusinessShortCode': MPESA_BUSINESS_SHORT_CODE,
-            'Password': password,
-            'Timestamp': timestamp,
-            'TransactionType': 'CustomerPayBillOnline',
-            'Amount': int(final_price),
-            'PartyA': phone_number,
-            'PartyB': MPESA_BUSINESS_SHORT_CODE,
-            'PhoneNumber': phone_number,
-            'CallBackURL': MPESA_CALLBACK_URL,
-            'AccountReference': f'Booking-{booking.id}',
-            'TransactionDesc': f'Moving service booking payment'
-        }
+            }), status_code
+
+        # STK Push initiated successfully
+        response_data = reply.data
+        payment_log.info('stk_push.sent', booking_id=booking.id, checkout_request_id=response_data.get('CheckoutRequestID'))
         
-        print(f"[PAYMENT] Step 3: Sending STK Push request to M-Pesa...")
-        print(f"[PAYMENT] Endpoint: {MPESA_API_BASE}/mpesa/stkpush/v1/processrequest")
-        print(f"[PAYMENT] Short Code: {MPESA_BUSINESS_SHORT_CODE}")
-        print(f"[PAYMENT] Phone: {phone_number}")
-        print(f"[PAYMENT] Amount: {int(final_price)}")
-        print(f"[PAYMENT] Callback: {MPESA_CALLBACK_URL}")
+        transaction.checkout_request_id = response_data.get('CheckoutRequestID')
+        transaction.merchant_request_id = response_data.get('MerchantRequestID')
         
-        try:
-            response = requests.post(
-                f'{MPESA_API_BASE}/mpesa/stkpush/v1/processrequest',
-                json=payload,
-                headers=headers,
-                timeout=30  # Increased timeout for better reliability
+        # In sandbox mode, auto-complete payment immediately for fast testing
+        if MPESA_ENVIRONMENT == 'sandbox':
+            transaction.status = 'completed'
+            transaction.mpesa_receipt_number = f'SIM{uuid.uuid4().hex[:10].upper()}'
+            booking.status = 'pending'
+            
+            # Create escrow record
+            platform_fee_percentage = 10
+            platform_fee = final_price * (platform_fee_percentage / 100)
+            driver_amount = final_price - platform_fee
+            
+            escrow = Escrow(
+                booking_id=booking.id,
+                user_id=plan['user_id'],
+                driver_id=plan['driver_id'],
+                amount=final_price,
+                platform_fee=platform_fee,
+                driver_amount=driver_amount,
+                status='held'
             )
+            db.session.add(escrow)
             
-            print(f"[PAYMENT] M-Pesa Response Status: {response.status_code}")
-            print(f"[PAYMENT] M-Pesa Response: {response.text}")
+            # Create payment record
+            payment = Payment(
+                user_id=plan['user_id'],
+                amount=final_price,
+                transaction_id=transaction.mpesa_receipt_number,
+                status='completed'
+            )
+            db.session.add(payment)
             
-            response_data = response.json()
-        except requests.exceptions.Timeout as e:
-            print(f"[ERROR] M-Pesa API timeout after 30 seconds: {str(e)}")
-            print(f"[ERROR] This may indicate M-Pesa service is slow or unavailable")
-            transaction.status = 'failed'
-            booking.status = 'cancelled'
-            db.session.commit()
-            return jsonify({
-                'success': False,
-                'error': 'M-Pesa service timeout. Please try again in a few minutes.',
-                'transaction_id': transaction_id
-            }), 500
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] M-Pesa API request failed: {str(e)}")
-            transaction.status = 'failed'
-            booking.status = 'cancelled'
-            db.session.commit()
-            return jsonify({
-                'success': False,
-                'error': 'Failed to connect to M-Pesa. Please check your internet connection.',
-                'transaction_id': transaction_id
-            }), 500
+            # Notify driver
+            notification = Notification(
+                driver_id=plan['driver_id'],
+                message=f"New booking request from {plan['user_name']}. Amount: KES {final_price:.2f} (KES {driver_amount:.2f} for you after fees)"
+            )
+            db.session.add(notification)
+            payment_log.info('stk_push.sandbox_completed', booking_id=booking.id, receipt=transaction.mpesa_receipt_number)
         
-        print(f"[PAYMENT] Step 4: Processing M-Pesa response...")
+        db.session.commit()
         
-        if response.status_code == 200 and response_data.get('ResponseCode') == '0':
-            # STK Push initiated successfully
-            print(f"[SUCCESS] STK Push sent successfully!")
-            print(f"[SUCCESS] CheckoutRequestID: {response_data.get('CheckoutRequestID')}")
-            print(f"[SUCCESS] MerchantRequestID: {response_data.get('MerchantRequestID')}")
-            print(f"[SUCCESS] Customer should receive prompt on phone: {phone_number}")
-            
-            transaction.checkout_request_id = response_data.get('CheckoutRequestID')
-            transaction.merchant_request_id = response_data.get('MerchantRequestID')
-            
-            # In sandbox mode, auto-complete payment immediately for fast testing
-            if MPESA_ENVIRONMENT == 'sandbox':
-                print(f"[SANDBOX] Auto-completing payment immediately for fast UX")
-                transaction.status = 'completed'
-                transaction.mpesa_receipt_number = f'SIM{uuid.uuid4().hex[:10].upper()}'
-                booking.status = 'pending'
-                
-                # Create escrow record
-                platform_fee_percentage = 10
-                platform_fee = final_price * (platform_fee_percentage / 100)
-                driver_amount = final_price - platform_fee
-                
-                escrow = Escrow(
-                    booking_id=booking.id,
-                    user_id=user_id,
-                    driver_id=driver_id,
-                    amount=final_price,
-                    platform_fee=platform_fee,
-                    driver_amount=driver_amount,
-                    status='held'
-                )
-                db.session.add(escrow)
-                
-                # Create payment record
-                payment = Payment(
-                    user_id=user_id,
-                    amount=final_price,
-                    transaction_id=transaction.mpesa_receipt_number,
-                    status='completed'
-                )
-                db.session.add(payment)
-                
-                # Notify driver
-                notification = Notification(
-                    driver_id=driver_id,
-                    message=f'New booking request from {user.name}. Amount: KES {final_price:.2f} (KES {driver_amount:.2f} for you after fees)'
-                )
-                db.session.add(notification)
-                print(f"[SANDBOX] Payment completed instantly - Transaction: {transaction.mpesa_receipt_number}")
-            
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': 'Payment processed successfully!' if MPESA_ENVIRONMENT == 'sandbox' else 'Check your phone to complete payment.',
-                'transaction_id': transaction_id,
-                'booking_id': booking.id,
-                'checkout_request_id': response_data.get('CheckoutRequestID'),
-                'amount': final_price,
-                'simulated': MPESA_ENVIRONMENT == 'sandbox'
-            }), 200
-        else:
-            # STK Push failed
-            print(f"[ERROR] STK Push failed!")
-            print(f"[ERROR] ResponseCode: {response_data.get('ResponseCode')}")
-            print(f"[ERROR] ResponseDescription: {response_data.get('ResponseDescription')}")
-            print(f"[ERROR] ErrorCode: {response_data.get('errorCode')}")
-            print(f"[ERROR] ErrorMessage: {response_data.get('errorMessage')}")
-            
-            error_message = response_data.get('errorMessage') or response_data.get('ResponseDescription') or 'Failed to initiate M-Pesa payment'
-            transaction.status = 'failed'
-            booking.status = 'cancelled'
-            db.session.commit()
-            
-            return jsonify({
-                'success': False,
-                'error': error_message,
-                'transaction_id': transaction_id
-            }), 400
+        return jsonify({
+            'success': True,
+            'message': 'Payment processed successfully!' if MPESA_ENVIRONMENT == 'sandbox' else 'Check your phone to complete payment.',
+            'transaction_id': transaction_id,
+            'booking_id': booking.id,
+            'checkout_request_id': response_data.get('CheckoutRequestID'),
+            'amount': final_price,
+            'simulated': MPESA_ENVIRONMENT == 'sandbox'
+        }), 200
             
     except Exception as e:
+        db.session.rollback()
         transaction.status = 'failed'
         booking.status = 'cancelled'
         db.session.commit()
@@ -708,22 +1408,52 @@ def book_driver_with_mpesa():
             'transaction_id': transaction_id
         }), 500
 
+def orders_poll_policy(driver_id=None):
+    if not driver_id:
+        return 15
+    is_available = db.session.query(Driver.is_available).filter_by(id=driver_id).scalar()
+    has_open_orders = db.session.query(Booking.id).filter(
+        Booking.driver_id == driver_id, Booking.status.in_(['pending', 'accepted'])
+    ).first() is not None
+    return driver_orders_poll_interval(is_available, has_open_orders)
+
+def reassigned_away(driver_id, since, limit=None):
+    """[(booking_id, version)] of bookings taken from a driver after `since`, latest move per booking"""
+    query = db.session.query(BookingReassignment.booking_id, db.func.max(BookingReassignment.version)).filter(
+        BookingReassignment.from_driver_id == driver_id, BookingReassignment.version > since
+    ).group_by(BookingReassignment.booking_id).order_by(db.func.max(BookingReassignment.version))
+    return query.limit(limit).all() if limit else query.all()
+
 # Driver Dashboard
 @app.route('/api/driver/available-orders', methods=['GET'])
 @app.route('/api/driver/available-orders/<int:driver_id>', methods=['GET'])
+@poll_interval(orders_poll_policy)
+@conditional(lambda driver_id=None: resource_versions(f'orders:driver:{driver_id}' if driver_id else 'orders:pending'))
 def available_orders(driver_id=None):
     """Get all pending and accepted orders for drivers
     If driver_id is provided, show orders assigned to that driver (pending to accept, accepted to complete).
     Otherwise, show all pending orders (for admin or general view)
+    With ?since=<version>, only orders changed after that version are returned (in any
+    status, so finished ones can be dropped), plus {booking_id, status: 'reassigned', version}
+    for each booking dispatch has since moved to another driver; `version` in the response
+    is the next cursor.
     """
+    try:
+        since = int(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': 'since must be a version number'}), 400
+
+    query = Booking.query.options(joinedload(Booking.user))
     if driver_id:
+        query = query.filter_by(driver_id=driver_id)
+    if since is not None:
+        orders = query.filter(Booking.version > since).all()
+    elif driver_id:
         # Get orders assigned to this specific driver that are pending or accepted
-        orders = Booking.query.filter_by(driver_id=driver_id).filter(Booking.status.in_(['pending', 'accepted'])).all()
-        print(f"[DEBUG] Driver {driver_id} fetching available orders: Found {len(orders)} pending/accepted orders")
+        orders = query.filter(Booking.status.in_(['pending', 'accepted'])).all()
     else:
         # Get all pending orders (no driver assigned yet or general view)
-        orders = Booking.query.filter_by(status='pending').all()
-        print(f"[DEBUG] Fetching all pending orders: Found {len(orders)} orders")
+        orders = query.filter_by(status='pending').all()
     
     orders_data = [{
         'booking_id': order.id,
@@ -735,13 +1465,57 @@ def available_orders(driver_id=None):
         'distance': order.distance,
         'price': order.price,
         'created_at': order.created_at.isoformat() if order.created_at else None,  # ISO format timestamp
-        'status': order.status
+        'status': order.status,
+        'version': order.version
     } for order in orders]
-    return jsonify({'orders': orders_data})
+    if driver_id and since is not None:
+        current = {order.id for order in orders}
+        orders_data.extend({'booking_id': booking_id, 'status': 'reassigned', 'version': moved_version}
+                           for booking_id, moved_version in reassigned_away(driver_id, since)
+                           if booking_id not in current)
+    version = max([since or 0] + [order['version'] or 0 for order in orders_data])
+    return jsonify({'orders': orders_data, 'version': version})
+
+@app.route('/api/driver/orders/<int:driver_id>/stream', methods=['GET'])
+def driver_order_stream(driver_id):
+    """Server-Sent Events: an 'order' event whenever a booking is assigned to, changes for
+    or is taken from this driver. Event ids are booking versions, usable as ?since="""
+    subscription, busy = open_subscription(f'orders:{driver_id}')
+    if busy:
+        return busy
+    cursor = last_event_id()
+    replay = []
+    if cursor is not None:
+        missed = db.session.query(Booking.id, Booking.status, Booking.version).filter(
+            Booking.driver_id == driver_id, Booking.version > cursor
+        ).order_by(Booking.version).limit(STREAM_REPLAY_LIMIT).all()
+        current = {booking_id for booking_id, _, _ in missed}
+        missed += [(booking_id, 'reassigned', version)
+                   for booking_id, version in reassigned_away(driver_id, cursor, STREAM_REPLAY_LIMIT)
+                   if booking_id not in current]
+        replay = [(version, 'order', order_event(booking_id, status, version))
+                  for booking_id, status, version in sorted(missed, key=lambda row: row[2])][:STREAM_REPLAY_LIMIT]
+    db.session.remove()  # Do not hold a connection for the lifetime of the stream
+    return sse_response(subscription, replay)
 
 @app.route('/api/driver/accept-order/<int:booking_id>', methods=['POST'])
 def accept_order(booking_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        driver_id = int(data['driver_id']) if data.get('driver_id') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'driver_id must be a number'}), 400
     booking = Booking.query.get_or_404(booking_id)
+
+    # Dispatch may have moved the booking to another driver in the meantime
+    if driver_id is not None and driver_id != booking.driver_id:
+        return jsonify({'error': 'This booking has been reassigned to another driver'}), 409
+    if booking.status != 'pending':
+        return jsonify({
+            'error': 'Only pending orders can be accepted',
+            'current_status': booking.status
+        }), 400
+
     driver = Driver.query.get_or_404(booking.driver_id)
     
     # Verify escrow exists before accepting
@@ -759,6 +1533,8 @@ def accept_order(booking_id):
     
     booking.status = 'accepted'
     db.session.commit()
+    ensure_trail_store()
+    trail_store.start(booking.id, booking.driver_id)
 
     # Notify user
     notification = Notification(
@@ -813,7 +1589,19 @@ def complete_order(booking_id):
     )
     db.session.add(escrow_release_transaction)
     
+    # Persist the recorded route compactly and stop tracking this booking
+    trail_points = trail_store.finish(booking.id)
+    if trail_points:
+        db.session.add(BookingTrail(
+            booking_id=booking.id,
+            point_count=len(trail_points),
+            points=pack_points(trail_points),
+            started_at=datetime.fromtimestamp(trail_points[0][0], timezone.utc),
+            finished_at=datetime.fromtimestamp(trail_points[-1][0], timezone.utc)
+        ))
+    
     db.session.commit()
+    sync_driver_registry(driver)
     
     # Notify user
     user_notification = Notification(
@@ -857,6 +1645,13 @@ def ban_user(user_id):
     user = User.query.get_or_404(user_id)
     user.is_banned = True
     db.session.commit()
+
+    # Banned drivers must disappear from customer searches immediately
+    if user.role == 'driver':
+        driver = Driver.query.filter_by(user_id=user.id).first()
+        if driver:
+            sync_driver_registry(driver)
+
     return jsonify({'message': f'User {user.name} has been banned.'})
 
 # Wallet Management
@@ -893,52 +1688,41 @@ def create_deposit():
     })
 
 # M-Pesa Daraja API Helper Functions
-def get_mpesa_access_token():
-    """Generate OAuth access token for M-Pesa Daraja API"""
-    try:
-        # Check if credentials are configured
-        if not MPESA_CONSUMER_KEY or not MPESA_CONSUMER_SECRET:
-            print("ERROR: M-Pesa credentials not configured in environment variables")
-            return None
-        
-        url = f'{MPESA_API_BASE}/oauth/v1/generate?grant_type=client_credentials'
-        print(f"Requesting M-Pesa access token from: {url}")
-        print(f"Using Consumer Key: {MPESA_CONSUMER_KEY[:10]}...{MPESA_CONSUMER_KEY[-4:]}")
-        
-        response = requests.get(
-            url, 
-            auth=HTTPBasicAuth(MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET),
-            timeout=30
-        )
-        
-        print(f"Token Response Status: {response.status_code}")
-        print(f"Token Response: {response.text}")
-        
-        if response.status_code == 200:
-            json_response = response.json()
-            access_token = json_response.get('access_token')
-            if access_token:
-                print(f"Successfully obtained M-Pesa access token (length: {len(access_token)})")
-                print(f"Token preview: {access_token[:20]}...")
-                return access_token
-            else:
-                print("No access token in response:", json_response)
-                return None
-        else:
-            print(f"Failed to get access token. Status: {response.status_code}")
-            print(f"Response: {response.text}")
-            return None
-    except requests.exceptions.Timeout:
-        print("Timeout error connecting to M-Pesa API")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Network error getting access token: {str(e)}")
-        return None
-    except Exception as e:
-        print(f"Unexpected error getting access token: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
+def observe_daraja_call(path, status, seconds):
+    daraja_latency.observe(seconds, path, status)
+
+daraja_client = DarajaClient(MPESA_API_BASE, MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET,
+                             max_connections=DARAJA_MAX_CONNECTIONS, observer=observe_daraja_call)
+
+# WSGI environ keys through which asgi.py takes the Daraja call out of the request
+DARAJA_DEFER_KEY = 'movers.daraja_defer'
+DARAJA_PLAN_KEY = 'movers.daraja_plan'
+DARAJA_RESUME_KEY = 'movers.daraja_resume'
+REQUEST_TALLY_KEY = 'movers.request_tally'  # Carried over to the resumed dispatch
+PROFILE_RUN_KEY = 'movers.profile_run'
+PROFILE_ENDPOINTS = ('list_profiles', 'download_profile')  # Take the token but are not profiled
+
+def run_payment(prepare, finalize, *args):
+    """Run a payment view in three steps: prepare (DB), the Daraja call, finalize (DB)
+
+    prepare(*args) returns (plan, None) or (None, response); plan['call'] is the
+    Daraja call to make, or None when there is nothing to send. Under asgi.py the
+    first dispatch stops after prepare and leaves the plan in the environ; the
+    call is awaited outside Flask and a second dispatch runs only finalize.
+    """
+    resumed = request.environ.get(DARAJA_RESUME_KEY)
+    if resumed is not None:
+        plan, reply = resumed
+        return finalize(plan, reply)
+    plan, response = prepare(*args)
+    if response is not None:
+        return response
+    if plan['call'] is None:
+        return finalize(plan, None)
+    if request.environ.get(DARAJA_DEFER_KEY):
+        request.environ[DARAJA_PLAN_KEY] = plan
+        return '', 202
+    return finalize(plan, daraja_client.call(plan['call']))
 
 def generate_password_and_timestamp():
     """Generate password and timestamp for STK Push"""
@@ -951,44 +1735,33 @@ def generate_password_and_timestamp():
     
     return password, timestamp
 
-def initiate_b2c_payment(phone_number, amount, transaction_id, remarks="Withdrawal"):
-    """
-    Initiate B2C payment using M-Pesa Daraja API
-    Sends money from business account to customer phone
-    """
-    try:
-        print(f"\n{'='*60}")
-        print(f"Initiating B2C Payment")
-        print(f"{'='*60}")
-        print(f"Amount: KES {amount}")
-        print(f"Phone: {phone_number}")
-        print(f"Transaction ID: {transaction_id}")
-        print(f"Environment: {MPESA_ENVIRONMENT}")
-        
-        # Validate configuration
-        if not MPESA_SECURITY_CREDENTIAL or len(MPESA_SECURITY_CREDENTIAL) < 10:
-            print("ERROR: Security credential not configured properly")
-            return {
-                'success': False,
-                'error': 'B2C not configured. Please contact support.'
-            }
-        
-        # Get access token
-        access_token = get_mpesa_access_token()
-        if not access_token:
-            return {'success': False, 'error': 'Failed to authenticate with M-Pesa'}
-        
-        # B2C API endpoint
-        url = f'{MPESA_API_BASE}/mpesa/b2c/v1/paymentrequest'
-        
-        # Request headers
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        # Request payload
-        payload = {
+def stk_push_call(amount, phone_number, account_reference, description, timeout):
+    """Daraja call that prompts the customer's phone for their M-Pesa PIN"""
+    password, timestamp = generate_password_and_timestamp()
+    return {
+        'path': '/mpesa/stkpush/v1/processrequest',
+        'payload': {
+            'BusinessShortCode': MPESA_BUSINESS_SHORT_CODE,
+            'Password': password,
+            'Timestamp': timestamp,
+            'TransactionType': 'CustomerPayBillOnline',
+            'Amount': amount,
+            'PartyA': phone_number,
+            'PartyB': MPESA_BUSINESS_SHORT_CODE,
+            'PhoneNumber': phone_number,
+            'CallBackURL': MPESA_CALLBACK_URL,
+            'AccountReference': account_reference,
+            'TransactionDesc': description
+        },
+        'timeout': timeout
+    }
+
+def b2c_payment_call(phone_number, amount, transaction_id, remarks="Withdrawal"):
+    """Daraja B2C call: sends money from the business account to a customer phone"""
+    payment_log.info('b2c.start', transaction_id=transaction_id, amount=amount, phone_number=phone_number, environment=MPESA_ENVIRONMENT)
+    return {
+        'path': '/mpesa/b2c/v1/paymentrequest',
+        'payload': {
             'InitiatorName': MPESA_INITIATOR_NAME,
             'SecurityCredential': MPESA_SECURITY_CREDENTIAL,
             'CommandID': 'BusinessPayment',
@@ -999,310 +1772,177 @@ def initiate_b2c_payment(phone_number, amount, transaction_id, remarks="Withdraw
             'QueueTimeOutURL': MPESA_B2C_TIMEOUT_URL,
             'ResultURL': MPESA_B2C_RESULT_URL,
             'Occasion': transaction_id
-        }
-        
-        # Make API request with 30-second timeout (sandbox can be slow)
-        print(f"Sending B2C request to: {url}")
-        print(f"Authorization: Bearer {access_token[:15]}...{access_token[-10:] if len(access_token) > 25 else '***'}")
-        print(f"InitiatorName: {MPESA_INITIATOR_NAME}")
-        print(f"PartyA (Short Code): {MPESA_B2C_SHORT_CODE}")
-        print(f"PartyB (Phone): {phone_number}")
-        print(f"Amount: {int(amount)}")
-        print(f"SecurityCredential length: {len(MPESA_SECURITY_CREDENTIAL)}")
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        
-        # Log response for debugging
-        print(f"B2C Response Status: {response.status_code}")
-        print(f"B2C Response Headers: {dict(response.headers)}")
-        print(f"B2C Response Body: {response.text}")
-        print(f"{'='*60}\n")
-        
-        # Try to parse JSON response
-        try:
-            response_data = response.json()
-        except ValueError as json_err:
-            print(f"Failed to parse JSON response: {json_err}")
-            print(f"Full response text: {response.text}")
-            return {
-                'success': False,
-                'error': f'M-Pesa returned an invalid response. Status: {response.status_code}'
-            }
-        
-        # Handle 401 Unauthorized - means credentials don't have B2C permissions
-        if response.status_code == 401:
-            print(f"✗ 401 Unauthorized: B2C credentials not authorized")
-            print(f"   The consumer key/secret don't have B2C permissions")
-            print(f"   Using STK Push credentials for B2C won't work")
-            
-            # In sandbox mode, we can simulate for testing
-            if MPESA_ENVIRONMENT == 'sandbox':
-                print(f"   Falling back to simulation mode for sandbox testing")
-                return {
-                    'success': False,
-                    'error': 'B2C_AUTH_FAILED',
-                    'simulate': True,
-                    'message': 'B2C authentication failed - using simulation mode'
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': 'B2C not authorized. Please enable B2C permissions in your Daraja account or use B2C-specific credentials.'
-                }
-        
-        # Check if request was successful
-        if response.status_code == 200 and response_data.get('ResponseCode') == '0':
-            print(f"✓ B2C payment initiated successfully!")
-            return {
-                'success': True,
-                'conversation_id': response_data.get('ConversationID'),
-                'originator_conversation_id': response_data.get('OriginatorConversationID'),
-                'response_description': response_data.get('ResponseDescription')
-            }
-        else:
-            # Extract detailed error information
-            error_code = response_data.get('errorCode', '')
-            error_message = response_data.get('errorMessage', '')
-            response_code = response_data.get('ResponseCode', '')
-            response_desc = response_data.get('ResponseDescription', '')
-            request_id = response_data.get('requestId', '')
-            
-            # Construct detailed error message
-            if error_message:
-                full_error = f"{error_message}"
-                if error_code:
-                    full_error += f" (Code: {error_code})"
-                    
-                # Special handling for common errors
-                if 'Invalid Access Token' in error_message or 'invalid access token' in error_message.lower():
-                    print(f"✗ Access token was rejected by M-Pesa B2C API")
-                    print(f"   This usually means the credentials are for STK Push, not B2C")
-                    print(f"   Or the app doesn't have B2C permissions enabled")
-                    full_error = "M-Pesa authentication failed. Please ensure B2C is enabled for your app."
-                    
-            elif response_desc:
-                full_error = f"{response_desc}"
-                if response_code:
-                    full_error += f" (Code: {response_code})"
-            else:
-                full_error = "B2C payment failed - unknown error"
-            
-            print(f"✗ B2C payment failed: {full_error}")
-            print(f"Request ID: {request_id}")
-            print(f"Full response: {response_data}")
-            
-            return {
-                'success': False,
-                'error': full_error
-            }
-            
-    except requests.exceptions.Timeout:
-        print(f"B2C Payment Timeout: M-Pesa API took too long to respond")
+        },
+        'timeout': 30  # Sandbox can be slow
+    }
+
+def read_b2c_reply(reply):
+    """Turn Daraja's answer to a B2C call into {'success': ...} with an error users can read"""
+    if reply.outcome == 'no_token':
+        return {'success': False, 'error': 'Failed to authenticate with M-Pesa'}
+    if reply.outcome == 'timeout':
+        payment_log.error('b2c.timeout')
         return {
             'success': False,
             'error': 'M-Pesa is temporarily slow. Please try again in a moment. Your money is safe.'
         }
-    except requests.exceptions.RequestException as e:
-        print(f"B2C Payment Request Error: {str(e)}")
+    if reply.outcome == 'unreachable':
+        payment_log.error('b2c.unreachable', error=reply.error)
         return {
             'success': False,
             'error': 'Unable to connect to M-Pesa. Please check your internet connection and try again.'
         }
-    except Exception as e:
-        print(f"B2C Payment Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+
+    payment_log.debug('b2c.response', status=reply.status_code, body=reply.text)
+    response_data = reply.data
+    if response_data is None:
+        return {
+            'success': False,
+            'error': f'M-Pesa returned an invalid response. Status: {reply.status_code}'
+        }
+
+    # 401 Unauthorized - the consumer key/secret don't have B2C permissions
+    if reply.status_code == 401:
+        payment_log.error('b2c.unauthorized')
+        if MPESA_ENVIRONMENT == 'sandbox':
+            return {
+                'success': False,
+                'error': 'B2C_AUTH_FAILED',
+                'simulate': True,
+                'message': 'B2C authentication failed - using simulation mode'
+            }
         return {
             'success': False,
-            'error': f'An unexpected error occurred. Please try again later.'
+            'error': 'B2C not authorized. Please enable B2C permissions in your Daraja account or use B2C-specific credentials.'
         }
 
+    if reply.accepted:
+        payment_log.info('b2c.accepted', conversation_id=response_data.get('ConversationID'))
+        return {
+            'success': True,
+            'conversation_id': response_data.get('ConversationID'),
+            'originator_conversation_id': response_data.get('OriginatorConversationID'),
+            'response_description': response_data.get('ResponseDescription')
+        }
+
+    # Extract detailed error information
+    error_code = response_data.get('errorCode', '')
+    error_message = response_data.get('errorMessage', '')
+    response_code = response_data.get('ResponseCode', '')
+    response_desc = response_data.get('ResponseDescription', '')
+    
+    if error_message:
+        full_error = f"{error_message}"
+        if error_code:
+            full_error += f" (Code: {error_code})"
+        if 'invalid access token' in error_message.lower():
+            # Usually STK Push credentials, or an app without B2C enabled
+            full_error = "M-Pesa authentication failed. Please ensure B2C is enabled for your app."
+    elif response_desc:
+        full_error = f"{response_desc}"
+        if response_code:
+            full_error += f" (Code: {response_code})"
+    else:
+        full_error = "B2C payment failed - unknown error"
+    
+    payment_log.warning('b2c.failed', error=full_error, request_id=response_data.get('requestId', ''))
+    return {
+        'success': False,
+        'error': full_error
+    }
+
 # M-Pesa Daraja API Endpoints
 @app.route('/api/mpesa/stk-push', methods=['POST'])
 def mpesa_stk_push():
     """Initiate M-Pesa STK Push payment using Daraja API"""
-    data = request.get_json()
+    return run_payment(prepare_deposit, finalize_deposit, request.get_json())
+
+def prepare_deposit(data):
+    """Record the pending wallet deposit and build its STK Push"""
     user_id = data.get('user_id')
     amount = data.get('amount')
     phone_number = data.get('phone_number')
     
     if not user_id or not amount or not phone_number:
-        return jsonify({'error': 'User ID, amount, and phone number are required'}), 400
+        return None, (jsonify({'error': 'User ID, amount, and phone number are required'}), 400)
     
     # Validate amount
     try:
         amount = int(float(amount))
         if amount <= 0:
-            return jsonify({'error': 'Amount must be greater than 0'}), 400
+            return None, (jsonify({'error': 'Amount must be greater than 0'}), 400)
     except ValueError:
-        return jsonify({'error': 'Invalid amount'}), 400
+        return None, (jsonify({'error': 'Invalid amount'}), 400)
     
     # Check if user exists
     user = User.query.get_or_404(user_id)
     
     # Format phone number (remove + and spaces, ensure it starts with 254)
     phone_number = phone_number.replace('+', '').replace(' ', '').replace('-', '')
-    if phone_number.startswith('0'):
-        phone_number = '254' + phone_number[1:]
-    elif not phone_number.startswith('254'):
-        phone_number = '254' + phone_number
-    
-    # Generate a unique transaction ID
-    transaction_id = str(uuid.uuid4())
-    
-    # Create a new transaction
-    transaction = Transaction(
-        user_id=user_id,
-        transaction_id=transaction_id,
-        amount=amount,
-        phone_number=phone_number,
-        type='deposit',
-        status='pending'
-    )
-    
-    db.session.add(transaction)
-    db.session.commit()
-    
-    try:
-        # Get OAuth access token
-        access_token = get_mpesa_access_token()
-        
-        if not access_token:
-            transaction.status = 'failed'
-            db.session.commit()
-            return jsonify({
-                'success': False,
-                'error': 'Failed to authenticate with M-Pesa API',
-                'transaction_id': transaction_id
-            }), 500
-        
-        # Generate password and timestamp
-        password, timestamp = generate_password_and_timestamp()
-        
-        # Prepare STK Push request
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        payload = {
-            'BusinessShortCode': MPESA_BUSINESS_SHORT_CODE,
-            'Password': password,
-            'Timestamp': timestamp,
-            'TransactionType': 'CustomerPayBillOnline',
-            'Amount': amount,
-            'PartyA': phone_number,
-            'PartyB': MPESA_BUSINESS_SHORT_CODE,
-            'PhoneNumber': phone_number,
-            'CallBackURL': MPESA_CALLBACK_URL,
-            'AccountReference': f'Wallet-{user_id}',
-            'TransactionDesc': f'Wallet deposit for {user.name}'
-        }
-        
-        print(f"[PAYMENT] Initiating M-Pesa STK Push for booking {booking.id}, Amount: KES {final_price}")
-        
-        try:
-            response = requests.post(
-                f'{MPESA_API_BASE}/mpesa/stkpush/v1/processrequest',
-                json=payload,
-                headers=headers,
-                timeout=15
-            )
-            
-            response_data = response.json()
-        except (requests.exceptions.Timeout, requests.exceptions.RequestException) as e:
-            print(f"[PAYMENT ERROR] M-Pesa API call failed: {str(e)}")
-            # In sandbox mode, simulate successful payment
-            if MPESA_ENVIRONMENT == 'sandbox':
-                print("[PAYMENT] Using sandbox simulation due to API error")
-                booking.status = 'pending'
-                transaction.status = 'completed'
-                transaction.checkout_request_id = f'sim-{transaction_id[:20]}'
-                transaction.mpesa_receipt_number = f'SIM{str(uuid.uuid4().hex[:10]).upper()}'
-                
-                platform_fee_percentage = 10
-                platform_fee = final_price * (platform_fee_percentage / 100)
-                driver_amount = final_price - platform_fee
-                
-                escrow = Escrow(
-                    booking_id=booking.id,
-                    user_id=user_id,
-                    driver_id=driver_id,
-                    amount=final_price,
-                    platform_fee=platform_fee,
-                    driver_amount=driver_amount,
-                    status='held'
-                )
-                db.session.add(escrow)
-                
-                notification = Notification(
-                    driver_id=driver_id,
-                    message=f'New booking request from {user.name}. Amount: KES {final_price:.2f} (KES {driver_amount:.2f} for you after fees)'
-                )
-                db.session.add(notification)
-                db.session.commit()
-                
-                return jsonify({
-                    'success': True,
-                    'message': 'Payment processed successfully (Sandbox Mode)',
-                    'transaction_id': transaction_id,
-                    'booking_id': booking.id,
-                    'checkout_request_id': transaction.checkout_request_id,
-                    'amount': final_price,
-                    'simulated': True
-                }), 200
-            else:
-                transaction.status = 'failed'
-                booking.status = 'cancelled'
-                db.session.commit()
-                return jsonify({
-                    'success': False,
-                    'error': 'Payment gateway unavailable. Please try again later.',
-                    'transaction_id': transaction_id
-                }), 500
-        
-        if response.status_code == 200 and response_data.get('ResponseCode') == '0':
-            # STK Push initiated successfully
-            transaction.checkout_request_id = response_data.get('CheckoutRequestID')
-            transaction.merchant_request_id = response_data.get('MerchantRequestID')
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': 'STK Push sent. Please check your phone to complete payment.',
-                'transaction_id': transaction_id,
-                'checkout_request_id': response_data.get('CheckoutRequestID')
-            }), 200
-        else:
-            # STK Push failed
-            transaction.status = 'failed'
-            db.session.commit()
-            
-            error_message = response_data.get('errorMessage') or response_data.get('ResponseDescription') or 'Failed to initiate payment'
-            
-            return jsonify({
-                'success': False,
-                'error': error_message,
-                'transaction_id': transaction_id
-            }), 400
-            
-    except requests.exceptions.Timeout:
-        transaction.status = 'failed'
+    if phone_number.startswith('0'):
+        phone_number = '254' + phone_number[1:]
+    elif not phone_number.startswith('254'):
+        phone_number = '254' + phone_number
+    
+    # Generate a unique transaction ID
+    transaction_id = str(uuid.uuid4())
+    
+    # Create a new transaction
+    transaction = Transaction(
+        user_id=user_id,
+        transaction_id=transaction_id,
+        amount=amount,
+        phone_number=phone_number,
+        type='deposit',
+        status='pending'
+    )
+    
+    db.session.add(transaction)
+    db.session.commit()
+    
+    payment_log.info('stk_push.start', kind='deposit', transaction_id=transaction_id, amount=amount, phone_number=phone_number)
+    return {
+        'transaction_id': transaction_id,
+        'call': stk_push_call(amount, phone_number, f'Wallet-{user_id}',
+                              f'Wallet deposit for {user.name}', timeout=15)
+    }, None
+
+def finalize_deposit(plan, reply):
+    """Keep the checkout ids of an accepted STK Push; the callback credits the wallet"""
+    transaction_id = plan['transaction_id']
+    transaction = Transaction.query.filter_by(transaction_id=transaction_id).first()
+
+    if reply.accepted:
+        transaction.checkout_request_id = reply.data.get('CheckoutRequestID')
+        transaction.merchant_request_id = reply.data.get('MerchantRequestID')
         db.session.commit()
-        return jsonify({
-            'success': False,
-            'error': 'Payment request timed out. Please try again.',
-            'transaction_id': transaction_id
-        }), 500
         
-    except Exception as e:
-        transaction.status = 'failed'
-        db.session.commit()
         return jsonify({
-            'success': False,
-            'error': f'An error occurred: {str(e)}',
-            'transaction_id': transaction_id
-        }), 500
+            'success': True,
+            'message': 'STK Push sent. Please check your phone to complete payment.',
+            'transaction_id': transaction_id,
+            'checkout_request_id': reply.data.get('CheckoutRequestID')
+        }), 200
+
+    if reply.outcome == 'no_token':
+        error_message, status_code = 'Failed to authenticate with M-Pesa API', 500
+    elif reply.outcome == 'timeout':
+        error_message, status_code = 'Payment request timed out. Please try again.', 500
+    elif reply.outcome == 'unreachable':
+        payment_log.error('stk_push.unreachable', transaction_id=transaction_id, error=reply.error)
+        error_message, status_code = 'Payment gateway unavailable. Please try again later.', 500
+    else:
+        response_data = reply.data or {}
+        error_message = response_data.get('errorMessage') or response_data.get('ResponseDescription') or 'Failed to initiate payment'
+        status_code = 400
+    transaction.status = 'failed'
+    db.session.commit()
+    
+    return jsonify({
+        'success': False,
+        'error': error_message,
+        'transaction_id': transaction_id
+    }), status_code
 
 @app.route('/api/mpesa/callback', methods=['POST'])
 def mpesa_callback():
@@ -1319,7 +1959,7 @@ def mpesa_callback():
         result_code = stk_callback.get('ResultCode')
         result_desc = stk_callback.get('ResultDesc')
         
-        print(f"[CALLBACK] Received callback for CheckoutRequestID: {checkout_request_id}, ResultCode: {result_code}")
+        payment_log.info('callback.received', checkout_request_id=checkout_request_id, result_code=result_code)
         
         if not checkout_request_id:
             return jsonify({'error': 'CheckoutRequestID is required'}), 400
@@ -1328,13 +1968,12 @@ def mpesa_callback():
         transaction = Transaction.query.filter_by(checkout_request_id=checkout_request_id).first()
         
         if not transaction:
-            print(f"[CALLBACK ERROR] Transaction not found for CheckoutRequestID: {checkout_request_id}")
+            payment_log.warning('callback.unknown_transaction', checkout_request_id=checkout_request_id)
             return jsonify({'error': 'Transaction not found'}), 404
         
         # Update transaction status based on result code
         if result_code == 0:
             # Transaction successful
-            print(f"[CALLBACK SUCCESS] Processing successful payment for transaction {transaction.transaction_id}")
             transaction.status = 'completed'
             
             # Extract callback metadata
@@ -1345,7 +1984,6 @@ def mpesa_callback():
             for item in items:
                 if item.get('Name') == 'MpesaReceiptNumber':
                     transaction.mpesa_receipt_number = item.get('Value')
-                    print(f"[CALLBACK] M-Pesa Receipt: {transaction.mpesa_receipt_number}")
                 elif item.get('Name') == 'PhoneNumber':
                     transaction.phone_number = str(item.get('Value'))
             
@@ -1356,7 +1994,6 @@ def mpesa_callback():
                 if booking:
                     # Update booking status to pending (waiting for driver acceptance)
                     booking.status = 'pending'
-                    print(f"[CALLBACK] Booking {booking.id} status updated to pending")
                     
                     # Create escrow record
                     platform_fee_percentage = 10
@@ -1392,18 +2029,18 @@ def mpesa_callback():
                         message=f'New booking request from {user.name}. Amount: KES {transaction.amount:.2f} (KES {driver_amount:.2f} for you after fees)'
                     )
                     db.session.add(notification)
-                    print(f"[CALLBACK] Escrow and notifications created for booking {booking.id}")
+                    payment_log.info('callback.booking_paid', booking_id=booking.id, transaction_id=transaction.transaction_id, receipt=transaction.mpesa_receipt_number)
                     
             elif transaction.type == 'deposit':
                 # Update user wallet balance for deposit
                 user = User.query.get(transaction.user_id)
                 if user:
                     user.balance += transaction.amount
-                    print(f"[CALLBACK] User {user.id} balance updated: +{transaction.amount}")
+                    payment_log.info('callback.deposit_credited', user_id=user.id, amount=transaction.amount, receipt=transaction.mpesa_receipt_number)
                 
         else:
             # Transaction failed or cancelled
-            print(f"[CALLBACK FAILED] Payment failed for transaction {transaction.transaction_id}, Code: {result_code}, Desc: {result_desc}")
+            payment_log.warning('callback.payment_failed', transaction_id=transaction.transaction_id, result_code=result_code, result_desc=result_desc)
             transaction.status = 'failed'
             
             # If this was a booking payment, cancel the booking
@@ -1411,11 +2048,10 @@ def mpesa_callback():
                 booking = Booking.query.get(transaction.booking_id)
                 if booking:
                     booking.status = 'cancelled'
-                    print(f"[CALLBACK] Booking {booking.id} cancelled due to payment failure")
+                    payment_log.info('callback.booking_cancelled', booking_id=booking.id)
         
         # Commit all changes in one transaction for efficiency
         db.session.commit()
-        print(f"[CALLBACK] Successfully processed callback for transaction {transaction.transaction_id}")
         
         return jsonify({
             'ResultCode': 0,
@@ -1424,9 +2060,7 @@ def mpesa_callback():
         
     except Exception as e:
         db.session.rollback()  # Rollback on error
-        print(f"[CALLBACK ERROR] Callback error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        payment_log.exception('callback.failed', error=str(e))
         return jsonify({
             'ResultCode': 1,
             'ResultDesc': f'Error: {str(e)}'
@@ -1437,7 +2071,7 @@ def b2c_result_callback():
     """Handle M-Pesa B2C payment result"""
     try:
         data = request.get_json()
-        print(f"B2C Result Callback: {data}")
+        payment_log.debug('b2c_result.received', body=data)
         
         result = data.get('Result', {})
         result_code = result.get('ResultCode')
@@ -1450,12 +2084,11 @@ def b2c_result_callback():
         ).first()
         
         if not transaction:
-            print(f"Transaction not found for conversation ID: {conversation_id}")
+            payment_log.warning('b2c_result.unknown_transaction', conversation_id=conversation_id)
             return jsonify({'ResultCode': 1, 'ResultDesc': 'Transaction not found'}), 404
         
         if result_code == 0:
             # Success
-            print(f"B2C withdrawal successful: {transaction_id}")
             transaction.status = 'completed'
             
             # Extract receipt number from result parameters
@@ -1463,7 +2096,6 @@ def b2c_result_callback():
             for param in result_parameters:
                 if param.get('Key') == 'TransactionReceipt':
                     transaction.mpesa_receipt_number = param.get('Value')
-                    print(f"M-Pesa Receipt: {transaction.mpesa_receipt_number}")
             
             # Notify driver
             notification = Notification(
@@ -1472,17 +2104,17 @@ def b2c_result_callback():
             )
             db.session.add(notification)
             
-            print(f"Withdrawal completed: KES {transaction.amount} to user {transaction.user_id}")
+            payment_log.info('b2c_result.completed', transaction_id=transaction.transaction_id, user_id=transaction.user_id, amount=transaction.amount, receipt=transaction.mpesa_receipt_number)
         else:
             # Failed
-            print(f"B2C withdrawal failed: Code {result_code}, Desc: {result_desc}")
+            payment_log.warning('b2c_result.failed', transaction_id=transaction.transaction_id, result_code=result_code, result_desc=result_desc)
             transaction.status = 'failed'
             
             # Refund the driver
             driver = Driver.query.filter_by(user_id=transaction.user_id).first()
             if driver:
                 driver.earnings += transaction.amount
-                print(f"Refunded KES {transaction.amount} to driver earnings")
+                payment_log.info('withdrawal.refunded', transaction_id=transaction.transaction_id, amount=transaction.amount)
                 
                 notification = Notification(
                     user_id=transaction.user_id,
@@ -1495,7 +2127,7 @@ def b2c_result_callback():
         return jsonify({'ResultCode': 0, 'ResultDesc': 'Accepted'}), 200
         
     except Exception as e:
-        print(f"B2C callback error: {str(e)}")
+        payment_log.exception('b2c_result.failed', error=str(e))
         return jsonify({'ResultCode': 1, 'ResultDesc': str(e)}), 500
 
 @app.route('/api/mpesa/b2c-timeout', methods=['POST'])
@@ -1503,7 +2135,7 @@ def b2c_timeout_callback():
     """Handle M-Pesa B2C payment timeout"""
     try:
         data = request.get_json()
-        print(f"B2C Timeout Callback: {data}")
+        payment_log.debug('b2c_timeout.received', body=data)
         
         result = data.get('Result', {})
         conversation_id = result.get('ConversationID')
@@ -1514,7 +2146,7 @@ def b2c_timeout_callback():
         ).first()
         
         if transaction and transaction.status == 'pending':
-            print(f"B2C withdrawal timed out for transaction: {transaction.transaction_id}")
+            payment_log.warning('b2c_timeout.refunding', transaction_id=transaction.transaction_id, amount=transaction.amount)
             transaction.status = 'failed'
             
             # Refund the driver
@@ -1533,120 +2165,115 @@ def b2c_timeout_callback():
         return jsonify({'ResultCode': 0, 'ResultDesc': 'Timeout processed'}), 200
         
     except Exception as e:
-        print(f"B2C timeout error: {str(e)}")
+        payment_log.exception('b2c_timeout.failed', error=str(e))
         return jsonify({'ResultCode': 1, 'ResultDesc': str(e)}), 500
 
+def payment_poll_policy(transaction_id):
+    row = db.session.query(Transaction.status, Transaction.created_at).filter_by(
+        transaction_id=transaction_id
+    ).first()
+    if row is None:
+        return payment_poll_interval(None, 0)
+    age = (datetime.utcnow() - row.created_at).total_seconds() if row.created_at else 0
+    return payment_poll_interval(row.status, age)
+
+def transaction_version(transaction_id):
+    """None while M-Pesa has to be asked for the outcome; otherwise the transaction's stamp"""
+    row = db.session.query(Transaction.status, Transaction.checkout_request_id).filter_by(
+        transaction_id=transaction_id
+    ).first()
+    if row is None or (row.status == 'pending' and row.checkout_request_id):
+        return None
+    return resource_versions(f'transaction:{transaction_id}')
+
 @app.route('/api/mpesa/check-status/<transaction_id>', methods=['GET'])
+@poll_interval(payment_poll_policy)
+@conditional(transaction_version)
 def check_mpesa_status(transaction_id):
     """Check the status of an M-Pesa transaction using Daraja API"""
+    return run_payment(prepare_status_check, finalize_status_check, transaction_id)
+
+def transaction_status_response(transaction):
+    return jsonify({
+        'transaction_id': transaction.transaction_id,
+        'amount': transaction.amount,
+        'status': transaction.status,
+        'type': transaction.type,
+        'created_at': transaction.created_at,
+        'mpesa_receipt_number': transaction.mpesa_receipt_number
+    }), 200
+
+def prepare_status_check(transaction_id):
+    """Answer from the database unless the STK Push is still waiting on M-Pesa"""
     transaction = Transaction.query.filter_by(transaction_id=transaction_id).first()
     
     if not transaction:
-        return jsonify({'error': 'Transaction not found'}), 404
-    
-    # If status is already final (completed or failed), return immediately without querying M-Pesa
-    if transaction.status in ['completed', 'failed']:
-        return jsonify({
-            'transaction_id': transaction.transaction_id,
-            'amount': transaction.amount,
-            'status': transaction.status,
-            'type': transaction.type,
-            'created_at': transaction.created_at,
-            'mpesa_receipt_number': transaction.mpesa_receipt_number
-        }), 200
-    
-    # If we have a checkout request ID and status is still pending, query M-Pesa for the latest status
-    if transaction.checkout_request_id and transaction.status == 'pending':
-        try:
-            access_token = get_mpesa_access_token()
-            
-            if not access_token:
-                # Return current status if can't get access token
-                return jsonify({
-                    'transaction_id': transaction.transaction_id,
-                    'amount': transaction.amount,
-                    'status': transaction.status,
-                    'type': transaction.type,
-                    'created_at': transaction.created_at
-                }), 200
-            
-            # Generate password and timestamp
-            password, timestamp = generate_password_and_timestamp()
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}'
-            }
-            
-            payload = {
+        return None, (jsonify({'error': 'Transaction not found'}), 404)
+    
+    # Final (completed or failed) or never sent: nothing to ask M-Pesa
+    if transaction.status != 'pending' or not transaction.checkout_request_id:
+        return None, transaction_status_response(transaction)
+    
+    password, timestamp = generate_password_and_timestamp()
+    return {
+        'transaction_id': transaction_id,
+        'call': {
+            'path': '/mpesa/stkpushquery/v1/query',
+            'payload': {
                 'BusinessShortCode': MPESA_BUSINESS_SHORT_CODE,
                 'Password': password,
                 'Timestamp': timestamp,
                 'CheckoutRequestID': transaction.checkout_request_id
-            }
+            },
+            'timeout': 5  # Short; the client polls again anyway
+        }
+    }, None
+
+def finalize_status_check(plan, reply):
+    """Apply M-Pesa's answer to the query, or return the current status if it had none"""
+    transaction_id = plan['transaction_id']
+    transaction = Transaction.query.filter_by(transaction_id=transaction_id).first()
+
+    if reply.outcome == 'timeout':
+        payment_log.warning('status_query.timeout', transaction_id=transaction_id)
+    elif reply.outcome == 'unreachable':
+        payment_log.warning('status_query.unreachable', transaction_id=transaction_id, error=reply.error)
+    # The callback may have settled the transaction while M-Pesa was being asked
+    elif reply.outcome == 'ok' and reply.status_code == 200 and reply.data is not None and transaction.status == 'pending':
+        result_code = reply.data.get('ResultCode')
+        
+        if result_code == '0':
+            transaction.status = 'completed'
+            payment_log.info('status_query.completed', transaction_id=transaction_id, type=transaction.type)
             
-            # Use shorter timeout for faster response
-            response = requests.post(
-                f'{MPESA_API_BASE}/mpesa/stkpushquery/v1/query',
-                json=payload,
-                headers=headers,
-                timeout=5  # Reduced from 10 to 5 seconds
-            )
+            # Update user balance for deposits
+            if transaction.type == 'deposit':
+                user = User.query.get(transaction.user_id)
+                if user:
+                    user.balance += transaction.amount
+            
+            # Handle booking payments
+            elif transaction.type == 'booking_payment' and transaction.booking_id:
+                booking = Booking.query.get(transaction.booking_id)
+                if booking and booking.status == 'pending_payment':
+                    booking.status = 'pending'
             
-            if response.status_code == 200:
-                status_data = response.json()
-                result_code = status_data.get('ResultCode')
+            db.session.commit()
                 
-                # Update transaction status based on M-Pesa response
-                if result_code == '0':
-                    if transaction.status != 'completed':
-                        transaction.status = 'completed'
-                        print(f"[CHECK-STATUS] Transaction {transaction_id} marked as completed")
-                        
-                        # Update user balance for deposits
-                        if transaction.type == 'deposit':
-                            user = User.query.get(transaction.user_id)
-                            if user:
-                                user.balance += transaction.amount
-                                print(f"[CHECK-STATUS] User {user.id} balance updated: +{transaction.amount}")
-                        
-                        # Handle booking payments
-                        elif transaction.type == 'booking_payment' and transaction.booking_id:
-                            booking = Booking.query.get(transaction.booking_id)
-                            if booking and booking.status == 'pending_payment':
-                                booking.status = 'pending'
-                                print(f"[CHECK-STATUS] Booking {booking.id} status updated to pending")
-                        
-                        db.session.commit()
-                        
-                elif result_code in ['1032', '1037', '1']:
-                    # Transaction cancelled, timeout, or failed
-                    transaction.status = 'failed'
-                    print(f"[CHECK-STATUS] Transaction {transaction_id} marked as failed, Code: {result_code}")
-                    
-                    # Cancel booking if applicable
-                    if transaction.type == 'booking_payment' and transaction.booking_id:
-                        booking = Booking.query.get(transaction.booking_id)
-                        if booking:
-                            booking.status = 'cancelled'
-                            print(f"[CHECK-STATUS] Booking {booking.id} cancelled")
-                    
-                    db.session.commit()
-                    
-        except requests.Timeout:
-            print(f"[CHECK-STATUS] Timeout querying M-Pesa for transaction {transaction_id}")
-            # Return current status on timeout
-        except Exception as e:
-            print(f"[CHECK-STATUS] Error checking status for {transaction_id}: {str(e)}")
+        elif result_code in ['1032', '1037', '1']:
+            # Transaction cancelled, timeout, or failed
+            transaction.status = 'failed'
+            payment_log.info('status_query.failed', transaction_id=transaction_id, result_code=result_code)
+            
+            # Cancel booking if applicable
+            if transaction.type == 'booking_payment' and transaction.booking_id:
+                booking = Booking.query.get(transaction.booking_id)
+                if booking:
+                    booking.status = 'cancelled'
+            
+            db.session.commit()
     
-    return jsonify({
-        'transaction_id': transaction.transaction_id,
-        'amount': transaction.amount,
-        'status': transaction.status,
-        'type': transaction.type,
-        'created_at': transaction.created_at,
-        'mpesa_receipt_number': transaction.mpesa_receipt_number
-    }), 200
+    return transaction_status_response(transaction)
 
 @app.route('/api/user/<int:user_id>', methods=['GET'])
 def get_user(user_id):
@@ -1682,41 +2309,50 @@ def payment_history(user_id):
         'booking_id': transaction.booking_id
     } for transaction in transactions]
     
-    print(f"[PAYMENT HISTORY] User {user_id} has {len(payments)} transactions")
     return jsonify({'payments': payments})
 
 # Order History
+def or_na(value):
+    return 'N/A' if value is None else value
+
+OrderDriverUser = aliased(User)
+USER_ORDER_FIELDS = {
+    'booking_id': Field(Booking.id),
+    'driver_id': Field(Booking.driver_id),
+    'driver_name': Field(OrderDriverUser.name, build=or_na),
+    'driver_phone': Field(OrderDriverUser.phone, build=or_na),
+    'vehicle_type': Field(Driver.vehicle_type, build=or_na),
+    'license_plate': Field(Driver.license_plate, build=or_na),
+    'is_verified': Field(Driver.is_verified, build=lambda verified: bool(verified)),
+    'pickup_location': Field(Booking.pickup_location),
+    'dropoff_location': Field(Booking.dropoff_location),
+    'price': Field(Booking.price),
+    'distance': Field(Booking.distance),
+    'status': Field(Booking.status),
+    'created_at': Field(Booking.created_at)
+}
+
 @app.route('/api/user/order-history/<int:user_id>', methods=['GET'])
 def user_order_history(user_id):
-    """Get all orders for a specific user"""
+    """Get all orders for a specific user; ?fields= limits the keys returned"""
+    try:
+        columns, build_row = field_columns(USER_ORDER_FIELDS, requested_fields(request.args.get('fields'), USER_ORDER_FIELDS))
+    except FieldsError as e:
+        return jsonify({'error': str(e)}), 400
+
     # Verify user exists
     user = db.session.get(User, user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    orders = Booking.query.filter_by(user_id=user_id).order_by(Booking.created_at.desc()).all()
-    orders_data = []
-    for order in orders:
-        driver = db.session.get(Driver, order.driver_id) if order.driver_id else None
-        driver_user = db.session.get(User, driver.user_id) if driver else None
-        orders_data.append({
-            'booking_id': order.id,
-            'driver_id': order.driver_id,
-            'driver_name': driver_user.name if driver_user else 'N/A',
-            'driver_phone': driver_user.phone if driver_user else 'N/A',
-            'vehicle_type': driver.vehicle_type if driver else 'N/A',
-            'license_plate': driver.license_plate if driver else 'N/A',
-            'is_verified': driver.is_verified if driver else False,
-            'pickup_location': order.pickup_location,
-            'dropoff_location': order.dropoff_location,
-            'price': order.price,
-            'distance': order.distance,
-            'status': order.status,
-            'created_at': order.created_at.isoformat() if order.created_at else None
-        })
+    # Driver and driver's user come from outer joins instead of two lookups per order
+    orders = db.session.query(*columns).select_from(Booking).outerjoin(
+        Driver, Booking.driver_id == Driver.id
+    ).outerjoin(
+        OrderDriverUser, Driver.user_id == OrderDriverUser.id
+    ).filter(Booking.user_id == user_id).order_by(Booking.created_at.desc()).all()
     
-    print(f"[ORDER HISTORY] User {user_id} has {len(orders_data)} orders")
-    return jsonify({'orders': orders_data})
+    return jsonify({'orders': [build_row(order) for order in orders]})
 
 @app.route('/api/driver/order-history/<int:driver_id>', methods=['GET'])
 def driver_order_history(driver_id):
@@ -1741,7 +2377,6 @@ def driver_order_history(driver_id):
         'payment_method': 'M-Pesa'  # Currently all payments are via M-Pesa
     } for order in orders]
     
-    print(f"[ORDER HISTORY] Driver {driver_id} has {len(orders_data)} orders")
     return jsonify({'orders': orders_data})
 
 # Ratings and Reviews
@@ -1772,6 +2407,7 @@ def submit_review():
         total_rating = sum(r.rating for r in all_reviews)
         driver.ratings = total_rating / len(all_reviews)
         db.session.commit()
+        sync_driver_registry(driver)
 
     return jsonify({'message': 'Review submitted successfully!'})
 
@@ -2045,6 +2681,49 @@ def driver_check_escrow_earnings(driver_id):
     })
 
 # Live Tracking
+def parse_location_point(point):
+    """Return ((driver_id, lat, lng, timestamp), None) for a ping payload, or (None, error)
+
+    The timestamp is epoch seconds. One further ahead than LOCATION_MAX_CLOCK_SKEW
+    is refused: the buffer keeps only a driver's newest ping, so it would hide
+    every real position after it.
+    """
+    try:
+        driver_id = int(point.get('driver_id'))
+        if point.get('live_location'):
+            position = parse_latlng(point['live_location'])
+        else:
+            position = parse_latlng(f"{point.get('latitude')},{point.get('longitude')}")
+    except (AttributeError, TypeError, ValueError):
+        position = None
+    if not position:
+        return None, 'Live location must be in "latitude,longitude" format'
+    timestamp = point.get('timestamp')
+    if timestamp is not None:
+        if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float, str)):
+            return None, 'Timestamp must be a number of seconds since the epoch'
+        try:
+            timestamp = float(timestamp)
+        except ValueError:
+            return None, 'Timestamp must be a number of seconds since the epoch'
+        if not math.isfinite(timestamp) or timestamp <= 0:
+            return None, 'Timestamp must be a number of seconds since the epoch'
+        if timestamp > time.time() + LOCATION_MAX_CLOCK_SKEW:
+            return None, 'Timestamp is ahead of server time; check the device clock'
+    return (driver_id, position[0], position[1], timestamp), None
+
+def ingest_location(driver_id, lat, lng, timestamp=None):
+    """Buffer a ping in memory; the location flusher persists it in bulk"""
+    timestamp = timestamp if timestamp is not None else time.time()
+    if location_buffer.submit(driver_id, lat, lng, timestamp):
+        driver_registry.update_position(driver_id, lat, lng)
+        ensure_trail_store()
+        booking_id = trail_store.record(driver_id, timestamp, lat, lng)
+        if booking_id is not None:
+            # One publish per ping however many customers are watching the booking
+            broadcaster.publish(f'booking:{booking_id}', timestamp, 'position', position_payload(timestamp, lat, lng))
+    ensure_location_flusher()
+
 @app.route('/api/driver/update-location', methods=['POST'])
 def update_driver_location():
     data = request.get_json()
@@ -2054,57 +2733,177 @@ def update_driver_location():
     if not driver_id or not live_location:
         return jsonify({'error': 'Driver ID and live location are required'}), 400
 
-    driver = Driver.query.get_or_404(driver_id)
-    driver.live_location = live_location
-    db.session.commit()
+    point, error = parse_location_point(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    ingest_location(*point)
 
     return jsonify({'message': 'Driver location updated successfully!'})
 
+@app.route('/api/driver/update-locations', methods=['POST'])
+def update_driver_locations():
+    """Batch ingestion of GPS pings: {"points": [{"driver_id", "live_location" | "latitude"/"longitude", "timestamp"}]}"""
+    data = request.get_json()
+    points = data.get('points') if data else None
+
+    if not isinstance(points, list) or not points:
+        return jsonify({'error': 'A non-empty list of points is required'}), 400
+    if len(points) > LOCATION_BATCH_LIMIT:
+        return jsonify({'error': f'At most {LOCATION_BATCH_LIMIT} points per batch'}), 400
+
+    accepted = 0
+    rejected = 0
+    for point in points:
+        parsed, _ = parse_location_point(point) if isinstance(point, dict) else (None, None)
+        if parsed:
+            ingest_location(*parsed)
+            accepted += 1
+        else:
+            rejected += 1
+
+    return jsonify({'accepted': accepted, 'rejected': rejected})
+
+def tracking_version(booking_id):
+    """Booking and driver stamps plus the time of the driver's latest in-memory ping"""
+    row = db.session.query(Booking.version, Booking.driver_id).filter_by(id=booking_id).first()
+    if row is None:
+        return None
+    live = location_buffer.latest(row.driver_id)
+    return (row.version or 0,) + resource_versions(f'driver:{row.driver_id}') + (live[2] if live else 0,)
+
+def tracking_poll_policy(booking_id):
+    row = db.session.query(Booking.status, Booking.driver_id).filter_by(id=booking_id).first()
+    if row is None:
+        return tracking_poll_interval(None, None)
+    live = location_buffer.latest(row.driver_id)
+    return tracking_poll_interval(row.status, time.time() - live[2] if live else None)
+
 @app.route('/api/user/track-driver/<int:booking_id>', methods=['GET'])
+@poll_interval(tracking_poll_policy)
+@conditional(tracking_version)
 def track_driver(booking_id):
     booking = Booking.query.get_or_404(booking_id)
     driver = Driver.query.get_or_404(booking.driver_id)
 
-    if not driver.live_location:
+    # Prefer the live in-memory position; the database copy lags by up to one flush interval
+    live = location_buffer.latest(driver.id)
+    if live:
+        live_location = f'{live[0]},{live[1]}'
+        location_updated_at = datetime.fromtimestamp(live[2], timezone.utc).isoformat()
+    else:
+        live_location = driver.live_location
+        location_updated_at = None
+
+    if not live_location:
         return jsonify({'error': 'Driver location not available'}), 404
 
+    # Route travelled so far; ?since=<last_timestamp> returns only newer points
+    try:
+        since = float(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': 'since must be a Unix timestamp'}), 400
+
+    ensure_trail_store()
+    trail_points = trail_store.points(booking.id, since)
+    if trail_points is None:
+        stored_trail = BookingTrail.query.filter_by(booking_id=booking.id).first()
+        trail_points = points_since(unpack_points(stored_trail.points), since) if stored_trail else []
+
     return jsonify({
         'booking_id': booking.id,
         'driver_id': driver.id,
         'driver_name': driver.user.name,
-        'driver_phone': driver.user.phone_number,
+        'driver_phone': driver.user.phone,
         'vehicle_type': driver.vehicle_type,
-        'vehicle_color': driver.vehicle_color or 'N/A',
+        'vehicle_color': 'N/A',  # Not recorded for drivers
         'license_plate': driver.license_plate,
         'is_verified': driver.is_verified,
-        'live_location': driver.live_location,
+        'live_location': live_location,
+        'location_updated_at': location_updated_at,
         'pickup_location': booking.pickup_location,
         'dropoff_location': booking.dropoff_location,
-        'status': booking.status
+        'status': booking.status,
+        'trail': trail_payload(trail_points)
     })
 
+@app.route('/api/user/track-driver/<int:booking_id>/stream', methods=['GET'])
+def track_driver_stream(booking_id):
+    """Server-Sent Events: 'position' on every ping of the booking's driver, 'status' on changes"""
+    booking = Booking.query.get_or_404(booking_id)
+    if booking.status in BOOKING_FINAL_STATUSES:
+        return jsonify({'error': f'Booking is {booking.status}; live tracking has ended'}), 400
+
+    subscription, busy = open_subscription(f'booking:{booking.id}')
+    if busy:
+        return busy
+    cursor = last_event_id(float)
+    ensure_trail_store()
+    missed = trail_store.points(booking.id, cursor) if cursor is not None else None
+    if missed:
+        # Resume: every point recorded since the client's last event
+        replay = [(ts, 'position', position_payload(ts, lat, lng)) for ts, lat, lng in missed]
+    else:
+        latest = location_buffer.latest(booking.driver_id)
+        replay = [(latest[2], 'position', position_payload(latest[2], latest[0], latest[1]))] \
+            if latest and (cursor is None or latest[2] > cursor) else []
+    db.session.remove()  # Do not hold a connection for the lifetime of the stream
+    return sse_response(subscription, replay)
+
 # Notifications
 @app.route('/api/user/notifications/<int:user_id>', methods=['GET'])
+@poll_interval(every(60))  # New notifications are pushed over the stream
+@conditional(lambda user_id: resource_versions(f'notifications:user:{user_id}'))
 def user_notifications(user_id):
-    notifications = Notification.query.filter_by(user_id=user_id).all()
-    notifications_data = [{
-        'id': notification.id,
-        'message': notification.message,
-        'is_read': notification.is_read,
-        'created_at': notification.created_at
-    } for notification in notifications]
-    return jsonify({'notifications': notifications_data})
+    return notification_list(Notification.user_id == user_id)
 
 @app.route('/api/driver/notifications/<int:driver_id>', methods=['GET'])
+@poll_interval(every(60))  # New notifications are pushed over the stream
+@conditional(lambda driver_id: resource_versions(f'notifications:driver:{driver_id}'))
 def driver_notifications(driver_id):
-    notifications = Notification.query.filter_by(driver_id=driver_id).all()
+    return notification_list(Notification.driver_id == driver_id)
+
+def notification_list(owner_filter):
+    """All of a recipient's notifications, or with ?since_id= only newer ones in id order"""
+    try:
+        since_id = int(request.args['since_id']) if request.args.get('since_id') else None
+    except ValueError:
+        return jsonify({'error': 'since_id must be a notification id'}), 400
+
+    query = Notification.query.filter(owner_filter)
+    if since_id is not None:
+        query = query.filter(Notification.id > since_id).order_by(Notification.id)
+    notifications = query.all()
     notifications_data = [{
         'id': notification.id,
         'message': notification.message,
         'is_read': notification.is_read,
         'created_at': notification.created_at
     } for notification in notifications]
-    return jsonify({'notifications': notifications_data})
+    last_id = max([since_id or 0] + [notification.id for notification in notifications])
+    return jsonify({'notifications': notifications_data, 'last_id': last_id})
+
+@app.route('/api/user/notifications/<int:user_id>/unread-count', methods=['GET'])
+@poll_interval(every(60))
+@conditional(lambda user_id: resource_versions(f'notifications:user:{user_id}'))
+def user_unread_count(user_id):
+    return jsonify({'unread': unread_count(f'user:{user_id}', Notification.user_id == user_id)})
+
+@app.route('/api/driver/notifications/<int:driver_id>/unread-count', methods=['GET'])
+@poll_interval(every(60))
+@conditional(lambda driver_id: resource_versions(f'notifications:driver:{driver_id}'))
+def driver_unread_count(driver_id):
+    return jsonify({'unread': unread_count(f'driver:{driver_id}', Notification.driver_id == driver_id)})
+
+@app.route('/api/user/notifications/<int:user_id>/stream', methods=['GET'])
+def user_notification_stream(user_id):
+    """Server-Sent Events stream of new notifications for a user"""
+    return notification_stream(f'user:{user_id}', Notification.user_id == user_id)
+
+@app.route('/api/driver/notifications/<int:driver_id>/stream', methods=['GET'])
+def driver_notification_stream(driver_id):
+    """Server-Sent Events stream of new notifications for a driver"""
+    return notification_stream(f'driver:{driver_id}', Notification.driver_id == driver_id)
 
 @app.route('/api/notifications/mark-read/<int:notification_id>', methods=['POST'])
 def mark_notification_read(notification_id):
@@ -2113,6 +2912,113 @@ def mark_notification_read(notification_id):
     db.session.commit()
     return jsonify({'message': 'Notification marked as read!'})
 
+@app.route('/api/notifications/mark-read', methods=['POST'])
+def mark_notifications_read():
+    """Mark many of one recipient's notifications read in a single UPDATE
+    Body: {"user_id" | "driver_id", "ids": [...]} or {"user_id" | "driver_id", "up_to_id": n}
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get('user_id'):
+        key, owner_filter = f"user:{data['user_id']}", Notification.user_id == data['user_id']
+    elif data.get('driver_id'):
+        key, owner_filter = f"driver:{data['driver_id']}", Notification.driver_id == data['driver_id']
+    else:
+        return jsonify({'error': 'user_id or driver_id is required'}), 400
+
+    ids = data.get('ids')
+    if isinstance(ids, list) and ids:
+        if len(ids) > NOTIFICATION_MARK_READ_LIMIT:
+            return jsonify({'error': f'At most {NOTIFICATION_MARK_READ_LIMIT} ids per request; use up_to_id'}), 400
+        selection = Notification.id.in_(ids)
+    elif isinstance(data.get('up_to_id'), int):
+        selection = Notification.id <= data['up_to_id']
+    else:
+        return jsonify({'error': 'ids or up_to_id is required'}), 400
+
+    # Bulk UPDATE skips the flush hooks, so the counter and version are adjusted here
+    marked = Notification.query.filter(owner_filter, selection, UNREAD_NOTIFICATION).update(
+        {'is_read': True}, synchronize_session=False
+    )
+    if marked:
+        connection = db.session.connection()
+        adjust_unread_counters(connection, {key: -marked})
+        bump_resource_versions(connection, {f'notifications:{key}'})
+    db.session.commit()
+    return jsonify({'marked': marked})
+
+# Streaming exports: (model, exported columns with id first, extra equality filters)
+EXPORTS = {
+    'transactions': (Transaction, ('id', 'transaction_id', 'user_id', 'booking_id', 'type', 'status', 'amount',
+                                   'phone_number', 'mpesa_receipt_number', 'created_at'), ('user_id', 'booking_id', 'type')),
+    'escrows': (Escrow, ('id', 'booking_id', 'user_id', 'driver_id', 'amount', 'platform_fee', 'driver_amount',
+                         'status', 'created_at', 'released_at', 'refunded_at'), ('user_id', 'driver_id')),
+    'bookings': (Booking, ('id', 'user_id', 'driver_id', 'pickup_location', 'dropoff_location', 'distance', 'price',
+                           'status', 'promo_code', 'created_at'), ('user_id', 'driver_id')),
+}
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def export_conditions(model, filters):
+    """SQL conditions from ?status=a,b&from=&to=(exclusive) and the table's id filters"""
+    conditions = []
+    statuses = [status for status in request.args.get('status', '').split(',') if status]
+    if statuses:
+        conditions.append(model.status.in_(statuses))
+    start = parse_timestamp(request.args.get('from'), 'from')
+    end = parse_timestamp(request.args.get('to'), 'to')
+    if start is not None:
+        conditions.append(model.created_at >= start)
+    if end is not None:
+        conditions.append(model.created_at < end)
+    for name in filters:
+        value = request.args.get(name)
+        if value is None:
+            continue
+        column = getattr(model, name)
+        if isinstance(column.type, db.Integer):
+            if not value.isdigit():
+                raise ExportError(f'{name} must be an integer')
+            value = int(value)
+        conditions.append(column == value)
+    return conditions, start is not None or end is not None
+
+@app.route('/api/admin/export/<kind>', methods=['GET'])
+def export_table(kind):
+    """Stream transactions, escrows or bookings as NDJSON or CSV (?format=), filtered in SQL"""
+    if kind not in EXPORTS:
+        return jsonify({'error': f"Unknown export, expected one of: {', '.join(EXPORTS)}"}), 404
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    model, columns, filters = EXPORTS[kind]
+    try:
+        conditions, by_date = export_conditions(model, filters)
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if by_date:
+        # Narrow the date range to an id range (read from the created_at index) so batches seek by id
+        first_id, last_id = db.session.query(db.func.min(model.id), db.func.max(model.id)).filter(*conditions).one()
+        if first_id is None:
+            conditions.append(db.false())
+        else:
+            conditions.extend([model.id >= first_id, model.id <= last_id])
+    selected = [getattr(model, column) for column in columns]
+
+    def fetch_batch(after_id, limit):
+        query = db.select(*selected).where(*conditions)
+        if after_id is not None:
+            query = query.where(model.id > after_id)
+        return db.session.execute(query.order_by(model.id).limit(limit)).all()
+
+    rows = keyset_rows(fetch_batch, EXPORT_BATCH_SIZE)
+    if export_format == 'csv':
+        lines = csv_lines(columns, rows)
+    else:
+        lines = ndjson_lines(columns, rows, app.json.dumps_bytes)
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.{export_format}"
+    return Response(stream_with_context(chunked(lines)), mimetype=EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 # Admin Payment Statistics - Real M-Pesa Data
 @app.route('/api/admin/payments-summary', methods=['GET'])
 def admin_payments_summary():
@@ -2280,6 +3186,7 @@ def user_cancel_order(booking_id):
 
     booking.status = 'cancelled'
     db.session.commit()
+    trail_store.finish(booking.id)
 
     # Notify driver
     notification = Notification(
@@ -2329,6 +3236,7 @@ def driver_cancel_order(booking_id):
 
     booking.status = 'cancelled'
     db.session.commit()
+    trail_store.finish(booking.id)
 
     # Notify user
     notification = Notification(
@@ -2356,6 +3264,7 @@ def toggle_availability():
     driver = Driver.query.get_or_404(driver_id)
     driver.is_available = is_available
     db.session.commit()
+    sync_driver_registry(driver)
 
     return jsonify({'message': 'Availability updated successfully!', 'is_available': driver.is_available})
 
@@ -2430,50 +3339,56 @@ def get_driver_earnings(driver_id):
             'message': f'{len(held_escrows)} booking(s) pending completion. Complete services to release KES {pending_escrow:.2f}'
         })
     except Exception as e:
-        print(f"Error fetching driver earnings: {str(e)}")
+        log.exception('driver_earnings.failed', error=str(e))
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/driver/withdraw', methods=['POST'])
 def driver_withdraw():
     """Driver withdraws available earnings to M-Pesa (only released escrow funds)"""
+    return run_payment(prepare_withdrawal, finalize_withdrawal, request.get_json())
+
+def pending_escrow_total(driver_id):
+    held_escrows = Escrow.query.filter_by(driver_id=driver_id, status='held').all()
+    return sum(e.driver_amount for e in held_escrows)
+
+def prepare_withdrawal(data):
+    """Validate, record the withdrawal and deduct it from earnings; B2C only outside sandbox"""
     try:
-        data = request.get_json()
         driver_id = data.get('driver_id')
         amount = data.get('amount')
         phone_number = data.get('phone_number')
         
         if not driver_id or not amount or not phone_number:
-            return jsonify({'error': 'Driver ID, amount, and phone number are required'}), 400
+            return None, (jsonify({'error': 'Driver ID, amount, and phone number are required'}), 400)
         
         driver = db.session.get(Driver, driver_id)
         if not driver:
-            return jsonify({'error': 'Driver not found'}), 404
+            return None, (jsonify({'error': 'Driver not found'}), 404)
         
         # Validate amount
         try:
             amount = float(amount)
             if amount <= 0:
-                return jsonify({'error': 'Amount must be greater than 0'}), 400
+                return None, (jsonify({'error': 'Amount must be greater than 0'}), 400)
             if amount < 20:
-                return jsonify({'error': 'Minimum withdrawal amount is KES 20'}), 400
+                return None, (jsonify({'error': 'Minimum withdrawal amount is KES 20'}), 400)
             if amount > 50000:
-                return jsonify({'error': 'Maximum withdrawal amount is KES 50,000 per transaction'}), 400
+                return None, (jsonify({'error': 'Maximum withdrawal amount is KES 50,000 per transaction'}), 400)
         except ValueError:
-            return jsonify({'error': 'Invalid amount format'}), 400
+            return None, (jsonify({'error': 'Invalid amount format'}), 400)
         
         # Check if driver has sufficient available earnings (not pending in escrow)
         if driver.earnings < amount:
             # Get pending escrow to show helpful message
-            held_escrows = Escrow.query.filter_by(driver_id=driver_id, status='held').all()
-            pending_escrow = sum(e.driver_amount for e in held_escrows)
+            pending_escrow = pending_escrow_total(driver_id)
             
-            return jsonify({
+            return None, (jsonify({
                 'error': 'Insufficient available earnings',
                 'available_now': driver.earnings,
                 'pending_in_escrow': pending_escrow,
                 'requested': amount,
                 'message': f'You have KES {pending_escrow:.2f} pending in escrow. Complete your active orders to release these funds.'
-            }), 400
+            }), 400)
         
         # Validate and format phone number
         phone_number = str(phone_number).replace('+', '').replace(' ', '').replace('-', '')
@@ -2484,7 +3399,7 @@ def driver_withdraw():
         
         # Validate phone number format
         if not phone_number.isdigit() or len(phone_number) != 12:
-            return jsonify({'error': 'Invalid phone number format. Use format: 0712345678'}), 400
+            return None, (jsonify({'error': 'Invalid phone number format. Use format: 0712345678'}), 400)
         
         # Generate transaction ID
         transaction_id = f'WTH-{uuid.uuid4().hex[:8].upper()}'
@@ -2504,131 +3419,108 @@ def driver_withdraw():
         driver.earnings -= amount
         db.session.commit()
         
-        # In sandbox mode, always simulate withdrawals (B2C requires special permissions)
-        if MPESA_ENVIRONMENT == 'sandbox':
-            print(f"[SANDBOX] Simulating withdrawal of KES {amount} for faster testing")
+        # Sandbox always simulates (B2C requires special permissions), as does a server without B2C credentials
+        use_real_api = MPESA_ENVIRONMENT != 'sandbox' and MPESA_SECURITY_CREDENTIAL and len(MPESA_SECURITY_CREDENTIAL) > 10
+        call = None
+        if use_real_api:
+            call = b2c_payment_call(phone_number, amount, transaction_id, remarks=f'Withdrawal for driver {driver.user_id}')
+        
+        return {
+            'transaction_id': transaction_id,
+            'driver_id': driver.id,
+            'driver_user_id': driver.user_id,
+            'amount': amount,
+            'phone_number': phone_number,
+            'call': call
+        }, None
+            
+    except Exception as e:
+        payment_log.exception('withdrawal.failed', error=str(e))
+        return None, (jsonify({'error': 'Internal server error'}), 500)
+
+def finalize_withdrawal(plan, reply):
+    """Complete a simulated withdrawal, or record the B2C outcome and refund on failure"""
+    transaction_id = plan['transaction_id']
+    transaction = Transaction.query.filter_by(transaction_id=transaction_id).first()
+    driver = db.session.get(Driver, plan['driver_id'])
+    amount = plan['amount']
+    phone_number = plan['phone_number']
+    sandbox = MPESA_ENVIRONMENT == 'sandbox'
+    
+    try:
+        if reply is None:
+            if sandbox:
+                payment_log.info('withdrawal.simulated', transaction_id=transaction_id, amount=amount, sandbox=True)
+            else:
+                payment_log.info('withdrawal.simulated', transaction_id=transaction_id, amount=amount, sandbox=False)
             transaction.status = 'completed'
             transaction.mpesa_receipt_number = f'SIM-WTH-{uuid.uuid4().hex[:10].upper()}'
-            db.session.commit()
             
             # Notify driver
             notification = Notification(
-                user_id=driver.user_id,
-                message=f'Withdrawal successful! KES {amount:.2f} sent to {phone_number[-10:]}'
+                user_id=plan['driver_user_id'],
+                message=f"{'' if sandbox else '[SIMULATED] '}Withdrawal successful! KES {amount:.2f} sent to {phone_number[-10:]}"
             )
             db.session.add(notification)
             db.session.commit()
             
-            # Get updated pending escrow
-            held_escrows = Escrow.query.filter_by(driver_id=driver_id, status='held').all()
-            pending_escrow = sum(e.driver_amount for e in held_escrows)
-            
             return jsonify({
                 'success': True,
-                'message': f'✅ Withdrawal of KES {amount:.2f} processed successfully!',
+                'message': f'✅ Withdrawal of KES {amount:.2f} processed successfully!' if sandbox else f'Withdrawal of KES {amount:.2f} processed successfully',
                 'transaction_id': transaction_id,
                 'remaining_earnings': driver.earnings,
-                'pending_in_escrow': pending_escrow,
+                'pending_in_escrow': pending_escrow_total(driver.id),
                 'phone_number': phone_number,
                 'simulated': True
             }), 200
         
-        # Production mode - attempt real B2C
-        use_real_api = MPESA_SECURITY_CREDENTIAL and len(MPESA_SECURITY_CREDENTIAL) > 10
-        
-        try:
-            if use_real_api:
-                # Real M-Pesa B2C API call
-                print(f"[PRODUCTION] Initiating real M-Pesa B2C withdrawal for KES {amount}")
-                b2c_result = initiate_b2c_payment(
-                    phone_number=phone_number,
-                    amount=amount,
-                    transaction_id=transaction_id,
-                    remarks=f'Withdrawal for driver {driver.user_id}'
-                )
-                
-                if b2c_result['success']:
-                    # B2C initiated successfully - status remains pending until callback
-                    transaction.checkout_request_id = b2c_result.get('conversation_id')
-                    transaction.merchant_request_id = b2c_result.get('originator_conversation_id')
-                    db.session.commit()
-                    
-                    # Notify driver
-                    notification = Notification(
-                        user_id=driver.user_id,
-                        message=f'Withdrawal request of KES {amount:.2f} is being processed. You will receive the money shortly.'
-                    )
-                    db.session.add(notification)
-                    db.session.commit()
-                    
-                    # Get updated pending escrow
-                    held_escrows = Escrow.query.filter_by(driver_id=driver_id, status='held').all()
-                    pending_escrow = sum(e.driver_amount for e in held_escrows)
-                    
-                    return jsonify({
-                        'success': True,
-                        'message': f'✅ Withdrawal initiated! KES {amount:.2f} will be sent to {phone_number} shortly',
-                        'transaction_id': transaction_id,
-                        'status': 'pending',
-                        'remaining_earnings': driver.earnings,
-                        'pending_in_escrow': pending_escrow
-                    }), 200
-                else:
-                    # B2C failed - refund earnings
-                    transaction.status = 'failed'
-                    driver.earnings += amount
-                    db.session.commit()
-                    
-                    return jsonify({
-                        'success': False,
-                        'error': b2c_result['error'],
-                        'transaction_id': transaction_id
-                    }), 400
-            else:
-                # Simulate successful withdrawal for development
-                print(f"Simulating withdrawal of KES {amount} (No B2C credentials configured)")
-                transaction.status = 'completed'
-                transaction.mpesa_receipt_number = f'SIM-WTH-{uuid.uuid4().hex[:10].upper()}'
-                db.session.commit()
-                
-                # Notify driver
-                notification = Notification(
-                    user_id=driver.user_id,
-                    message=f'[SIMULATED] Withdrawal successful! KES {amount:.2f} sent to {phone_number[-10:]}'
-                )
-                db.session.add(notification)
-                db.session.commit()
-                
-                # Get updated pending escrow
-                held_escrows = Escrow.query.filter_by(driver_id=driver_id, status='held').all()
-                pending_escrow = sum(e.driver_amount for e in held_escrows)
-                
-                return jsonify({
-                    'success': True,
-                    'message': f'Withdrawal of KES {amount:.2f} processed successfully',
-                    'transaction_id': transaction_id,
-                    'remaining_earnings': driver.earnings,
-                    'pending_in_escrow': pending_escrow,
-                    'phone_number': phone_number,
-                    'simulated': True
-                }), 200
+        b2c_result = read_b2c_reply(reply)
+        if b2c_result['success']:
+            # B2C initiated successfully - status remains pending until callback
+            transaction.checkout_request_id = b2c_result.get('conversation_id')
+            transaction.merchant_request_id = b2c_result.get('originator_conversation_id')
             
-        except Exception as e:
-            # Refund earnings if withdrawal fails
-            transaction.status = 'failed'
-            driver.earnings += amount
+            # Notify driver
+            notification = Notification(
+                user_id=plan['driver_user_id'],
+                message=f'Withdrawal request of KES {amount:.2f} is being processed. You will receive the money shortly.'
+            )
+            db.session.add(notification)
             db.session.commit()
             
-            print(f"Withdrawal error: {str(e)}")
             return jsonify({
-                'success': False,
-                'error': f'Withdrawal failed: {str(e)}',
-                'transaction_id': transaction_id
-            }), 500
-            
+                'success': True,
+                'message': f'✅ Withdrawal initiated! KES {amount:.2f} will be sent to {phone_number} shortly',
+                'transaction_id': transaction_id,
+                'status': 'pending',
+                'remaining_earnings': driver.earnings,
+                'pending_in_escrow': pending_escrow_total(driver.id)
+            }), 200
+        
+        # B2C failed - refund earnings
+        transaction.status = 'failed'
+        driver.earnings += amount
+        db.session.commit()
+        
+        return jsonify({
+            'success': False,
+            'error': b2c_result['error'],
+            'transaction_id': transaction_id
+        }), 400
+        
     except Exception as e:
-        print(f"Driver withdrawal error: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500
+        # Refund earnings if withdrawal fails
+        db.session.rollback()
+        transaction.status = 'failed'
+        driver.earnings += amount
+        db.session.commit()
+        
+        payment_log.exception('withdrawal.refunded', transaction_id=transaction_id, amount=amount, error=str(e))
+        return jsonify({
+            'success': False,
+            'error': f'Withdrawal failed: {str(e)}',
+            'transaction_id': transaction_id
+        }), 500
 
 # Driver Verification System
 @app.route('/api/driver/submit-verification/<int:driver_id>', methods=['POST'])
@@ -2669,6 +3561,10 @@ def submit_driver_verification():
     return jsonify({'message': 'Verification documents submitted successfully!', 'status': 'under_review'})
 
 @app.route('/api/driver/verification-status/<int:driver_id>', methods=['GET'])
+@poll_interval(lambda driver_id: verification_poll_interval(
+    db.session.query(Driver.verification_status).filter_by(id=driver_id).scalar()
+))
+@conditional(lambda driver_id: resource_versions(f'driver:{driver_id}'))
 def get_driver_verification_status(driver_id):
     """Get driver verification status"""
     driver = Driver.query.get_or_404(driver_id)
@@ -2692,54 +3588,59 @@ def get_driver_verification_status(driver_id):
         }
     })
 
+def verification_documents(drivers_license, vehicle_registration, insurance_certificate, vehicle_photo, profile_photo):
+    return {
+        'drivers_license': drivers_license,
+        'vehicle_registration': vehicle_registration,
+        'insurance_certificate': insurance_certificate,
+        'vehicle_photo': vehicle_photo,
+        'profile_photo': profile_photo
+    }
+
+PENDING_VERIFICATION_FIELDS = {
+    'driver_id': Field(Driver.id),
+    'user_id': Field(Driver.user_id),
+    'name': Field(User.name),
+    'email': Field(User.email),
+    'phone': Field(User.phone),
+    'vehicle_type': Field(Driver.vehicle_type),
+    'license_plate': Field(Driver.license_plate),
+    'license_number': Field(Driver.license_number),
+    'license_expiry': Field(Driver.license_expiry),
+    'insurance_expiry': Field(Driver.insurance_expiry),
+    'submitted_at': Field(Driver.submitted_at),
+    'documents': Field(Driver.drivers_license_url, Driver.vehicle_registration_url, Driver.insurance_certificate_url,
+                       Driver.vehicle_photo_url, Driver.profile_photo_url, build=verification_documents)
+}
+
 @app.route('/api/admin/pending-verifications', methods=['GET'])
 def get_pending_verifications():
-    """Admin gets all pending driver verifications - OPTIMIZED with JOIN"""
+    """Admin gets all pending driver verifications; ?fields= limits the columns loaded and returned"""
+    try:
+        columns, build_row = field_columns(
+            PENDING_VERIFICATION_FIELDS, requested_fields(request.args.get('fields'), PENDING_VERIFICATION_FIELDS)
+        )
+    except FieldsError as e:
+        return jsonify({'error': str(e)}), 400
+
     # Use JOIN to get all data in one query (eliminates N+1 problem)
-    results = db.session.query(Driver, User).join(
+    results = db.session.query(*columns).select_from(Driver).join(
         User, Driver.user_id == User.id
     ).filter(
         Driver.verification_status.in_(['pending', 'under_review'])
     ).all()
     
-    drivers_data = []
-    for driver, user in results:
-        drivers_data.append({
-            'driver_id': driver.id,
-            'user_id': driver.user_id,
-            'name': user.name,
-            'email': user.email,
-            'phone': user.phone,
-            'vehicle_type': driver.vehicle_type,
-            'license_plate': driver.license_plate,
-            'license_number': driver.license_number,
-            'license_expiry': driver.license_expiry,
-            'insurance_expiry': driver.insurance_expiry,
-            'submitted_at': driver.submitted_at,
-            'documents': {
-                'drivers_license': driver.drivers_license_url,
-                'vehicle_registration': driver.vehicle_registration_url,
-                'insurance_certificate': driver.insurance_certificate_url,
-                'vehicle_photo': driver.vehicle_photo_url,
-                'profile_photo': driver.profile_photo_url
-            }
-        })
-    
-    return jsonify({'pending_verifications': drivers_data})
+    return jsonify({'pending_verifications': [build_row(row) for row in results]})
 
 @app.route('/api/admin/verify-driver/<int:driver_id>', methods=['POST'])
 def verify_driver(driver_id):
     """Admin approves driver verification"""
     data = request.get_json()
-    admin_id = data.get('admin_id')
     action = data.get('action')  # 'approve' or 'reject'
     rejection_reason = data.get('rejection_reason', '')
     
     driver = Driver.query.get_or_404(driver_id)
-    admin = User.query.get_or_404(admin_id)
-    
-    if admin.role != 'admin':
-        return jsonify({'error': 'Only admins can verify drivers'}), 403
+    admin_id = current_principal().user_id  # Admin routes always carry a token; its role is checked on entry
     
     if action == 'approve':
         driver.is_verified = True
@@ -2761,6 +3662,7 @@ def verify_driver(driver_id):
         return jsonify({'error': 'Invalid action'}), 400
     
     db.session.commit()
+    sync_driver_registry(driver)
     
     # Notify driver
     notification = Notification(
@@ -2776,42 +3678,154 @@ def verify_driver(driver_id):
         'verification_status': driver.verification_status
     })
 
+Verifier = aliased(User)
+DRIVER_VERIFICATION_FIELDS = {
+    'driver_id': Field(Driver.id),
+    'user_id': Field(Driver.user_id),
+    'name': Field(User.name),
+    'email': Field(User.email),
+    'phone': Field(User.phone),
+    'vehicle_type': Field(Driver.vehicle_type),
+    'license_plate': Field(Driver.license_plate),
+    'is_verified': Field(Driver.is_verified),
+    'verification_status': Field(Driver.verification_status),
+    'submitted_at': Field(Driver.submitted_at),
+    'verified_at': Field(Driver.verified_at),
+    'verified_by': Field(Verifier.name),
+    'rejection_reason': Field(Driver.rejection_reason),
+    'ratings': Field(Driver.ratings),
+    'completed_orders': Field(Driver.completed_orders)
+}
+
 @app.route('/api/admin/all-drivers-verification', methods=['GET'])
 def get_all_drivers_verification():
-    """Get all drivers with their verification status - OPTIMIZED with JOIN"""
-    # Use JOIN to get all data in one query (eliminates N+1 problem)
-    drivers = db.session.query(Driver, User).join(User, Driver.user_id == User.id).all()
+    """Get all drivers with their verification status; ?fields= limits the columns loaded and returned"""
+    try:
+        columns, build_row = field_columns(
+            DRIVER_VERIFICATION_FIELDS, requested_fields(request.args.get('fields'), DRIVER_VERIFICATION_FIELDS)
+        )
+    except FieldsError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Use JOINs to get all data in one query (eliminates N+1 problem), the verifier included
+    drivers = db.session.query(*columns).select_from(Driver).join(
+        User, Driver.user_id == User.id
+    ).outerjoin(
+        Verifier, Driver.verified_by == Verifier.id
+    ).all()
     
-    drivers_data = []
-    for driver, user in drivers:
-        verifier = User.query.get(driver.verified_by) if driver.verified_by else None
-        
-        drivers_data.append({
-            'driver_id': driver.id,
-            'user_id': driver.user_id,
-            'name': user.name,
-            'email': user.email,
-            'phone': user.phone,
-            'vehicle_type': driver.vehicle_type,
-            'license_plate': driver.license_plate,
-            'is_verified': driver.is_verified,
-            'verification_status': driver.verification_status,
-            'submitted_at': driver.submitted_at,
-            'verified_at': driver.verified_at,
-            'verified_by': verifier.name if verifier else None,
-            'rejection_reason': driver.rejection_reason,
-            'ratings': driver.ratings,
-            'completed_orders': driver.completed_orders
-        })
+    return jsonify({'drivers': [build_row(driver) for driver in drivers]})
+
+@app.route('/api/admin/driver-registry/check', methods=['GET'])
+def check_driver_registry():
+    """Compare the in-memory driver registry with the database; ?repair=true rebuilds it"""
+    ensure_driver_registry()
+    report = driver_registry.check_consistency(load_bookable_driver_records())
+    
+    if not report['consistent'] and request.args.get('repair') == 'true':
+        load_driver_registry()
+        report['repaired'] = True
     
-    return jsonify({'drivers': drivers_data})
+    return jsonify(report)
+
+@app.route('/api/admin/streams/stats', methods=['GET'])
+def stream_stats():
+    """Open push channels, connected clients and events published"""
+    return jsonify(broadcaster.stats())
+
+@app.route('/api/admin/unread-counters/rebuild', methods=['POST'])
+def rebuild_unread_counts():
+    """Recount every unread counter from the notifications table, e.g. after manual data fixes"""
+    connection = db.session.connection()
+    keys = rebuild_unread_counters(connection)
+    bump_resource_versions(connection, {f'notifications:{key}' for key in keys})
+    db.session.commit()
+    return jsonify({'counters': len(keys)})
+
+@app.route('/api/admin/search-cache/stats', methods=['GET'])
+def search_cache_stats():
+    """Hit rate and size of the per-cell driver search cache"""
+    return jsonify(search_cache.stats())
+
+@app.route('/api/admin/conditional/stats', methods=['GET'])
+def conditional_get_stats():
+    """Per-route share of polled GETs answered with 304 Not Modified"""
+    return jsonify(conditional_stats.stats())
+
+metrics.gauges('movers_stream_subscribers', 'Connected SSE clients',
+               lambda: [((), broadcaster.stats()['subscribers'])])
+metrics.gauges('movers_search_cache_lookups_total', 'Driver search cache lookups by result',
+               lambda: [(('hit',), search_cache.hits), (('miss',), search_cache.misses)], ('result',), 'counter')
+metrics.gauges('movers_principal_cache_lookups_total', 'Account profile cache lookups by result',
+               lambda: [(('hit',), principal_cache.hits), (('miss',), principal_cache.misses)], ('result',), 'counter')
+metrics.gauges('movers_password_hashes_total', 'Password hashing work by outcome',
+               lambda: [((name,), password_hasher.stats()[name]) for name in ('hashed', 'verified', 'rehashed', 'rejected')],
+               ('outcome',), 'counter')
+metrics.gauges('movers_password_hashes_in_flight', 'Password hashes running or queued',
+               lambda: [((), password_hasher.stats()['in_flight'])])
+metrics.gauges('movers_log_records_dropped_total', 'Log records dropped because the log queue was full',
+               lambda: [((), logging_stats()['dropped'])], kind='counter')
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """This process's counters and histograms in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Recent request profiles, newest first (needs the profile token)"""
+    if not PROFILE_TOKEN:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    if not has_profile_token():
+        return jsonify({'error': 'Invalid profile token'}), 403
+    return jsonify({'profiles': profile_store.summaries()})
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """One profile: ?format=summary (JSON, top functions), pstats or collapsed (flamegraph stacks)"""
+    if not PROFILE_TOKEN:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    if not has_profile_token():
+        return jsonify({'error': 'Invalid profile token'}), 403
+    kind = request.args.get('format', 'summary')
+    path = profile_store.path(name, kind)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    if kind == 'summary':
+        return send_file(path, mimetype='application/json')
+    return send_file(path, as_attachment=True, mimetype='application/octet-stream' if kind == 'pstats' else 'text/plain')
+
+@app.route('/api/admin/dispatch/run', methods=['POST'])
+def run_dispatch_now():
+    """Run a dispatch tick immediately instead of waiting for the background loop"""
+    return jsonify(run_dispatch())
 
 # Run the App
+# App factory used by serve.py and the development server
+app_initialized = False
+app_init_lock = threading.Lock()
+
+def create_app():
+    """Return the WSGI app with its tables, admin account and in-memory indexes ready
+
+    Safe to call repeatedly. serve.py calls it once in the server's master
+    process before forking workers, so each worker starts with the driver
+    registry and trails already loaded instead of rebuilding them.
+    """
+    global app_initialized
+    with app_init_lock:
+        if not app_initialized:
+            with app.app_context():
+                db.create_all()
+                create_admin_user()
+                load_driver_registry()
+                load_active_trails()
+                db.engine.dispose()  # Forked workers must not share the master's connections
+            app_initialized = True
+    return app
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        create_admin_user()
-        print("\n[SERVER] Driver verification requires admin approval")
-        print("[SERVER] Only admin-verified drivers will be marked as verified\n")
-        
+    create_app()
+    log.info('server.start', mode='development', note='use serve.py or asgi.py in production; drivers need admin verification')
+
     app.run(port=5000, debug=True)
\ No newline at end of file
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { toast } from 'react-toastify';
 import API_ENDPOINTS from '../../config/api';
 import './AvailableOrders.css';
@@ -9,17 +9,64 @@ const AvailableOrders = () => {
   const [isLoading, setIsLoading] = useState(true);
   const [acceptingOrderId, setAcceptingOrderId] = useState(null);
   const [completingOrderId, setCompletingOrderId] = useState(null);
+  const versionRef = useRef(null);  // Order feed cursor: only changes after it are fetched
 
   useEffect(() => {
-    fetchOrders();
-    // Auto-refresh every 30 seconds
-    const interval = setInterval(fetchOrders, 30000);
-    return () => clearInterval(interval);
+    let eventSource = null;
+
+    const subscribe = async () => {
+      const driverId = await fetchOrders();
+      if (!driverId) return;
+
+      // The server pushes a notice whenever one of this driver's orders changes
+      eventSource = new EventSource(API_ENDPOINTS.DRIVER_ORDER_STREAM(driverId, versionRef.current));
+      eventSource.addEventListener('order', (event) => {
+        const change = JSON.parse(event.data);
+        if (change.status === 'reassigned') {
+          setOrders((current) => current.filter(order => order.booking_id !== change.booking_id));
+        } else if (versionRef.current === null || change.version > versionRef.current) {
+          fetchOrderChanges(driverId);
+        }
+      });
+    };
+
+    subscribe();
+    return () => {
+      if (eventSource) eventSource.close();
+    };
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
+  const enhanceOrder = (order) => ({
+    ...order,
+    estimated_time: calculateEstimatedTime(order.distance),
+    priority: calculatePriority(order.created_at, order.price),
+    created_at: formatTimeAgo(order.created_at)
+  });
+
+  // Merge only the orders changed since the last fetch; finished ones drop out of the list
+  const fetchOrderChanges = async (driverId) => {
+    try {
+      const response = await fetch(API_ENDPOINTS.AVAILABLE_ORDERS(driverId, versionRef.current));
+      const data = await response.json();
+      if (!response.ok) return;
+
+      versionRef.current = Math.max(versionRef.current || 0, data.version);
+      const changed = new Map(data.orders.map(order => [order.booking_id, order]));
+      setOrders((current) => [
+        ...current.filter(order => !changed.has(order.booking_id)),
+        ...data.orders
+          .filter(order => order.status === 'pending' || order.status === 'accepted')
+          .map(enhanceOrder)
+      ]);
+    } catch (error) {
+      console.error('Error fetching order changes:', error);
+    }
+  };
+
   const fetchOrders = async () => {
     setIsLoading(true);
+    let driverId = null;
     try {
       // Get driver ID from localStorage
       const user = JSON.parse(localStorage.getItem('user'));
@@ -29,7 +76,7 @@ const AvailableOrders = () => {
         return;
       }
 
-      let driverId = user.driver_id;
+      driverId = user.driver_id;
 
       // Fallback: fetch driver_id if not in localStorage
       if (!driverId && user.id && user.role === 'driver') {
@@ -49,7 +96,7 @@ const AvailableOrders = () => {
       if (!driverId) {
         toast.error('Driver information not found');
         setIsLoading(false);
-        return;
+        return null;
       }
 
       const response = await fetch(API_ENDPOINTS.AVAILABLE_ORDERS(driverId));
@@ -57,13 +104,8 @@ const AvailableOrders = () => {
       
       if (response.ok) {
         // Enhance orders with calculated fields
-        const enhancedOrders = data.orders.map(order => ({
-          ...order,
-          estimated_time: calculateEstimatedTime(order.distance),
-          priority: calculatePriority(order.created_at, order.price),
-          created_at: formatTimeAgo(order.created_at)
-        }));
-        setOrders(enhancedOrders);
+        setOrders(data.orders.map(enhanceOrder));
+        versionRef.current = data.version;
       } else {
         toast.error('Failed to load available orders');
       }
@@ -73,6 +115,7 @@ const AvailableOrders = () => {
     } finally {
       setIsLoading(false);
     }
+    return driverId;
   };
 
   const calculateEstimatedTime = (distance) => {
@@ -112,17 +155,23 @@ const AvailableOrders = () => {
   const handleAcceptOrder = async (bookingId) => {
     try {
       setAcceptingOrderId(bookingId);
+      const user = JSON.parse(localStorage.getItem('user'));
       
       const response = await fetch(API_ENDPOINTS.ACCEPT_ORDER(bookingId), {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-        }
+        },
+        body: JSON.stringify({ driver_id: user?.driver_id })
       });
 
       const data = await response.json();
       
-      if (response.ok) {
+      if (response.status === 409) {
+        // Dispatch gave this booking to another driver after it was not accepted in time
+        setOrders(orders.filter(order => order.booking_id !== bookingId));
+        toast.warning(data.error);
+      } else if (response.ok) {
         // Update the order status to 'accepted' instead of removing it
         setOrders(orders.map(order => 
           order.booking_id === bookingId 
@@ -11,6 +11,7 @@ import {
 import L from "leaflet";
 import "leaflet/dist/leaflet.css";
 import "./BookDriver.css";
+import { getPollInterval } from "../../config/api";
 
 // Fix for default marker icons in Leaflet
 delete L.Icon.Default.prototype._getIconUrl;
@@ -25,15 +26,6 @@ L.Icon.Default.mergeOptions({
 
 // No hardcoded drivers - all drivers come from database via API
 
-// Kenyan promo codes
-const KENYAN_PROMO_CODES = {
-  KARIBU10: 0.1, // 10% off
-  SAFARI20: 0.2, // 20% off
-  NAIROBI25: 0.25, // 25% off
-  MADARAKA50: 0.5, // 50% off for Madaraka Day
-  UHURU30: 0.3, // 30% off for Independence Day
-};
-
 // Kenyan popular locations for suggestions
 const POPULAR_LOCATIONS = [
   "CBD",
@@ -216,7 +208,11 @@ const BookDriver = () => {
         body: JSON.stringify({
           pickup_location: formData.pickup_location,
           dropoff_location: formData.dropoff_location,
-          distance: calculatedDistance
+          distance: calculatedDistance,
+          pickup_lat: pickupCoords.lat,
+          pickup_lng: pickupCoords.lon,
+          dropoff_lat: dropoffCoords.lat,
+          dropoff_lng: dropoffCoords.lon
         })
       });
 
@@ -280,36 +276,45 @@ const BookDriver = () => {
       return;
     }
 
-    // Simulate API delay
+    // The backend discounts the signed quote so the booking price cannot be tampered with
     setLoading(true);
-    await new Promise((resolve) => setTimeout(resolve, 500));
-    setLoading(false);
+    try {
+      const response = await fetch('http://127.0.0.1:5000/api/user/apply-promo', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          quote_id: selectedDriver.quote_id,
+          promo_code: formData.promo_code
+        })
+      });
+      const data = await response.json();
 
-    const promoCode = formData.promo_code.toUpperCase();
-    const discount = KENYAN_PROMO_CODES[promoCode];
+      if (!response.ok) {
+        toast.error(data.error || "Invalid or inactive promo code");
+        return;
+      }
 
-    if (discount) {
-      // Apply discount to the selected driver's price
-      const currentPrice = selectedDriver.price || searchResults.base_price;
-      const newPrice = currentPrice * (1 - discount);
-      
-      // Update the selected driver's price
+      // Update the selected driver's price and quote
       setSelectedDriver({
         ...selectedDriver,
-        price: newPrice
+        price: data.price,
+        quote_id: data.quote_id
       });
-      
+
       setSearchResults({
         ...searchResults,
-        appliedPromoCode: promoCode,
-        discount: discount * 100,
+        appliedPromoCode: data.promo_code,
+        discount: data.discount,
       });
 
       toast.success(
-        `Promo code ${promoCode} applied! ${discount * 100}% discount - Saved KES ${(currentPrice - newPrice).toFixed(0)}`
+        `Promo code ${data.promo_code} applied! ${data.discount}% discount - Saved KES ${(data.original_price - data.price).toFixed(0)}`
       );
-    } else {
-      toast.error("Invalid or inactive promo code");
+    } catch (error) {
+      console.error("Error applying promo code:", error);
+      toast.error("Failed to apply promo code. Please try again.");
+    } finally {
+      setLoading(false);
     }
   };
 
@@ -317,10 +322,10 @@ const BookDriver = () => {
     try {
       const response = await fetch(`http://127.0.0.1:5000/api/mpesa/check-status/${txnId}`);
       const data = await response.json();
-      return data.status;
+      return { status: data.status, nextPollMs: getPollInterval(response, 1000) };
     } catch (error) {
       console.error('Error checking payment status:', error);
-      return null;
+      return { status: null, nextPollMs: 1000 };
     }
   };
 
@@ -329,7 +334,7 @@ const BookDriver = () => {
     
     const poll = async () => {
       attempts++;
-      const status = await checkPaymentStatus(txnId);
+      const { status, nextPollMs } = await checkPaymentStatus(txnId);
       
       if (status === 'completed') {
         setIsPaymentProcessing(false);
@@ -344,8 +349,8 @@ const BookDriver = () => {
         toast.error('❌ Payment failed. Please try again.');
         setBookingStep(3); // Go back to confirmation
         return;
-      } else if (attempts < maxAttempts) {
-        setTimeout(poll, 1000); // Check every 1 second (faster)
+      } else if (attempts < maxAttempts && nextPollMs !== null) {
+        setTimeout(poll, nextPollMs); // Interval suggested by the server
       } else {
         setIsPaymentProcessing(false);
         toast.warning('⏱️ Payment is taking longer than expected. Please check your order history.');
@@ -396,8 +401,6 @@ const BookDriver = () => {
         return;
       }
 
-      const finalPrice = selectedDriver.price || searchResults.base_price;
-
       // Call backend API to initiate M-Pesa payment
       const response = await fetch('http://127.0.0.1:5000/api/user/book-driver-mpesa', {
         method: 'POST',
@@ -407,10 +410,8 @@ const BookDriver = () => {
           driver_id: selectedDriver.driver_id,
           pickup_location: formData.pickup_location,
           dropoff_location: formData.dropoff_location,
-          distance: parseFloat(searchResults.distance),
-          price: finalPrice,
-          phone_number: phoneNumber,
-          promo_code: formData.promo_code || null
+          quote_id: selectedDriver.quote_id,
+          phone_number: phoneNumber
         })
       });
 
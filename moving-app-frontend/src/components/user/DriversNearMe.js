@@ -1,9 +1,9 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { MapContainer, TileLayer, Marker, Popup, CircleMarker, useMap } from 'react-leaflet';
 import L from 'leaflet';
 import 'leaflet/dist/leaflet.css';
 import { toast } from 'react-toastify';
-import API_ENDPOINTS from '../../config/api';
+import API_ENDPOINTS, { getPollInterval } from '../../config/api';
 import './DriversNearMe.css';
 
 // Fix for default marker icons
@@ -90,17 +90,35 @@ const DriversNearMe = () => {
     getUserLocation();
   }, []);
 
-  // Fetch available drivers
+  // Pending orders seen so far and the feed cursor; each refresh only fetches what changed since
+  const ordersRef = useRef(new Map());
+  const versionRef = useRef(null);
+
+  // Fetch available drivers; resolves to the delay before the next refresh (null to stop)
   const fetchAvailableDrivers = async () => {
+    let nextPollMs = refreshInterval;
     try {
-      const response = await fetch(API_ENDPOINTS.AVAILABLE_ORDERS());
+      const response = await fetch(API_ENDPOINTS.AVAILABLE_ORDERS(null, versionRef.current));
       const data = await response.json();
+      nextPollMs = getPollInterval(response, refreshInterval);
 
       if (response.ok && data.orders) {
+        if (versionRef.current !== null && data.orders.length === 0) {
+          return nextPollMs;  // Nothing changed
+        }
+        data.orders.forEach((order) => {
+          if (order.status === 'pending') {
+            ordersRef.current.set(order.booking_id, order);
+          } else {
+            ordersRef.current.delete(order.booking_id);
+          }
+        });
+        versionRef.current = data.version;
+
         // Extract unique drivers with their locations
         const driversMap = new Map();
 
-        data.orders.forEach((order) => {
+        ordersRef.current.forEach((order) => {
           if (order.driver_id && order.live_location) {
             const [lat, lng] = order.live_location.split(',').map(Number);
 
@@ -135,16 +153,26 @@ const DriversNearMe = () => {
     } finally {
       setLoading(false);
     }
+    return nextPollMs;
   };
 
-  // Initial fetch and auto-refresh
+  // Initial fetch and auto-refresh at the pace the server suggests
   useEffect(() => {
-    fetchAvailableDrivers();
+    let timer = null;
+    let cancelled = false;
 
-    if (autoRefresh) {
-      const interval = setInterval(fetchAvailableDrivers, refreshInterval);
-      return () => clearInterval(interval);
-    }
+    const refresh = async () => {
+      const nextPollMs = await fetchAvailableDrivers();
+      if (!cancelled && autoRefresh && nextPollMs !== null) {
+        timer = setTimeout(refresh, nextPollMs);
+      }
+    };
+
+    refresh();
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
   }, [autoRefresh, refreshInterval]);
 
   // Filter drivers based on criteria
@@ -12,7 +12,7 @@ const TrackDriver = () => {
   const [error, setError] = useState(null);
   const [isLiveTracking, setIsLiveTracking] = useState(true);
   
-  const pollingIntervalRef = useRef(null);
+  const eventSourceRef = useRef(null);
 
   useEffect(() => {
     const fetchTrackingData = async () => {
@@ -45,16 +45,31 @@ const TrackDriver = () => {
     // Initial fetch
     fetchTrackingData();
 
-    // Real-time polling every 5 seconds when live tracking is enabled
+    // Live tracking: the server pushes each new driver position instead of being polled
     if (isLiveTracking) {
-      pollingIntervalRef.current = setInterval(() => {
-        fetchTrackingData();
-      }, 5000);
+      const eventSource = new EventSource(API_ENDPOINTS.TRACK_DRIVER_STREAM(bookingId));
+      eventSource.addEventListener('position', (event) => {
+        const position = JSON.parse(event.data);
+        setTrackingData((current) => ({
+          ...current,
+          location: `${position.latitude},${position.longitude}`,
+          last_updated: new Date(position.timestamp * 1000).toISOString()
+        }));
+      });
+      eventSource.addEventListener('status', (event) => {
+        const { status } = JSON.parse(event.data);
+        setBookingDetails((current) => (current ? { ...current, status } : current));
+        if (status === 'completed' || status === 'cancelled') {
+          eventSource.close();  // Tracking has ended; stop the browser from reconnecting
+        }
+      });
+      eventSourceRef.current = eventSource;
     }
 
     return () => {
-      if (pollingIntervalRef.current) {
-        clearInterval(pollingIntervalRef.current);
+      if (eventSourceRef.current) {
+        eventSourceRef.current.close();
+        eventSourceRef.current = null;
       }
     };
   }, [bookingId, isLiveTracking]);
@@ -211,7 +226,7 @@ const TrackDriver = () => {
                       <div>
                         <p className="last-updated">
                           🕐 Last updated: {formatDateTime(trackingData.last_updated)}
-                          {isLiveTracking && <span style={{ marginLeft: '8px', color: '#10b981' }}>• Auto-refreshing every 5s</span>}
+                          {isLiveTracking && <span style={{ marginLeft: '8px', color: '#10b981' }}>• Streaming live</span>}
                         </p>
                         <p className="driver-status">🚗 Driver is on the way</p>
                       </div>
@@ -1,61 +1,87 @@
 import React, { useState, useEffect } from 'react';
 import { toast } from 'react-toastify';
+import API_ENDPOINTS from '../../config/api';
 import './UserNotifications.css';
 
 const UserNotifications = () => {
-  const initialNotifications = [
-    {
-      id: 1,
-      message: "Your deposit of $100.00 was successful",
-      created_at: "2025-03-19T14:30:22Z",
-      is_read: false
-    },
-    {
-      id: 2,
-      message: "Welcome to our platform! Complete your profile to get started.",
-      created_at: "2025-03-18T09:15:43Z",
-      is_read: false
-    },
-    {
-      id: 3,
-      message: "New feature alert: You can now withdraw funds directly to your M-Pesa account.",
-      created_at: "2025-03-15T17:45:10Z",
-      is_read: true
-    },
-    {
-      id: 4,
-      message: "Your account has been successfully created.",
-      created_at: "2025-03-10T11:22:33Z",
-      is_read: true
-    }
-  ];
-
   const [notifications, setNotifications] = useState([]);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    const timer = setTimeout(() => {
-      setNotifications(initialNotifications);
+    const user = JSON.parse(localStorage.getItem('user'));
+    if (!user) {
       setLoading(false);
-    }, 1000);
+      return undefined;
+    }
+
+    let eventSource = null;
+    let cancelled = false;
 
-    return () => clearTimeout(timer);
+    const loadAndSubscribe = async () => {
+      try {
+        // Load the history once, then only receive new notifications as they are pushed
+        const response = await fetch(API_ENDPOINTS.USER_NOTIFICATIONS(user.id));
+        const data = await response.json();
+        if (cancelled) return;
+        const history = (data.notifications || []).sort((a, b) => b.id - a.id);
+        setNotifications(history);
+        setLoading(false);
+
+        // The browser resends Last-Event-ID on reconnect, so missed messages are replayed
+        const lastId = history.length ? history[0].id : 0;
+        eventSource = new EventSource(API_ENDPOINTS.USER_NOTIFICATION_STREAM(user.id, lastId));
+        eventSource.addEventListener('notification', (event) => {
+          const notification = JSON.parse(event.data);
+          setNotifications((current) => (
+            current.some((n) => n.id === notification.id) ? current : [notification, ...current]
+          ));
+          toast.info(notification.message);
+        });
+      } catch (error) {
+        console.error('Error loading notifications:', error);
+        setLoading(false);
+      }
+    };
+
+    loadAndSubscribe();
+    return () => {
+      cancelled = true;
+      if (eventSource) eventSource.close();
+    };
   }, []);
 
-  const markAsRead = (notificationId) => {
-    setNotifications(notifications.map(notification =>
-      notification.id === notificationId
-        ? { ...notification, is_read: true }
-        : notification
-    ));
-    toast.success('Notification marked as read');
+  const markAsRead = async (notificationId) => {
+    try {
+      await fetch(API_ENDPOINTS.MARK_NOTIFICATION_READ(notificationId), { method: 'POST' });
+      setNotifications((current) => current.map(notification =>
+        notification.id === notificationId
+          ? { ...notification, is_read: true }
+          : notification
+      ));
+      toast.success('Notification marked as read');
+    } catch (error) {
+      toast.error('Failed to mark notification as read');
+    }
   };
 
-  const markAllAsRead = () => {
-    setNotifications(notifications.map(notification => (
-      { ...notification, is_read: true }
-    )));
-    toast.success('All notifications marked as read');
+  const markAllAsRead = async () => {
+    const user = JSON.parse(localStorage.getItem('user'));
+    const newestId = Math.max(...notifications.map(notification => notification.id));
+    try {
+      // One request and one UPDATE for everything up to the newest notification shown
+      const response = await fetch(API_ENDPOINTS.MARK_NOTIFICATIONS_READ, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ user_id: user.id, up_to_id: newestId })
+      });
+      if (!response.ok) throw new Error('Bulk mark-read failed');
+      setNotifications((current) => current.map(notification => (
+        notification.id <= newestId ? { ...notification, is_read: true } : notification
+      )));
+      toast.success('All notifications marked as read');
+    } catch (error) {
+      toast.error('Failed to mark notifications as read');
+    }
   };
 
   const formatDate = (dateString) => {
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { toast } from 'react-toastify';
 import { useAuth } from '../../context/AuthContext';
+import { getPollInterval } from '../../config/api';
 import './UserWallet.css';
 
 const UserWallet = () => {
@@ -56,12 +57,12 @@ const UserWallet = () => {
       const data = await response.json();
       
       if (response.ok) {
-        return data.status;
+        return { status: data.status, nextPollMs: getPollInterval(response, 2000) };
       }
-      return null;
+      return { status: null, nextPollMs: 2000 };
     } catch (error) {
       console.error('Error checking status:', error);
-      return null;
+      return { status: null, nextPollMs: 2000 };
     }
   };
 
@@ -70,7 +71,7 @@ const UserWallet = () => {
     
     const poll = async () => {
       attempts++;
-      const status = await checkTransactionStatus(transactionId);
+      const { status, nextPollMs } = await checkTransactionStatus(transactionId);
       
       if (status === 'completed') {
         setTransactions(prev => prev.map(t =>
@@ -96,8 +97,8 @@ const UserWallet = () => {
         });
         setIsDepositing(false);
         return;
-      } else if (attempts < maxAttempts) {
-        setTimeout(poll, 2000); // Check every 2 seconds (faster)
+      } else if (attempts < maxAttempts && nextPollMs !== null) {
+        setTimeout(poll, nextPollMs); // The server shortens or lengthens this as the payment ages
       } else {
         toast.warning('⏱️ Payment is taking longer than expected. Check back later.', {
           position: "top-center",
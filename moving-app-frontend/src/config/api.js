@@ -19,6 +19,51 @@ const getApiBaseUrl = () => {
 
 export const API_BASE_URL = getApiBaseUrl();
 
+// Polled endpoints send X-Poll-Interval: seconds until the next poll, or "stop".
+// Returns the delay in ms, null to stop polling, or fallbackMs when there is no hint.
+export const getPollInterval = (response, fallbackMs) => {
+  const hint = response && response.headers.get('X-Poll-Interval');
+  if (hint === 'stop') return null;
+  const seconds = Number(hint);
+  return hint && seconds > 0 ? seconds * 1000 : fallbackMs;
+};
+
+// Access token from /api/login, kept with the stored user
+export const getAccessToken = () => {
+  try {
+    return JSON.parse(localStorage.getItem('user'))?.access_token || null;
+  } catch {
+    return null;
+  }
+};
+
+// EventSource cannot send headers, so streams take the token as a query parameter
+const streamToken = () => {
+  const token = getAccessToken();
+  return token ? `access_token=${encodeURIComponent(token)}` : '';
+};
+
+// Some components call the backend by a literal host instead of API_BASE_URL
+const API_ORIGINS = [API_BASE_URL, 'http://localhost:5000', 'http://127.0.0.1:5000'];
+
+// Send "Authorization: Bearer <token>" with every fetch to the backend. Call once at startup.
+export const installAuthHeader = () => {
+  if (window.fetch.authHeaderInstalled) return;
+  const originalFetch = window.fetch.bind(window);
+  const authFetch = (input, init = {}) => {
+    const url = typeof input === 'string' ? input : input.url;
+    const token = getAccessToken();
+    if (!token || !API_ORIGINS.some((origin) => url.startsWith(`${origin}/api/`))) {
+      return originalFetch(input, init);
+    }
+    const headers = new Headers(init.headers || (typeof input === 'string' ? undefined : input.headers));
+    if (!headers.has('Authorization')) headers.set('Authorization', `Bearer ${token}`);
+    return originalFetch(input, { ...init, headers });
+  };
+  authFetch.authHeaderInstalled = true;
+  window.fetch = authFetch;
+};
+
 // API Endpoints
 export const API_ENDPOINTS = {
   // Auth
@@ -30,7 +75,9 @@ export const API_ENDPOINTS = {
   SEARCH_DRIVERS: `${API_BASE_URL}/api/user/search-drivers`,
   BOOK_DRIVER: `${API_BASE_URL}/api/user/book-driver`,
   USER_ORDER_HISTORY: (userId) => `${API_BASE_URL}/api/user/order-history/${userId}`,
-  USER_NOTIFICATIONS: (userId) => `${API_BASE_URL}/api/user/notifications/${userId}`,
+  USER_NOTIFICATIONS: (userId, sinceId = null) => `${API_BASE_URL}/api/user/notifications/${userId}` + (sinceId ? `?since_id=${sinceId}` : ''),
+  USER_UNREAD_COUNT: (userId) => `${API_BASE_URL}/api/user/notifications/${userId}/unread-count`,
+  USER_NOTIFICATION_STREAM: (userId, lastEventId) => `${API_BASE_URL}/api/user/notifications/${userId}/stream?last_event_id=${lastEventId || ''}&${streamToken()}`,
   USER_SUPPORT_TICKETS: `${API_BASE_URL}/api/user/support-tickets`,
   SUBMIT_SUPPORT_TICKET: `${API_BASE_URL}/api/user/submit-support-ticket`,
   PAYMENT_HISTORY: (userId) => `${API_BASE_URL}/api/user/payment-history/${userId}`,
@@ -39,12 +86,15 @@ export const API_ENDPOINTS = {
   GET_DRIVER_BY_USER: (userId) => `${API_BASE_URL}/api/driver/by-user/${userId}`,
   DRIVER_EARNINGS: (driverId) => `${API_BASE_URL}/api/driver/${driverId}/earnings`,
   DRIVER_WITHDRAW: `${API_BASE_URL}/api/driver/withdraw`,
-  AVAILABLE_ORDERS: (driverId = null) => driverId ? `${API_BASE_URL}/api/driver/available-orders/${driverId}` : `${API_BASE_URL}/api/driver/available-orders`,
+  AVAILABLE_ORDERS: (driverId = null, since = null) => (driverId ? `${API_BASE_URL}/api/driver/available-orders/${driverId}` : `${API_BASE_URL}/api/driver/available-orders`) + (since ? `?since=${since}` : ''),
+  DRIVER_ORDER_STREAM: (driverId, lastEventId) => `${API_BASE_URL}/api/driver/orders/${driverId}/stream?last_event_id=${lastEventId || ''}&${streamToken()}`,
   ACCEPT_ORDER: (bookingId) => `${API_BASE_URL}/api/driver/accept-order/${bookingId}`,
   COMPLETE_ORDER: (bookingId) => `${API_BASE_URL}/api/driver/complete-order/${bookingId}`,
   CANCEL_ORDER: (bookingId) => `${API_BASE_URL}/api/driver/cancel-order/${bookingId}`,
   DRIVER_ORDER_HISTORY: (driverId) => `${API_BASE_URL}/api/driver/order-history/${driverId}`,
-  DRIVER_NOTIFICATIONS: (driverId) => `${API_BASE_URL}/api/driver/notifications/${driverId}`,
+  DRIVER_NOTIFICATIONS: (driverId, sinceId = null) => `${API_BASE_URL}/api/driver/notifications/${driverId}` + (sinceId ? `?since_id=${sinceId}` : ''),
+  DRIVER_UNREAD_COUNT: (driverId) => `${API_BASE_URL}/api/driver/notifications/${driverId}/unread-count`,
+  DRIVER_NOTIFICATION_STREAM: (driverId, lastEventId) => `${API_BASE_URL}/api/driver/notifications/${driverId}/stream?last_event_id=${lastEventId || ''}&${streamToken()}`,
   TOGGLE_AVAILABILITY: `${API_BASE_URL}/api/driver/toggle-availability`,
   SUBMIT_VERIFICATION: (driverId) => `${API_BASE_URL}/api/driver/submit-verification/${driverId}`,
   VERIFICATION_STATUS: (driverId) => `${API_BASE_URL}/api/driver/verification-status/${driverId}`,
@@ -68,10 +118,12 @@ export const API_ENDPOINTS = {
   
   // Notifications
   MARK_NOTIFICATION_READ: (notificationId) => `${API_BASE_URL}/api/notifications/mark-read/${notificationId}`,
+  MARK_NOTIFICATIONS_READ: `${API_BASE_URL}/api/notifications/mark-read`,
   
   // Tracking
   UPDATE_DRIVER_LOCATION: `${API_BASE_URL}/api/driver/update-location`,
   TRACK_DRIVER: (bookingId) => `${API_BASE_URL}/api/user/track-driver/${bookingId}`,
+  TRACK_DRIVER_STREAM: (bookingId) => `${API_BASE_URL}/api/user/track-driver/${bookingId}/stream?${streamToken()}`,
 };
 
 export default API_ENDPOINTS;
@@ -1,6 +1,15 @@
 import React, { createContext, useState, useEffect, useContext } from 'react';
 import axios from 'axios';
-import API_ENDPOINTS from '../config/api';
+import API_ENDPOINTS, { getAccessToken, installAuthHeader } from '../config/api';
+
+installAuthHeader();
+axios.interceptors.request.use((config) => {
+  const token = getAccessToken();
+  if (token && !config.headers.Authorization) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
 
 const AuthContext = createContext();
 
@@ -11,7 +20,12 @@ export const AuthProvider = ({ children }) => {
   useEffect(() => {
     const userData = localStorage.getItem('user');
     if (userData) {
-      setCurrentUser(JSON.parse(userData));
+      const user = JSON.parse(userData);
+      if (user.expires_at && user.expires_at <= Date.now()) {
+        localStorage.removeItem('user');  // Token expired; log in again
+      } else {
+        setCurrentUser(user);
+      }
     }
     setLoading(false);
   }, []);
@@ -41,7 +55,9 @@ export const AuthProvider = ({ children }) => {
         name: response.data.name,
         phone: response.data.phone,
         // Include driver_id if user is a driver
-        ...(response.data.driver_id && { driver_id: response.data.driver_id })
+        ...(response.data.driver_id && { driver_id: response.data.driver_id }),
+        access_token: response.data.access_token,
+        expires_at: Date.now() + response.data.expires_in * 1000
       };
       
       localStorage.setItem('user', JSON.stringify(user));
@@ -60,6 +60,30 @@ def optimize_payment_database():
                 'table': 'booking',
                 'column': 'driver_id',
                 'description': 'Speed up driver booking queries'
+            },
+            {
+                'name': 'idx_booking_driver_id_version',
+                'table': 'booking',
+                'columns': ['driver_id', 'version'],
+                'description': 'Serve driver order feed deltas (?since=) from the index'
+            },
+            {
+                'name': 'idx_transaction_created_at',
+                'table': 'transaction',
+                'column': 'created_at',
+                'description': 'Date-range admin exports'
+            },
+            {
+                'name': 'idx_escrow_created_at',
+                'table': 'escrow',
+                'column': 'created_at',
+                'description': 'Date-range admin exports'
+            },
+            {
+                'name': 'idx_booking_created_at',
+                'table': 'booking',
+                'column': 'created_at',
+                'description': 'Date-range admin exports'
             }
         ]
         
@@ -0,0 +1,112 @@
+"""
+Password hashing on a small, bounded thread pool
+A pbkdf2 hash at werkzeug's default cost takes about half a second of CPU.
+Run on the request threads, a burst of logins takes every core and booking
+and payment requests queue behind it. Here at most `workers` hashes run at
+once, at most `max_pending` more wait for a worker, and anything beyond that
+is turned away with HashingBusy so the caller can answer 503 at once.
+
+hashlib releases the GIL while it hashes, so threads are enough to keep the
+work off the request threads without a process pool's memory or fork cost.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+class HashingBusy(RuntimeError):
+    pass
+
+def normalized_method(method):
+    """Method as werkzeug writes it into a hash, e.g. 'pbkdf2:sha256' -> 'pbkdf2:sha256:1000000'"""
+    name, *args = method.split(':')
+    if name == 'pbkdf2' and len(args) <= 2:
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    if name == 'scrypt' and len(args) in (0, 3):
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    raise ValueError(f'Unsupported password hash method: {method}')
+
+def stored_method(password_hash):
+    """Method part of a stored hash, None when it is not a werkzeug hash"""
+    method, separator, _ = (password_hash or '').partition('$')
+    return method if separator else None
+
+class PasswordHasher:
+    def __init__(self, method='pbkdf2:sha256', workers=2, max_pending=16):
+        self.method = normalized_method(method)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.in_flight = 0
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self.rejected = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._pid != os.getpid():  # A forked worker does not inherit the parent's threads
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, work, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy(f'{self.workers + self.max_pending} password hashes already queued')
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return self._pool().submit(work, *args).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def needs_rehash(self, password_hash):
+        return stored_method(password_hash) != self.method
+
+    def hash(self, password):
+        """New hash with the configured method; raises HashingBusy when the queue is full"""
+        password_hash = self._run(generate_password_hash, password, self.method)
+        with self._lock:
+            self.hashed += 1
+        return password_hash
+
+    def _verify(self, password_hash, password):
+        if not check_password_hash(password_hash, password):
+            return False, None
+        if self.needs_rehash(password_hash):
+            return True, generate_password_hash(password, self.method)
+        return True, None
+
+    def verify(self, password_hash, password):
+        """(matches, replacement) where replacement is a hash with the configured method
+        when the stored one was made with another, else None"""
+        matches, replacement = self._run(self._verify, password_hash, password)
+        with self._lock:
+            self.verified += 1
+            if replacement:
+                self.rehashed += 1
+        return matches, replacement
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'in_flight': self.in_flight,
+                'hashed': self.hashed,
+                'verified': self.verified,
+                'rehashed': self.rehashed,
+                'rejected': self.rejected
+            }
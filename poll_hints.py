@@ -0,0 +1,48 @@
+"""
+Server-directed polling intervals
+Polled endpoints tell the client when to ask again through an X-Poll-Interval
+header: whole seconds, or "stop" once the resource can no longer change. The
+interval follows the resource's state, so a payment waiting for the customer's
+PIN is checked every couple of seconds while an idle screen backs off.
+"""
+STOP = None
+
+PAYMENT_FINAL_STATUSES = ('completed', 'failed')
+
+def format_poll_interval(seconds):
+    return 'stop' if seconds is STOP else str(int(seconds))
+
+def payment_poll_interval(status, age_seconds):
+    """A fresh STK push settles within seconds; one left unanswered backs off"""
+    if status is None or status in PAYMENT_FINAL_STATUSES:
+        return STOP
+    if age_seconds < 30:
+        return 2
+    if age_seconds < 120:
+        return 5
+    return 15
+
+def tracking_poll_interval(status, ping_age_seconds):
+    """Fast while the driver is moving, slow while waiting for acceptance or a silent driver"""
+    if status is None or status in ('completed', 'cancelled'):
+        return STOP
+    if status != 'accepted':
+        return 15
+    if ping_age_seconds is not None and ping_age_seconds < 30:
+        return 5
+    return 30
+
+def driver_orders_poll_interval(is_available, open_orders):
+    """Drivers with orders in hand refresh often; off-duty drivers rarely"""
+    if not is_available:
+        return 60
+    return 10 if open_orders else 30
+
+def verification_poll_interval(verification_status):
+    """Verification is decided by an admin, usually hours later; only approval is final,
+    a rejected driver can resubmit and be reviewed again"""
+    if verification_status is None or verification_status == 'approved':
+        return STOP
+    if verification_status in ('pending', 'under_review'):
+        return 60
+    return 300
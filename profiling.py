@@ -0,0 +1,151 @@
+"""
+On-demand profiling of single requests
+A profiled request runs under cProfile, which only traces the request's own
+thread. The result is saved as .pstats (for pstats or snakeviz) and as
+collapsed stacks, one "frame;frame;frame microseconds" line per call path,
+for flamegraph.pl or speedscope. Profiles are written to a directory shared
+by all server processes, and only the most recent ones are kept.
+
+The stacks come from cProfile's caller graph rather than a sampling thread.
+Python hands the GIL to another thread only every 5 ms, so a sampler sees
+nothing of a request that finishes in a few milliseconds. A function called
+from several places has its time split between those call paths in
+proportion to the time each caller spent in it.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+
+PROFILE_NAME = re.compile(r'^\d{8}T\d{6}\.\d{6}-[A-Za-z0-9_]+-[0-9a-f]{8}$')
+PROFILE_FILES = {'pstats': '.pstats', 'collapsed': '.collapsed', 'summary': '.json'}
+TOP_FUNCTIONS = 20
+MIN_STACK_MICROSECONDS = 1  # Call paths below this are left out of the collapsed file
+MAX_STACK_DEPTH = 200
+
+def function_label(function):
+    filename, line, name = function
+    if filename == '~':
+        return name  # Built-in, e.g. "<method 'execute' of 'sqlite3.Cursor' objects>"
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+def collapsed_stacks(stats):
+    """{'root;caller;callee': microseconds of own time} from a pstats caller graph"""
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+    stacks = {}
+
+    def walk(function, path, share):
+        own = stats.stats[function][2] * share
+        label = ';'.join(function_label(f) for f in path)
+        if own * 1e6 >= MIN_STACK_MICROSECONDS:
+            stacks[label] = stacks.get(label, 0) + own
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_cumulative in callees.get(function, ()):
+            total = stats.stats[callee][3]
+            callee_share = share * edge_cumulative / total if total else 0.0
+            if callee not in path and edge_cumulative * share * 1e6 >= MIN_STACK_MICROSECONDS:
+                walk(callee, path + (callee,), callee_share)
+
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            walk(function, (function,), 1.0)
+    return {stack: round(seconds * 1e6) for stack, seconds in stacks.items() if round(seconds * 1e6)}
+
+class ProfileRun:
+    """cProfile on the calling thread, until stop()"""
+
+    def __init__(self, endpoint):
+        self.endpoint = re.sub(r'[^A-Za-z0-9_]', '_', endpoint or 'unmatched')
+        self.started = time.time()
+        self.name = (time.strftime('%Y%m%dT%H%M%S', time.gmtime(self.started))
+                     + f'.{int(self.started % 1 * 1e6):06d}-{self.endpoint}-{uuid.uuid4().hex[:8]}')
+        self.profile = cProfile.Profile()
+        self.duration = None
+        self.profile.enable()
+
+    def stop(self):
+        if self.duration is None:
+            self.profile.disable()
+            self.duration = time.time() - self.started
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    """Slowest functions by cumulative time, as JSON-friendly dicts"""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        'function': function_label(function),
+        'calls': calls,
+        'own_ms': round(own * 1000, 3),
+        'cumulative_ms': round(cumulative * 1000, 3)
+    } for function, (_, calls, own, cumulative, _) in rows]
+
+class ProfileStore:
+    """Directory of saved profiles: NAME.pstats, NAME.collapsed and NAME.json"""
+
+    def __init__(self, directory, keep=50):
+        self.directory = directory
+        self.keep = keep
+
+    def start(self, endpoint):
+        return ProfileRun(endpoint)
+
+    def save(self, run, **details):
+        """Stop the run, write its files and drop profiles beyond the newest keep"""
+        run.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, run.name)
+        stats = pstats.Stats(run.profile)
+        stats.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w') as f:
+            for stack, microseconds in sorted(collapsed_stacks(stats).items()):
+                f.write(f'{stack} {microseconds}\n')
+        summary = dict(details, name=run.name, endpoint=run.endpoint,
+                       created=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(run.started)),
+                       duration_ms=round(run.duration * 1000, 3),
+                       calls=stats.total_calls,
+                       top_functions=top_functions(stats))
+        with open(base + '.json', 'w') as f:
+            json.dump(summary, f)
+        self.prune()
+        return summary
+
+    def names(self):
+        """Saved profile names, newest first"""
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((f[:-5] for f in files if f.endswith('.json') and PROFILE_NAME.match(f[:-5])), reverse=True)
+
+    def prune(self):
+        for name in self.names()[self.keep:]:
+            for suffix in PROFILE_FILES.values():
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass  # Pruned concurrently by another worker
+
+    def summaries(self):
+        result = []
+        for name in self.names():
+            try:
+                with open(os.path.join(self.directory, name + '.json')) as f:
+                    summary = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue  # Pruned or still being written
+            summary.pop('top_functions', None)
+            result.append(summary)
+        return result
+
+    def path(self, name, kind):
+        """File of a saved profile, None for unknown names and kinds"""
+        if not PROFILE_NAME.match(name) or kind not in PROFILE_FILES:
+            return None
+        path = os.path.join(self.directory, name + PROFILE_FILES[kind])
+        return path if os.path.exists(path) else None
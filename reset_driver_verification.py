@@ -2,7 +2,9 @@
 """
 Reset all drivers to unverified status for proper admin verification testing
 """
-from movers import app, db, Driver, User
+from models import db, Driver, User, script_app
+
+app = script_app()
 
 def reset_driver_verification():
     """Reset all drivers to unverified status"""
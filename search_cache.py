@@ -0,0 +1,92 @@
+"""
+Short-lived cache of driver search candidates per geohash cell
+Customers searching from the same ~150 m cell within a few seconds share one
+spatial lookup. Entries hold the candidate driver records only; distances,
+ETAs and prices are still computed for each request's exact pickup point, and
+entries are dropped as soon as a nearby driver's availability changes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from geo_index import haversine_km
+
+class SearchCache:
+    """TTL + LRU map of (geohash, vehicle_type, radius_km, limit) -> candidates
+
+    Candidates are stored as (records, latitudes, longitudes) so a hit can be
+    ranked without touching the records again.
+    """
+
+    def __init__(self, ttl_seconds=5.0, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, centre_lat, centre_lng, reach_km, candidates)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+
+    def get(self, key, now=None):
+        """Return cached candidates, or None on a miss"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[4]
+
+    def put(self, key, centre_lat, centre_lng, reach_km, candidates, now=None):
+        """Cache candidates found within reach_km of the cell centre"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, centre_lat, centre_lng, reach_km, candidates)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_driver(self, driver_id, latitude=None, longitude=None, now=None):
+        """Drop entries that contain the driver or whose search area covers its position"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            stale, expired = [], []
+            for key, (expires_at, centre_lat, centre_lng, reach_km, candidates) in self._entries.items():
+                if expires_at <= now:
+                    expired.append(key)  # Purged here so invalidation scans stay short
+                elif any(record.driver_id == driver_id for record in candidates[0]):
+                    stale.append(key)
+                elif latitude is not None and longitude is not None \
+                        and haversine_km(centre_lat, centre_lng, latitude, longitude) <= reach_km:
+                    stale.append(key)
+            for key in stale + expired:
+                del self._entries[key]
+            self.invalidated += len(stale)
+            self.expired += len(expired)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.invalidated += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'invalidated': self.invalidated,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'ttl_seconds': self.ttl_seconds
+            }
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Production server for the Moving App API (gunicorn, threaded workers)
+Usage: python serve.py [--bind HOST:PORT] [--workers N] [--threads N]
+
+The app is loaded once in the master process (preload) and forked into the
+workers, so tables, the admin account and the driver registry are prepared a
+single time. Each worker serves requests on a pool of threads, which also
+carries the long-lived SSE streams. Workers are recycled after
+WEB_MAX_REQUESTS requests (with jitter so they do not all restart at once).
+
+Signals to the master process:
+  HUP   re-read the configuration and gracefully replace every worker
+  TERM  graceful shutdown; in-flight requests get WEB_GRACEFUL_TIMEOUT seconds
+  TTIN / TTOU   add / remove one worker
+Because the app is preloaded, a code deploy needs a restart (or USR2 to start
+a new master alongside the old one, then QUIT to the old master).
+
+Several workers give more throughput, but live positions, the driver registry,
+search cache and SSE channels are kept in memory per process. Run one worker
+(and scale with threads) unless requests for the same driver or booking are
+routed to the same worker. Background dispatch runs in one worker at a time.
+"""
+import argparse
+import os
+
+from gunicorn.app.base import BaseApplication
+
+def default_options():
+    return {
+        'bind': os.getenv('WEB_BIND', '0.0.0.0:5000'),
+        'workers': int(os.getenv('WEB_WORKERS', '1')),
+        'threads': int(os.getenv('WEB_THREADS', '16')),
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'max_requests': int(os.getenv('WEB_MAX_REQUESTS', '10000')),
+        'max_requests_jitter': int(os.getenv('WEB_MAX_REQUESTS_JITTER', '1000')),
+        'timeout': int(os.getenv('WEB_TIMEOUT', '60')),
+        'graceful_timeout': int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30')),
+        'keepalive': int(os.getenv('WEB_KEEPALIVE', '5')),
+        'accesslog': os.getenv('WEB_ACCESS_LOG') or None,
+        'post_fork': post_fork,
+    }
+
+def post_fork(server, worker):
+    """Background threads do not survive fork, so each worker starts its own"""
+    from movers import ensure_dispatch_worker
+    ensure_dispatch_worker()
+
+class MoversServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from movers import create_app
+        return create_app()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bind')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads', type=int)
+    args = parser.parse_args()
+
+    options = default_options()
+    options.update({key: value for key, value in vars(args).items() if value is not None})
+    if options['workers'] > 1:
+        # Only the worker holding this lock runs the dispatch loop
+        instance_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+        os.makedirs(instance_dir, exist_ok=True)
+        os.environ.setdefault('DISPATCH_LOCK_FILE', os.path.join(instance_dir, 'dispatch.lock'))
+    # Leave threads for ordinary requests however many streams are open
+    os.environ.setdefault('STREAM_MAX_CLIENTS', str(max(1, options['threads'] // 2)))
+    print(f"[SERVER] {options['workers']} worker(s) x {options['threads']} threads on {options['bind']}")
+    MoversServer(options).run()
@@ -4,9 +4,11 @@ Real Escrow System - Uses Actual Customer Transactions
 Creates escrow records from real bookings and payments in the system
 """
 
-from movers import app, db, User, Driver, Booking, Escrow, Payment, Transaction
+from models import db, User, Driver, Booking, Escrow, Payment, Transaction, script_app
 from datetime import datetime, timezone
 
+app = script_app()
+
 def setup_real_escrow_data():
     """Create escrow records from real transactions in the system"""
     with app.app_context():
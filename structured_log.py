@@ -0,0 +1,196 @@
+"""
+Structured, non-blocking logging
+A record is an event name plus key/value fields, rendered as one logfmt (or
+JSON) line. Request threads only put records on a bounded queue; a listener
+thread formats, redacts and writes them, so a request never waits on stdout.
+When the queue is full new records are dropped and counted instead.
+
+DEBUG records are traces: they are kept for the requests picked by
+TraceSampler (per-route rates) and skipped before any work is done for the
+rest, so verbose traces can stay in hot paths.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+REDACTED = '***'
+SECRET_FIELDS = {'password', 'passkey', 'token', 'access_token', 'authorization',
+                 'security_credential', 'consumer_secret'}
+PHONE_FIELDS = {'phone', 'phone_number'}
+
+_tracing = contextvars.ContextVar('log_tracing', default=False)
+_queue_handler = None
+_listener = None
+
+def redact(key, value):
+    if key in SECRET_FIELDS:
+        return REDACTED
+    if key in PHONE_FIELDS and value:
+        value = str(value)
+        return '*' * (len(value) - 3) + value[-3:]
+    return value
+
+def logfmt_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    value = str(value)
+    if not value or any(c in value for c in ' ="\n\\'):
+        return json.dumps(value)
+    return value
+
+class EventFormatter(logging.Formatter):
+    """ts, level, logger and event, then the record's fields (redacted)"""
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        line = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        for key, value in getattr(record, 'fields', {}).items():
+            line[key] = redact(key, value)
+        if record.exc_text:
+            line['exc'] = record.exc_text
+        if self.json_lines:
+            return json.dumps(line, default=str)
+        return ' '.join(f'{key}={logfmt_value(value)}' for key, value in line.items())
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; never blocks the caller"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting is left to the listener; only resolve what may change meanwhile
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class EventLogger:
+    """Logger taking an event name and fields: log.info('stk_push.sent', booking_id=4)"""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    @property
+    def tracing(self):
+        """True when debug() would emit; guard loops that build trace fields"""
+        return _tracing.get() or self.logger.isEnabledFor(logging.DEBUG)
+
+    def _emit(self, level, event, fields, exc_info=None):
+        record = self.logger.makeRecord(self.logger.name, level, '', 0, event, None, exc_info,
+                                        extra={'fields': fields})
+        self.logger.handle(record)
+
+    def debug(self, event, **fields):
+        if self.tracing:
+            self._emit(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        if self.logger.isEnabledFor(logging.INFO):
+            self._emit(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self._emit(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._emit(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        """error() with the current exception's traceback"""
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._emit(logging.ERROR, event, fields, exc_info=sys.exc_info())
+
+def get_logger(name):
+    return EventLogger(name)
+
+class TraceSampler:
+    """Per-route trace rates from a spec like "search_drivers=0.01,book_driver=1,*=0" """
+
+    def __init__(self, spec=''):
+        self.rates = {}
+        self.default = 0.0
+        for part in filter(None, (item.strip() for item in spec.split(','))):
+            route, _, rate = part.partition('=')
+            if route.strip() == '*':
+                self.default = float(rate)
+            else:
+                self.rates[route.strip()] = float(rate)
+
+    def start(self, route):
+        """Decide whether the current request is traced; returns the decision"""
+        rate = self.rates.get(route, self.default)
+        sampled = rate >= 1 or (rate > 0 and random.random() < rate)
+        _tracing.set(sampled)
+        return sampled
+
+    def end(self):
+        _tracing.set(False)
+
+def configure_logging(level='INFO', json_lines=False, queue_size=10000, stream=None):
+    """Route the root logger through a queue to a background writer (idempotent)"""
+    global _queue_handler, _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _queue_handler is not None:
+        return
+    log_queue = queue.Queue(maxsize=queue_size)
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(EventFormatter(json_lines))
+    _queue_handler = DroppingQueueHandler(log_queue)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    logging.getLogger('httpx').setLevel(logging.WARNING)  # One INFO line per request otherwise
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=_restart_listener)
+
+def _restart_listener():
+    """The listener thread does not survive fork; forked server workers start their own"""
+    if _listener is not None:
+        log_queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)  # The parent's may hold a stale lock
+        _queue_handler.queue = _listener.queue = log_queue
+        _listener._thread = None
+        _listener.start()
+
+def stop_logging():
+    """Write out what is queued and stop the listener"""
+    if _listener is not None and _listener._thread is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            pass  # No room for the stop marker; the daemon thread dies with the process
+
+def logging_stats():
+    if _queue_handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _queue_handler.queue.qsize(), 'dropped': _queue_handler.dropped}
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
-from movers import app, db, User, Booking, Transaction, Driver
+from models import db, User, Booking, Transaction, Driver, script_app
+
+app = script_app()
 
 with app.app_context():
     print("Testing database access...")
@@ -4,10 +4,12 @@ Quick Test Script for Driver Wallet System
 Run this to verify the wallet system is working correctly
 """
 
-from movers import app, db, User, Driver, Booking, Escrow, Transaction
+from models import db, User, Driver, Booking, Escrow, Transaction, script_app
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 
+app = script_app()
+
 def test_driver_wallet_system():
     """Test the complete driver wallet system"""
     
@@ -4,6 +4,18 @@ Test script for M-Pesa payment processing
 import requests
 import json
 
+def get_quote(driver_id, pickup_location, dropoff_location, distance):
+    """Fetch the signed price quote for a driver from the search endpoint"""
+    response = requests.post(
+        "http://127.0.0.1:5000/api/user/search-drivers",
+        json={"pickup_location": pickup_location, "dropoff_location": dropoff_location, "distance": distance},
+        timeout=30
+    )
+    for driver in response.json().get("drivers", []):
+        if driver["driver_id"] == driver_id:
+            return driver["quote_id"]
+    return None
+
 def test_payment_endpoint():
     """Test the book-driver-mpesa endpoint"""
     url = "http://127.0.0.1:5000/api/user/book-driver-mpesa"
@@ -13,8 +25,7 @@ def test_payment_endpoint():
         "driver_id": 1,
         "pickup_location": "Nairobi CBD",
         "dropoff_location": "Westlands",
-        "distance": 5.5,
-        "price": 500,
+        "quote_id": get_quote(1, "Nairobi CBD", "Westlands", 5.5),
         "phone_number": "0712345678"
     }
     
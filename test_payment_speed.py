@@ -4,6 +4,18 @@ import requests
 import json
 import time
 
+def get_quote(driver_id, pickup_location, dropoff_location, distance):
+    """Fetch the signed price quote for a driver from the search endpoint"""
+    response = requests.post(
+        'http://localhost:5000/api/user/search-drivers',
+        json={'pickup_location': pickup_location, 'dropoff_location': dropoff_location, 'distance': distance},
+        timeout=10
+    )
+    for driver in response.json().get('drivers', []):
+        if driver['driver_id'] == driver_id:
+            return driver['quote_id']
+    return None
+
 def test_payment_speed():
     """Simulate a payment and measure response time"""
     
@@ -17,10 +29,8 @@ def test_payment_speed():
         'driver_id': 1,
         'pickup_location': 'Westlands',
         'dropoff_location': 'CBD',
-        'distance': 5.0,
-        'price': 15.0,
-        'phone_number': '0758670512',
-        'promo_code': None
+        'quote_id': get_quote(1, 'Westlands', 'CBD', 5.0),
+        'phone_number': '0758670512'
     }
     
     print(f"\n1. Initiating payment...")
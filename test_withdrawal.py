@@ -2,7 +2,9 @@
 """Test driver withdrawal functionality"""
 import requests
 import json
-from movers import app, db, Driver, User
+from models import db, Driver, User, script_app
+
+app = script_app()
 
 def test_withdrawal():
     print("="*60)